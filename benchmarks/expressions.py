@@ -0,0 +1,76 @@
+"""
+Micro-benchmark for code generation of deeply nested expressions.
+
+Builds a function assigning a chain of additions nested DEPTH levels deep, like "a + a + ... + a", for doubling
+depths and measures how long the code generator takes for it. The tree is built directly instead of parsing it, as
+the Earley parser is far slower than code generation for deep input. If code generation is linear in the size of the
+expression, the time per level stays about the same as the depth grows.
+
+Usage: python benchmarks/expressions.py [--depth N] [--steps N] [--repeat N]
+"""
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath("mcfunction_compiler")))
+
+from lark.lexer import Token
+
+from callgraph import CallGraph
+from codegeneration import CodeGenerator
+from constructs import Start, Namespace, NamespaceReference, VariableDeclaration, TypeReference, VariableReference, \
+    FunctionDeclaration, FunctionReference, ArgumentsDeclaration, Events, Block, ExpressionStatement, Assignment, \
+    AdditionOperation, Expression
+from visitor import NameResolver
+
+
+def variable() -> VariableReference:
+    return VariableReference(Token("IDENTIFIER", "a"))
+
+
+def build_program(depth: int) -> Start:
+    expression: Expression = variable()
+    for _ in range(depth):
+        expression = AdditionOperation(expression, variable())
+    function_ = FunctionDeclaration(FunctionReference(Token("IDENTIFIER", "f")), ArgumentsDeclaration([]), Events([]),
+                                    Block([ExpressionStatement(Assignment(variable(), expression))]))
+    return Start([
+        Namespace(NamespaceReference(Token("IDENTIFIER", "bench"))),
+        VariableDeclaration(TypeReference(Token("IDENTIFIER", "int")), variable()),
+        function_,
+    ])
+
+
+def generate(depth: int) -> float:
+    ast = build_program(depth)
+    ast.accept(NameResolver())
+    call_graph = CallGraph()
+    ast.accept(call_graph)
+    call_graph.analyse()
+    start = time.perf_counter()
+    ast.accept(CodeGenerator())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--depth", type=int, default=1_000, help="depth of the first chain")
+    parser.add_argument("--steps", type=int, default=5, help="number of times the depth is doubled")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # Every level of the tree takes a few frames in each visitor
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), args.depth * 2 ** args.steps * 10))
+    first = None
+    for step in range(args.steps + 1):
+        depth = args.depth * 2 ** step
+        best = min(generate(depth) for _ in range(args.repeat))
+        per_level = best / depth
+        first = first if first is not None else per_level
+        print(f"depth {depth:>7}: {best * 1000:8.1f} ms, {per_level * 1e6:6.2f} us per level "
+              f"({per_level / first:.2f}x the first)")
+
+
+if __name__ == "__main__":
+    main()
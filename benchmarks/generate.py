@@ -0,0 +1,114 @@
+"""
+Generates synthetic .mccode programs for benchmarking.
+
+The programs are random but deterministic for a given seed. They contain the number of functions and globals asked
+for, expressions of a fixed depth, blocks nested up to a fixed depth and a configurable share of run statements, some
+of which call other generated functions.
+
+Usage: python benchmarks/generate.py [--functions N] [--globals N] [--statements N] [--depth D] [--nesting B]
+                                     [--run-density P] [--seed S] [-o FILE]
+"""
+import random
+import sys
+from argparse import ArgumentParser
+
+ARITHMETIC_OPERATORS = ["+", "-", "*", "/", "%"]
+COMPARISON_OPERATORS = ["==", "!=", "<", "<=", ">", ">="]
+# The random condition of a while loop might never become false, so every loop also counts its iterations
+MAX_LOOP_ITERATIONS = 4
+
+
+class ProgramGenerator:
+    def __init__(self, functions: int = 10, globals_: int = 10, statements: int = 10, depth: int = 2,
+                 nesting: int = 1, run_density: float = 0.2, seed: int = 0):
+        self.function_count: int = functions
+        self.global_count: int = globals_
+        self.statement_count: int = statements
+        self.depth: int = depth
+        self.nesting: int = nesting
+        self.run_density: float = run_density
+        self.random: random.Random = random.Random(seed)
+        self.lines: list = []
+        self.loop_count: int = 0
+
+    def generate(self) -> str:
+        self.lines = ["namespace bench;", ""]
+        self.loop_count = 0
+        for index in range(self.global_count):
+            self.lines.append(f"int g{index} = {self.random.randint(0, 100)};")
+        self.lines.append("")
+        for index in range(self.function_count):
+            events = " on minecraft:tick" if index == 0 else ""
+            self.lines.append(f"function f{index}(){events} {{")
+            self.statements(index, 1, self.statement_count)
+            self.lines.append("}")
+            self.lines.append("")
+        return "\n".join(self.lines)
+
+    def statements(self, function_index: int, level: int, count: int):
+        for _ in range(count):
+            self.statement(function_index, level)
+
+    def statement(self, function_index: int, level: int):
+        indent = "    " * level
+        choice = self.random.random()
+        if level <= self.nesting and choice < 0.25:
+            if self.random.random() < 0.3:
+                counter = f"l{self.loop_count}"
+                self.loop_count += 1
+                self.lines.append(f"{indent}int {counter} = 0;")
+                self.lines.append(f"{indent}while ({counter} < {MAX_LOOP_ITERATIONS} && {self.condition()}) {{")
+                self.lines.append(f"{indent}    {counter} = {counter} + 1;")
+            else:
+                self.lines.append(f"{indent}if ({self.condition()}) {{")
+            self.statements(function_index, level + 1, max(1, self.statement_count // 4))
+            self.lines.append(f"{indent}}}")
+        elif choice < 0.25 + self.run_density * 0.75:
+            self.lines.append(f"{indent}run \"{self.command(function_index)}\";")
+        else:
+            self.lines.append(f"{indent}{self.global_()} = {self.expression(self.depth)};")
+
+    def command(self, function_index: int) -> str:
+        # Only calling functions with a higher index keeps the call graph acyclic
+        if function_index + 1 < self.function_count and self.random.random() < 0.3:
+            return f"function bench:f{self.random.randrange(function_index + 1, self.function_count)}"
+        return f"say {self.random.randint(0, 1000)}"
+
+    def condition(self) -> str:
+        operator = self.random.choice(COMPARISON_OPERATORS)
+        return f"{self.expression(max(0, self.depth - 1))} {operator} {self.expression(0)}"
+
+    def expression(self, depth: int) -> str:
+        if depth == 0:
+            if self.random.random() < 0.6:
+                return self.global_()
+            return str(self.random.randint(1, 100))
+        operator = self.random.choice(ARITHMETIC_OPERATORS)
+        return f"({self.expression(depth - 1)} {operator} {self.expression(depth - 1)})"
+
+    def global_(self) -> str:
+        return f"g{self.random.randrange(self.global_count)}"
+
+
+def main():
+    parser = ArgumentParser(description="Generate a synthetic .mccode program")
+    parser.add_argument("--functions", type=int, default=10)
+    parser.add_argument("--globals", type=int, default=10)
+    parser.add_argument("--statements", type=int, default=10, help="statements per function body")
+    parser.add_argument("--depth", type=int, default=2, help="depth of assigned expressions")
+    parser.add_argument("--nesting", type=int, default=1, help="maximum depth of nested if and while blocks")
+    parser.add_argument("--run-density", type=float, default=0.2, help="share of simple statements that are runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default=None, help="file to write the program to instead of stdout")
+    args = parser.parse_args()
+    program = ProgramGenerator(args.functions, args.globals, args.statements, args.depth, args.nesting,
+                               args.run_density, args.seed).generate()
+    if args.output is None:
+        sys.stdout.write(program)
+    else:
+        with open(args.output, "w") as file:
+            file.write(program)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Benchmark harness for the compiler.
+
+Compiles a set of synthetic programs, measures every pipeline phase and the number of generated commands, and compares
+the results with the stored baselines in baselines.json. The generated pack is then run for one load and one tick in
+the offline interpreter to count the commands and selector evaluations it executes. Exits with status 1 if any case got
+slower, used more memory, or generated or executed more commands than its baseline allows. Memory is traced with
+tracemalloc during every run, which slows down all phases by the same factor, so timings are only comparable with each
+other and with the baselines.
+
+Timings depend on the machine, so baselines should be recorded on the machine that runs the comparison
+(--update-baselines). Command counts are deterministic and any increase counts as a regression.
+
+Usage: python benchmarks/harness.py [--repeat N] [--threshold FRACTION] [--update-baselines] [--case NAME ...]
+"""
+import json
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, Any, List
+
+BENCHMARK_DIRECTORY = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCHMARK_DIRECTORY.parent.joinpath("mcfunction_compiler")))
+sys.path.insert(0, str(BENCHMARK_DIRECTORY))
+
+from lark import Lark
+
+from callgraph import CallGraph
+from codegeneration import CodeGenerator
+from generate import ProgramGenerator
+from instrumentation import PhaseTimer
+from interpreter import Interpreter
+from transformer import TreeTransformer
+from visitor import NameResolver
+
+GRAMMAR_PATH = BENCHMARK_DIRECTORY.parent.joinpath("mcfunction_compiler", "resources", "grammar.lark")
+BASELINES_PATH = BENCHMARK_DIRECTORY.joinpath("baselines.json")
+DEFAULT_THRESHOLD = 0.25
+# Phases shorter than this are too noisy to compare
+MINIMUM_COMPARED_TIME = 0.005
+
+# The Earley parser dominates compile time, so the programs are kept small enough to run the suite in about a minute
+CASES = {
+    "functions-2": dict(functions=2),
+    "functions-4": dict(functions=4),
+    "functions-8": dict(functions=8),
+    "globals-200": dict(functions=2, globals_=200),
+    "depth-4": dict(functions=2, depth=4),
+    "nesting-3": dict(functions=2, nesting=3),
+    "runs-80": dict(functions=4, run_density=0.8),
+}
+
+
+def compile_program(parser: Lark, code: str, timer: PhaseTimer) -> Dict[str, Any]:
+    with timer.phase("parse"):
+        tree = parser.parse(code)
+    with timer.phase("transform"):
+        ast = TreeTransformer().transform(tree)
+    with timer.phase("name resolution"):
+        ast.accept(NameResolver())
+    with timer.phase("call graph"):
+        call_graph = CallGraph()
+        ast.accept(call_graph)
+        call_graph.analyse()
+    with timer.phase("code generation"):
+        generator = CodeGenerator()
+        ast.accept(generator)
+    with timer.phase("serialization"):
+        files = list(generator.serialize())
+    interpreter = Interpreter()
+    interpreter.load_files(files)
+    interpreter.load()
+    interpreter.tick()
+    return {
+        "functions": len(generator.functions),
+        "commands": sum(len(code) for code in generator.functions.values()),
+        "bytes": sum(len(content) for _, content in files),
+        "executed_commands": interpreter.commands,
+        "selector_evaluations": interpreter.selectors,
+    }
+
+
+def run_case(parser: Lark, name: str, repeat: int) -> Dict[str, Any]:
+    code = ProgramGenerator(**CASES[name]).generate()
+    best: Dict[str, float] = {}
+    peak_memory = 0
+    output = None
+    for _ in range(repeat):
+        timer = PhaseTimer()
+        timer.start()
+        output = compile_program(parser, code, timer)
+        timer.stop()
+        for phase in timer.phases:
+            best[phase.name] = min(best.get(phase.name, phase.wall_time), phase.wall_time)
+            peak_memory = max(peak_memory, phase.peak_memory)
+    return {
+        "lines": code.count("\n") + 1,
+        "phases": best,
+        "total": sum(best.values()),
+        "peak_memory": peak_memory,
+        **output,
+    }
+
+
+def compare(name: str, result: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    for phase, time in result["phases"].items():
+        previous = baseline["phases"].get(phase)
+        if previous is not None and max(time, previous) >= MINIMUM_COMPARED_TIME and time > previous * (1 + threshold):
+            regressions.append(f"{name}: {phase} took {time * 1000:.1f} ms, baseline {previous * 1000:.1f} ms")
+    if result["peak_memory"] > baseline["peak_memory"] * (1 + threshold):
+        regressions.append(f"{name}: peak memory {result['peak_memory']} B, baseline {baseline['peak_memory']} B")
+    if result["commands"] > baseline["commands"]:
+        regressions.append(f"{name}: {result['commands']} commands generated, baseline {baseline['commands']}")
+    for metric in ("executed_commands", "selector_evaluations"):
+        if metric in baseline and result[metric] > baseline[metric]:
+            regressions.append(f"{name}: {result[metric]} {metric.replace('_', ' ')}, baseline {baseline[metric]}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Run the compiler benchmarks and compare them with the baselines")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per case, the fastest one counts")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown and memory growth as a fraction of the baseline")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--case", action="append", choices=sorted(CASES), help="only run these cases")
+    parser.add_argument("--json", action="store", metavar="FILE", default=None, help="also store the results in FILE")
+    args = parser.parse_args()
+
+    lark = Lark(GRAMMAR_PATH.read_text(), parser="earley")
+    baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+    results = {}
+    regressions = []
+    for name in args.case or CASES:
+        result = run_case(lark, name, args.repeat)
+        results[name] = result
+        print(f"{name}: {result['lines']} lines, {result['commands']} commands in {result['functions']} functions, "
+              f"{result['executed_commands']} executed, "
+              f"{result['total'] * 1000:.1f} ms, peak memory {result['peak_memory'] / 1024:.0f} KiB "
+              f"({result['total'] / result['lines'] * 1000:.2f} ms per line)")
+        if not args.update_baselines and name in baselines:
+            regressions += compare(name, result, baselines[name], args.threshold)
+
+    if args.json is not None:
+        Path(args.json).write_text(json.dumps(results, indent=4, sort_keys=True))
+    if args.update_baselines:
+        baselines.update(results)
+        BASELINES_PATH.write_text(json.dumps(baselines, indent=4, sort_keys=True) + "\n")
+        print(f"Baselines written to {BASELINES_PATH}")
+    elif regressions:
+        print("Regressions:", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Micro-benchmark for instruction serialization.
+
+Builds a pack of 100,000 instructions spread over 1,000 functions, with a mix of globals, static locals, stack frame
+locals and registers, and measures how long it takes to turn all function bodies into file contents. With --memory,
+it also compares the memory per instruction of the instruction objects with the encoded functions the code generator
+keeps.
+
+Usage: python benchmarks/serialization.py [--instructions N] [--functions N] [--repeat N] [--memory]
+"""
+import gc
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.joinpath("mcfunction_compiler")))
+
+from constructs import Namespace, NamespaceReference
+from codegeneration import CodeGenerator, NameManager
+from encoding import EncodedCode, OperandTable
+from instructions import Instruction, StoreInstruction, AdditionInstruction, ConditionalInstruction, \
+    ScoreMatchesCondition, CallInstruction, ScoreComparisonCondition, StoreConditionInstruction
+from symboltable import GlobalScope, BlockScope, IntType
+
+
+def build_functions(namespace: Namespace, instruction_count: int, function_count: int) -> Dict[str, List[Instruction]]:
+    functions = {}
+    globals_ = [GlobalScope.GlobalVariable(namespace, f"g{i}", IntType()) for i in range(50)]
+    name_manager = NameManager(namespace)
+    per_function = instruction_count // function_count
+    for index in range(function_count):
+        function = GlobalScope.GlobalFunction(namespace, f"f{index}")
+        function.recursive = index % 10 == 0
+        local = BlockScope.LocalVariable(namespace, "x", IntType(), function)
+        name_manager.function = function
+        code = []
+        for position in range(per_function):
+            # Registers are created fresh for every expression, like the code generator does
+            depth = position % 4
+            for _ in range(depth + 1):
+                register = name_manager.create_register(IntType())
+            for _ in range(depth + 1):
+                name_manager.free_register()
+            global_ = globals_[position % len(globals_)]
+            kind = position % 5
+            if kind == 0:
+                code.append(StoreInstruction(register, global_))
+            elif kind == 1:
+                code.append(AdditionInstruction(register, local))
+            elif kind == 2:
+                code.append(StoreConditionInstruction(local, ScoreComparisonCondition(register, "<", global_)))
+            elif kind == 3:
+                code.append(ConditionalInstruction([ScoreMatchesCondition(local, "1..")],
+                                                   CallInstruction(namespace, f"f{(index + 1) % function_count}")))
+            else:
+                code.append(StoreInstruction(global_, register))
+        functions[function.name] = code
+    return functions
+
+
+def build_pack(instruction_count: int, function_count: int) -> CodeGenerator:
+    namespace = Namespace(NamespaceReference("bench"))
+    namespace.name = "bench"
+    generator = CodeGenerator()
+    generator.namespace_ = namespace
+    for function_name, code in build_functions(namespace, instruction_count, function_count).items():
+        generator.add_function(function_name, code)
+    return generator
+
+
+def measure_memory(instruction_count: int, function_count: int):
+    namespace = Namespace(NamespaceReference("bench"))
+    namespace.name = "bench"
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    functions = build_functions(namespace, instruction_count, function_count)
+    objects = tracemalloc.get_traced_memory()[0] - start
+    operands = OperandTable()
+    encoded = {function_name: EncodedCode(operands, code) for function_name, code in functions.items()}
+    del functions
+    gc.collect()
+    compact = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    print(f"memory: {objects / instruction_count:.1f} bytes per instruction as objects, "
+          f"{compact / instruction_count:.1f} encoded ({len(operands.strings)} interned operands, "
+          f"{len(encoded)} functions)")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--instructions", type=int, default=100_000)
+    parser.add_argument("--functions", type=int, default=1_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--memory", action="store_true", help="also measure the memory per instruction")
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.repeat):
+        # A fresh pack for every run, so identifiers cached by a previous run don't count
+        generator = build_pack(args.instructions, args.functions)
+        start = time.perf_counter()
+        size = sum(len(generator.serialize_function(name)) for name in generator.functions)
+        timings.append(time.perf_counter() - start)
+    print(f"{args.instructions} instructions in {args.functions} functions, {size} bytes")
+    print(f"best {min(timings) * 1000:.1f} ms, median {sorted(timings)[len(timings) // 2] * 1000:.1f} ms")
+    if args.memory:
+        measure_memory(args.instructions, args.functions)
+
+
+if __name__ == "__main__":
+    main()
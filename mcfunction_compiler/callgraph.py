@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Set, Optional
+
+from constructs import Construct, Namespace, FunctionDeclaration, RunExpression, Call, WhileStatement
+from helper import FUNCTION_COMMAND
+from symboltable import Function
+from visitor import Visitor
+
+# Commands containing these depend on the executing entity or its position and can't run as the stack frame. Chat
+# commands show the name of the executing entity.
+CONTEXT_DEPENDENT = re.compile(r"@s|~|\^|(?:^|\brun\s+)(?:say|me|tell|msg|w)\b")
+
+
+class CallGraph(Visitor):
+    """
+    Collects which function calls which other functions and finds the functions that can be reentered.
+
+    Locals of functions that are part of a cycle in the call graph need a stack frame, all others get static slots.
+    Recursive functions whose commands (including those of their callees) don't depend on the executing entity run
+    their body as the stack frame, so locals can be addressed as @s.
+    Sliced loops and the statements after them can run in a later tick, scheduled as the server. Functions whose
+    sliced part depends on the executing entity are marked, so the CodeGenerator can reject them.
+    Must run after the NameResolver and before the CodeGenerator.
+    """
+
+    def __init__(self):
+        self.namespace_: Namespace = None
+        self.functions: Dict[str, Function] = {}
+        self.calls: Dict[str, Set[str]] = {}
+        self.context_dependent: Set[str] = set()
+        # What the sliced part of each function depends on itself, and which functions it calls
+        self.sliced_context_dependent: Set[str] = set()
+        self.sliced_calls: Dict[str, Set[str]] = {}
+        self.sliced: bool = False
+        self.components: List[List[str]] = []
+        self.function_: Optional[Function] = None
+
+    def __default__(self, construct: Construct):
+        for child in construct.children:
+            if isinstance(child, Construct):
+                child.accept(self)
+
+    def namespace(self, namespace: Namespace):
+        self.namespace_ = namespace
+
+    def function_declaration(self, declaration: FunctionDeclaration):
+        self.function_ = declaration.reference.target
+        self.functions[self.function_.name] = self.function_
+        self.calls.setdefault(self.function_.name, set())
+        for statement in declaration.block.statements:
+            if isinstance(statement, WhileStatement) and statement.slice_size is not None:
+                self.sliced = True
+            statement.accept(self)
+        self.sliced = False
+        self.function_ = None
+
+    def call(self, call: Call):
+        if self.function_ is not None and call.intrinsic is None:
+            self.add_call(self.function_, call.reference.name)
+        self.__default__(call)
+
+    def run_expression(self, expression: RunExpression):
+        if self.function_ is None:
+            return
+        if CONTEXT_DEPENDENT.search(expression.command):
+            self.add_context_dependent(self.function_)
+        for namespace, name in FUNCTION_COMMAND.findall(expression.command):
+            if namespace == self.namespace_.name:
+                self.add_call(self.function_, name)
+            else:
+                # We don't know what functions of other datapacks do
+                self.add_context_dependent(self.function_)
+
+    def add_call(self, caller: Function, callee_name: str):
+        self.calls.setdefault(caller.name, set()).add(callee_name)
+        if self.sliced:
+            self.sliced_calls.setdefault(caller.name, set()).add(callee_name)
+
+    def add_context_dependent(self, function_: Function):
+        self.context_dependent.add(function_.name)
+        if self.sliced:
+            self.sliced_context_dependent.add(function_.name)
+
+    def analyse(self):
+        """Marks every function that is part of a cycle as recursive and decides how its locals are addressed."""
+        self.components = self.strongly_connected_components()
+        # Tarjan's algorithm finds callees before their callers, so context dependence can be propagated in one pass
+        for component in self.components:
+            if any(callee in self.context_dependent
+                   for name in component for callee in self.callees(name) | {name}):
+                self.context_dependent.update(component)
+            if len(component) > 1 or component[0] in self.calls.get(component[0], ()):
+                for name in component:
+                    self.functions[name].recursive = True
+                    self.functions[name].runs_as_frame = name not in self.context_dependent
+        for name, function_ in self.functions.items():
+            function_.sliced_context_dependent = name in self.sliced_context_dependent or \
+                any(callee in self.context_dependent for callee in self.sliced_calls.get(name, ()))
+
+    def strongly_connected_components(self) -> List[List[str]]:
+        # Iterative version of Tarjan's algorithm, so deep call chains don't hit the recursion limit
+        index: Dict[str, int] = {}
+        lowlink: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+        components: List[List[str]] = []
+
+        for root in sorted(self.functions):
+            if root in index:
+                continue
+            work = [(root, iter(sorted(self.callees(root))))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(self.callees(child)))))
+                        break
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.remove(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(sorted(component))
+        return components
+
+    def callees(self, name: str) -> Set[str]:
+        """Returns the known functions called by the given function. Calls to unknown functions are ignored."""
+        return {callee for callee in self.calls.get(name, ()) if callee in self.functions}
+
+    def report(self) -> str:
+        lines = []
+        for name in sorted(self.functions):
+            if self.functions[name].recursive:
+                component = next(component for component in self.components if name in component)
+                addressing = "@s" if self.functions[name].runs_as_frame else "selector"
+                lines.append(f"{name}: stack frame, {addressing} (recursive via {', '.join(component)})")
+            else:
+                lines.append(f"{name}: static")
+        return "\n".join(lines)
@@ -1,8 +1,12 @@
 from __future__ import annotations
 
 import json
-from pathlib import Path
-from typing import List, Dict, Optional
+import math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Set, Tuple, Iterator, Callable
 
 from lark.lexer import Token
 
@@ -11,25 +15,101 @@ from constructs import FunctionDeclaration, Block, ArgumentsDeclaration, Constan
     Construct, ExpressionStatement, RunExpression, Assignment, AdditionOperation, VariableReference, OrOperation, \
     EqualityOperation, UnaryNotOperation, McfcNamespace, AndOperation, UnequalityOperation, LessThenOperation, \
     LessThenEqualsOperation, GreaterThenOperation, GreaterThenEqualsOperation, SubtractionOperation, \
-    MultiplicationOperation, DivisionOperation, UnaryPlusOperation, UnaryMinusOperation, ModuloOperation
-from instructions import StoreInstruction, RunInstruction, \
-    AdditionInstruction, EqualityInstruction, Instruction, InvertInstruction, \
-    CallIfZeroInstruction, CallIfNotZeroInstruction, LessThenInstruction, UnequalityInstruction, \
-    LessThenEqualsInstruction, GreaterThenEqualsInstruction, GreaterThenInstruction, SubtractionInstruction, \
-    MultiplicationInstruction, DivisionInstruction
-from symboltable import BuiltinType, BlockScope, Variable, Type
+    MultiplicationOperation, DivisionOperation, UnaryPlusOperation, UnaryMinusOperation, ModuloOperation, \
+    IfStatement, TwoSidedOperation, Expression, WhileStatement, ForStatement, Statement, Call, ReturnStatement, \
+    ArrayAccess, ArrayAssignment, SwitchStatement, SwitchCase
+from callgraph import FUNCTION_COMMAND
+from cost import FunctionSummary
+from encoding import OperandTable, EncodedCode
+from exception import InvalidSlicedLoopException
+from incremental import BuildCache
+from layout import GlobalLayout
+from instructions import StoreInstruction, RunInstruction, AdditionInstruction, Instruction, SubtractionInstruction, \
+    MultiplicationInstruction, DivisionInstruction, ModuloInstruction, CallInStackFrameInstruction, \
+    SummonStackFrameInstruction, IncreaseStackDepthInstruction, KillStackFrameInstruction, \
+    DecreaseStackDepthInstruction, Condition, ScoreComparisonCondition, ScoreMatchesCondition, \
+    ConditionalInstruction, StoreConditionInstruction, StoreResultInstruction, CallInstruction, bool_to_int, \
+    AddConstantInstruction, ScheduleInstruction, MinimumInstruction, MaximumInstruction, SwapInstruction, RUN, CALL
+from symboltable import BuiltinType, BlockScope, Variable, Type, Function, GlobalScope, BooleanType, IntType, \
+    CallRegister, ArrayType
+from profiledata import ProfileData
+from sourcemap import SourceLocation, SourceMap, SourceMapSpool, SOURCE_MAP_NAME
 from visitor import Visitor
+from writer import PackWriter, write_all
+
+COMPARISON_OPERATORS = {
+    EqualityOperation: ("=", False),
+    UnequalityOperation: ("=", True),
+    LessThenOperation: ("<", False),
+    LessThenEqualsOperation: ("<=", False),
+    GreaterThenOperation: (">", False),
+    GreaterThenEqualsOperation: (">=", False),
+}
+
+MIRRORED_OPERATORS = {"=": "=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+
+LOAD_EVENT = "minecraft:load"
+
+# Handlers up to this many commands are copied into merged event dispatchers instead of being called
+INLINE_HANDLER_LIMIT = 8
+# With profile data, hot functions up to this many commands are copied into their callers
+HOT_INLINE_LIMIT = 32
+# Array accesses with a dynamic index pass the index and the value of the element in these registers
+ARRAY_INDEX = CallRegister("index", IntType())
+ARRAY_VALUE = CallRegister("value", IntType())
+
+# Up to this many ranges of a switch are tested one after the other, splitting them wouldn't run fewer commands
+SWITCH_LEAF_SIZE = 4
+
+MATCHES_RANGES = {"=": "{value}", "<": "..{below}", "<=": "..{value}", ">": "{above}..", ">=": "{value}.."}
+
+
+def is_simple(expression: Expression) -> bool:
+    return isinstance(expression, (VariableReference, Constant))
+
+
+def is_pure(construct: Construct) -> bool:
+    """Returns whether evaluating an expression can't have side effects."""
+    if isinstance(construct, (RunExpression, Assignment, ArrayAssignment)):
+        return False
+    if isinstance(construct, Call) and construct.intrinsic in (None, "swap"):
+        return False
+    return all(is_pure(child) for child in construct.children if isinstance(child, Construct))
+
+
+def matches_range(low: Optional[int], high: Optional[int]) -> str:
+    """Returns the range argument of a "matches" test for low..high, where None is unbounded."""
+    if low is not None and low == high:
+        return str(low)
+    return f"{'' if low is None else low}..{'' if high is None else high}"
+
+
+def boolean_constant(value: bool) -> Constant:
+    return Constant(Token("BOOLEAN", "true" if value else "false"))
 
 
 class NameManager:
     def __init__(self, namespace: Namespace):
         self.registers: List[Variable] = []
-        self.function_count: int = 0
+        # Registers are created for every expression, but there are only a few distinct names per function
+        self.register_names: Dict[Tuple[Function, int], str] = {}
+        # Helpers are numbered per source function, so editing one function doesn't rename the helpers of others
+        self.function_counts: Dict[str, int] = {}
+        self.loop_counts: Dict[str, int] = {}
         self.namespace: Namespace = namespace
+        self.init_function: Function = GlobalScope.GlobalFunction(namespace, "init")
+        self.function: Function = self.init_function
 
     def create_register(self, type_: Type):
-        self.registers.append(BlockScope.LocalVariable(McfcNamespace(), f"r{len(self.registers)}", type_))
-        return self.registers[-1]
+        index = len(self.registers)
+        register = BlockScope.LocalVariable(McfcNamespace(), f"r{index}", type_, self.function)
+        key = (self.function, index)
+        if key in self.register_names:
+            register.compiled_name = self.register_names[key]
+        else:
+            self.register_names[key] = register.get_identifier()
+        self.registers.append(register)
+        return register
 
     def get_register(self, index: int = 0):
         return self.registers[-1 - index]
@@ -37,224 +117,994 @@ class NameManager:
     def free_register(self):
         self.registers.pop()
 
-    def create_function(self):
-        self.function_count += 1
-        return f"{self.function_count}"
+    def create_function(self) -> str:
+        count = self.function_counts.get(self.function.name, 0) + 1
+        self.function_counts[self.function.name] = count
+        return f"{self.function.name}.{count}"
+
+    def create_loop(self) -> int:
+        """Returns a number for the state of a sliced loop that is unique within the current function."""
+        count = self.loop_counts.get(self.function.name, 0) + 1
+        self.loop_counts[self.function.name] = count
+        return count
 
 
 class CodeGenerator(Visitor):
-    def __init__(self):
+    """
+    Generates the functions of the datapack. The source locations of commands are only recorded for the source map
+    when a source name or profile counts are given.
+
+    Normally all functions are kept until the pack is serialized. With a stream writer, the functions of every
+    declaration are serialized and written as soon as it was generated, and its body and code are released. Their
+    source map entries go to a temporary file. Small event handlers are kept until the event dispatchers were
+    created. The cost model needs all functions, so a summary is kept for every written function: its number of
+    commands and selectors, and the functions it calls. Memory doesn't grow with the number of commands, but it
+    still does with the number of functions and calls. Streaming can't be combined with a build cache or profile
+    data, which need the code of all functions.
+    """
+
+    def __init__(self, source_name: Optional[str] = None, profile_counts: Optional[Dict[str, int]] = None,
+                 cache: Optional[BuildCache] = None, layout: Optional[GlobalLayout] = None,
+                 stream: Optional[PackWriter] = None):
+        self.source_name: Optional[str] = source_name
+        # Decides where globals are stored, and which objectives the load function has to create for them
+        self.layout: Optional[GlobalLayout] = layout
+        # Receives the code generated for every function declaration, for the next build
+        self.cache: Optional[BuildCache] = cache
+        # Observed call counts per function. Without them no decision depends on how often code runs.
+        self.profile_counts: Optional[Dict[str, int]] = profile_counts
+        self.profile: Optional[ProfileData] = None
         self.namespace_: Namespace = None
-        self.functions: Dict[str, List[Instruction]] = {}
+        # Generated functions are stored encoded, their operands are shared by all of them
+        self.operands: OperandTable = OperandTable()
+        self.functions: Dict[str, EncodedCode] = {}
         self.variables: set = set()
-        self.events: Dict = {}
+        self.events: Dict[str, List[str]] = {}
+        self.tags: Dict[str, List[str]] = {}
         self.name_manager: Optional[NameManager] = None
+        self.function_body: Optional[Block] = None
+        # Whether each sliced loop of the current function is still running
+        self.sliced_loops: List[Variable] = []
+        self.origins: Dict[str, SourceLocation] = {}
+        # The code instructions are emitted to, a new list for every function
+        self.code: List[Instruction] = []
+        # Source locations are only needed for the source map and profile data, and visiting is a lot cheaper without
+        self.track_locations: bool = source_name is not None or profile_counts is not None
+        # Locations of the constructs that are being generated, the innermost one last
+        self.locations: List[SourceLocation] = []
+        self.global_arrays: List[Variable] = []
+        # Dispatch trees of global arrays that are called, they are only created once all functions are known
+        self.called_dispatchers: set = set()
+        self.stream: Optional[PackWriter] = stream
+        # What is left of the functions that were already written when streaming
+        self.summaries: Dict[str, FunctionSummary] = {}
+        self.written_source_map: Optional[SourceMapSpool] = SourceMapSpool() if stream is not None else None
+        # Event handlers that are kept when streaming, so they can be copied into dispatchers
+        self.kept_handlers: Set[str] = set()
 
-    def write_to_files(self, output_directory: Path):
-        with output_directory.joinpath("pack.mcmeta").open("w+") as pack_mcmeta:
-            metadata = {"pack": {
-                "pack_version": 1,
-                "description": "Generated by MCFunction compiler"
-            }}
-            json.dump(metadata, pack_mcmeta)
-        functions_dir = output_directory.joinpath("data").joinpath(self.namespace_.name).joinpath("functions")
-        functions_dir.mkdir(parents=True)
-        for function_name in self.functions:
-            with functions_dir.joinpath(f"{function_name}.mcfunction").open("w+") as function_file:
-                for instruction in self.functions[function_name]:
-                    function_file.write(instruction.to_string())
-                    function_file.write("\n")
+    def write_to_files(self, writer: PackWriter, jobs: int = 1):
+        write_all(writer, self.serialize(jobs), jobs)
+
+    def serialize(self, jobs: int = 1) -> Iterator[Tuple[str, bytes]]:
+        """
+        Yields the path and content of every file of the datapack. With more than one job, function files are
+        serialized by a pool of worker threads, but they are still yielded in the same order. Only a few functions
+        are serialized ahead of the one that is yielded, so the serialized bodies aren't all kept in memory at once.
+        """
+        if self.stream is None:
+            # Otherwise it was written first thing
+            yield "pack.mcmeta", self.pack_metadata()
+        if jobs <= 1:
+            for function_name in self.functions:
+                yield self.function_path(function_name), self.serialize_function(function_name)
+        else:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                pending = deque()
+                for function_name in self.functions:
+                    pending.append((self.function_path(function_name),
+                                    executor.submit(self.serialize_function, function_name)))
+                    # Enough to keep every worker busy while the oldest one is written
+                    if len(pending) > 2 * jobs:
+                        path, future = pending.popleft()
+                        yield path, future.result()
+                for path, future in pending:
+                    yield path, future.result()
+        for tag, values in self.tags.items():
+            namespace, name = tag.split(":")
+            yield f"data/{namespace}/tags/functions/{name}.json", json.dumps({"values": values}).encode()
+        if self.written_source_map is None:
+            yield SOURCE_MAP_NAME, self.source_map().to_json().encode()
+        else:
+            yield SOURCE_MAP_NAME, self.written_source_map.to_json(self.source_map()).encode()
+
+    @staticmethod
+    def pack_metadata() -> bytes:
+        metadata = {"pack": {
+            "pack_format": 1,
+            "description": "Generated by MCFunction compiler"
+        }}
+        return json.dumps(metadata).encode()
+
+    def function_path(self, function_name: str) -> str:
+        return f"data/{self.namespace_.name}/functions/{function_name}.mcfunction"
+
+    def source_map(self) -> SourceMap:
+        """Returns the source map of the functions that are kept, which are all of them unless streaming."""
+        source_map = SourceMap(self.source_name)
+        for function_name, code in self.functions.items():
+            name = f"{self.namespace_.name}:{function_name}"
+            source_map.lines[name] = code.source_locations()
+            if function_name in self.origins:
+                source_map.origins[name] = self.origins[function_name]
+        return source_map
+
+    def visit(self, name: str, construct: Construct):
+        function_count = len(self.functions)
+        attributed = self.track_locations and self.push_location(construct)
+        super().visit(name, construct)
+        if attributed:
+            self.locations.pop()
+        if self.cache is not None and isinstance(construct, FunctionDeclaration):
+            created = list(islice(self.functions, function_count, None))
+            self.cache.store(construct, {function_name: self.functions[function_name] for function_name in created},
+                             self.origins)
+
+    def push_location(self, construct: Construct) -> bool:
+        """
+        Attributes the instructions and functions generated until the location is popped again to the construct.
+        Constructs are nested, so everything ends up with the innermost construct that generated it. Returns whether
+        the construct has a location.
+        """
+        if construct.line is None or isinstance(construct, Start):
+            return False
+        if isinstance(construct, FunctionDeclaration):
+            function_name = construct.reference.name
+        else:
+            function_name = self.name_manager.function.name if self.name_manager is not None else None
+        self.locations.append(SourceLocation(construct.line, construct.column, construct.construct_name,
+                                             function_name))
+        return True
+
+    @contextmanager
+    def capture(self) -> Iterator[List[Instruction]]:
+        """Collects the instructions emitted inside the block in a new list, instead of the current code."""
+        code = self.code
+        self.code = []
+        try:
+            yield self.code
+        finally:
+            self.code = code
+
+    def emit(self, *instructions: Instruction):
+        """Appends instructions to the current code. Nothing is copied, so generating code is linear in its size."""
+        for instruction in instructions:
+            if instruction.source_location is None and self.locations:
+                instruction.source_location = self.locations[-1]
+            self.code.append(instruction)
+
+    def add_function(self, function_name: str, code: List[Instruction]):
+        if self.locations:
+            location = self.locations[-1]
+            self.origins.setdefault(function_name, location)
+            for instruction in code:
+                if instruction.source_location is None:
+                    instruction.source_location = location
+        self.functions[function_name] = EncodedCode(self.operands, code)
+
+    def serialize_function(self, function_name: str) -> bytes:
+        parts = []
+        self.functions[function_name].write(parts)
+        return "".join(parts).encode()
 
     def __default__(self, construct: Construct):
         raise Exception(construct)
 
     def start(self, start: Start):
-        start.code = []
-        for child in start.children:
-            child.accept(self)
-            start.code += child.code
-        self.functions["init"] = start.code
-        for function_ in self.functions:
-            print(f"{function_.upper()}:")
-            for instruction in self.functions[function_]:
-                print(instruction.to_string())
+        if self.stream is not None:
+            self.stream.write("pack.mcmeta", self.pack_metadata())
+        with self.capture() as init:
+            if self.layout is not None:
+                self.emit(*self.layout.setup())
+            for child in start.children:
+                child.accept(self)
+        self.functions["init"] = EncodedCode(self.operands, init)
+        for array in self.global_arrays:
+            for kind in ("get", "set"):
+                if f"{array.name}.{kind}" in self.called_dispatchers:
+                    self.dispatch_tree(f"{array.name}.{kind}", array, kind, 0, len(array.elements))
+        if self.profile is not None:
+            # Before dispatching events, so merged dispatchers copy handlers with their calls already inlined
+            self.inline_hot_calls()
+        self.dispatch_events()
+        if self.stream is not None:
+            self.kept_handlers.clear()
+            self.flush()
+
+    def dispatch_events(self):
+        """
+        Creates the function tags for all events.
+
+        Events with multiple handlers get a single dispatcher function that runs the handlers in declaration order, so
+        the server only has to run one function from the tag. The initialisation of global variables runs first on
+        load.
+        """
+        events = {event: list(dict.fromkeys(handlers)) for event, handlers in self.events.items()}
+        if self.functions["init"]:
+            events[LOAD_EVENT] = ["init"] + events.get(LOAD_EVENT, [])
+        for event, handlers in events.items():
+            if len(handlers) == 1:
+                self.tags[event] = [f"{self.namespace_.name}:{handlers[0]}"]
+                continue
+            dispatcher = f"event.{event.replace(':', '.')}"
+            code = EncodedCode(self.operands)
+            for handler in handlers:
+                # When streaming, handlers that are too long to copy were already written
+                if handler in self.functions and len(self.functions[handler]) <= self.inline_limit(handler):
+                    code.copy(self.functions[handler])
+                else:
+                    code.append(CallInstruction(self.namespace_, handler))
+            self.functions[dispatcher] = code
+            self.tags[event] = [f"{self.namespace_.name}:{dispatcher}"]
+
+    def inline_limit(self, function_name: str) -> int:
+        """Returns up to how many commands of a function are copied into a caller instead of calling it."""
+        if self.profile is None:
+            return INLINE_HANDLER_LIMIT
+        if self.profile.is_hot(function_name):
+            return HOT_INLINE_LIMIT
+        if self.profile.is_cold(function_name):
+            # Copying a single command is still smaller than calling it
+            return 1
+        return INLINE_HANDLER_LIMIT
+
+    def inline_hot_calls(self):
+        """
+        Replaces unconditional calls in hot functions with the body of the called function. A plain function call
+        runs with the same executor and position, so this is safe for all functions that can't call themselves.
+        """
+        for function_name, code in list(self.functions.items()):
+            if not self.profile.is_hot(function_name):
+                continue
+            inlined = EncodedCode(self.operands)
+            for index in range(len(code)):
+                callee = self.called_function(code, index)
+                if callee is not None and callee in self.functions and \
+                        len(self.functions[callee]) <= HOT_INLINE_LIMIT and not self.is_recursive(callee):
+                    inlined.copy(self.functions[callee])
+                else:
+                    inlined.copy(code, index, index + 1)
+            self.functions[function_name] = inlined
+
+    def called_function(self, code: EncodedCode, index: int) -> Optional[str]:
+        """Returns the name of the function an instruction calls unconditionally in this namespace, if any."""
+        if code.is_conditional(index):
+            return None
+        if code.opcodes[index] == CALL:
+            namespace, name = code.callee(index)
+            return name if namespace == self.namespace_.name else None
+        if code.opcodes[index] == RUN:
+            match = FUNCTION_COMMAND.fullmatch(code.operand(index))
+            if match and match.group(1) == self.namespace_.name:
+                return match.group(2)
+        return None
+
+    def is_recursive(self, function_name: str) -> bool:
+        visited = set()
+        pending = list(self.callees(function_name))
+        while pending:
+            callee = pending.pop()
+            if callee == function_name:
+                return True
+            if callee not in visited:
+                visited.add(callee)
+                pending += self.callees(callee)
+        return False
+
+    def callees(self, function_name: str) -> List[str]:
+        callees = []
+        code = self.functions.get(function_name)
+        for index in range(len(code) if code is not None else 0):
+            callee = code.callee(index)
+            if callee is not None:
+                callees.append(callee[1])
+            elif code.opcodes[index] == RUN:
+                callees += [name for namespace, name in FUNCTION_COMMAND.findall(code.operand(index))
+                            if namespace == self.namespace_.name]
+        return callees
 
     def namespace(self, namespace: Namespace):
         self.namespace_ = namespace
         self.name_manager = NameManager(namespace)
-        namespace.code = []
+        if self.profile_counts is not None:
+            self.profile = ProfileData(namespace.name, self.profile_counts)
 
     def variable_declaration(self, declaration: VariableDeclaration):
         if isinstance(declaration.type_ref.type, BuiltinType):
             self.variables.add(declaration.reference.name)
+        elif isinstance(declaration.type_ref.type, ArrayType):
+            if self.name_manager.function is self.name_manager.init_function:
+                self.global_arrays.append(declaration.reference.target)
         else:
             raise NotImplementedError
         if declaration.expression is not None:
             declaration.expression.accept(self)
-            declaration.code = declaration.expression.code
-            declaration.code.append(StoreInstruction(declaration.reference.target, self.name_manager.get_register()))
+            self.emit(StoreInstruction(declaration.reference.target, self.name_manager.get_register()))
             self.name_manager.free_register()
-        else:
-            declaration.code = []
 
     def constant(self, constant: Constant):
-        constant.code = [StoreInstruction(self.name_manager.create_register(constant.type), constant)]
+        self.emit(StoreInstruction(self.name_manager.create_register(constant.type), constant))
 
     def arguments(self, arguments: ArgumentsDeclaration):
-        arguments.code = []
-        for child in arguments.children:
-            child.accept(self)
-            arguments.code += child.code
+        function_ = self.name_manager.function
+        if function_.recursive:
+            # Runs after the stack frame was pushed, so the arguments end up in the frame of this call
+            self.emit(*[StoreInstruction(parameter, CallRegister(f"arg{index}", parameter.type))
+                        for index, parameter in enumerate(function_.parameters)])
+        # Otherwise callers store the arguments directly in the parameters
 
     def function_declaration(self, declaration: FunctionDeclaration):
-        declaration.arguments.accept(self)
-        declaration.block.accept(self)
-        code = declaration.arguments.code + declaration.block.code
-        self.functions[declaration.reference.name] = code
-        declaration.code = []
+        if declaration.cached is not None:
+            self.restore_function(declaration)
+            return
+        self.name_manager.function = declaration.reference.target
+        self.function_body = declaration.block
+        with self.capture() as code:
+            declaration.arguments.accept(self)
+            declaration.block.accept(self)
+        function_ = declaration.reference.target
+        if self.sliced_loops:
+            # A call while a loop waits for the next tick would restart it with the same static state
+            body_name = f"{declaration.reference.name}.body"
+            self.add_function(body_name, code)
+            code = [ConditionalInstruction([ScoreMatchesCondition(running, "1", True) for running in self.sliced_loops],
+                                           CallInstruction(self.namespace_, body_name))]
+            self.sliced_loops = []
+        if function_.recursive:
+            if function_.runs_as_frame:
+                # Resolve the stack frame selector once and run the body as the frame, so locals can use @s
+                body_name = f"{declaration.reference.name}.body"
+                self.add_function(body_name, code)
+                code = [CallInStackFrameInstruction(self.namespace_, body_name)]
+            code = [SummonStackFrameInstruction(), IncreaseStackDepthInstruction()] + code + \
+                [KillStackFrameInstruction(), DecreaseStackDepthInstruction()]
+        self.add_function(declaration.reference.name, code)
+        self.add_event_handlers(declaration)
+        self.name_manager.function = self.name_manager.init_function
+        self.function_body = None
+        if self.stream is not None:
+            self.release(declaration)
+
+    def release(self, declaration: FunctionDeclaration):
+        """Writes the functions generated for a declaration and releases them and its body, when streaming."""
+        function_name = declaration.reference.name
+        if declaration.event.events and len(self.functions[function_name]) <= self.inline_limit(function_name):
+            self.kept_handlers.add(function_name)
+        self.flush()
+        # The block's statements are its children, so this drops the whole tree below it
+        declaration.block.statements.clear()
+        # Operands of other functions are rarely shared, so a new table keeps it from growing with the pack
+        self.operands = OperandTable()
+
+    def flush(self):
+        """Serializes and writes all functions except the kept handlers, and releases their code."""
+        for function_name in [name for name in self.functions if name not in self.kept_handlers]:
+            self.stream.write(self.function_path(function_name), self.serialize_function(function_name))
+            code = self.functions.pop(function_name)
+            self.summaries[function_name] = FunctionSummary(self.namespace_.name, code)
+            self.written_source_map.add(f"{self.namespace_.name}:{function_name}", code.source_locations(),
+                                        self.origins.pop(function_name, None))
+
+    def restore_function(self, declaration: FunctionDeclaration):
+        """Uses the code a previous build generated for a declaration whose body the NameResolver skipped."""
+        functions = declaration.cached.restore(declaration.line)
+        self.functions.update({function_name: EncodedCode(self.operands, code)
+                               for function_name, code in functions.items()})
+        self.origins.update(declaration.cached.origins(declaration.line))
+        for function_name in functions:
+            self.called_dispatchers.update(self.callees(function_name))
+        self.add_event_handlers(declaration)
+
+    def add_event_handlers(self, declaration: FunctionDeclaration):
+        for event in declaration.event.events:
+            self.events.setdefault(f"{event.namespace.name}:{event.function.name}", []).append(
+                declaration.reference.name)
 
     def block(self, block: Block):
-        block.code = []
-        for statement in block.statements:
+        self.statements(block.statements, block is self.function_body)
+
+    def statements(self, statements: List[Statement], allow_sliced: bool):
+        for index, statement in enumerate(statements):
+            if allow_sliced and isinstance(statement, WhileStatement) and statement.slice_size is not None:
+                # The loop can take multiple ticks, so the rest of the function has to wait for it
+                attributed = self.track_locations and self.push_location(statement)
+                self.sliced_loop(statement, statements[index + 1:])
+                if attributed:
+                    self.locations.pop()
+                return
             statement.accept(self)
-            block.code += statement.code
 
     def expression_statement(self, statement: ExpressionStatement):
+        if isinstance(statement.expression, RunExpression):
+            # The result of the command isn't needed, so it doesn't have to be stored
+            self.emit(RunInstruction(statement.expression.command))
+            return
+        statement.expression.accept(self)
+        self.free_value(statement.expression)
+
+    def free_value(self, expression: Expression):
+        """Frees the register with the value of a discarded expression. Calls without a value don't have one."""
+        if expression.type is not None:
+            self.name_manager.free_register()
+
+    def if_statement(self, statement: IfStatement):
+        if statement.else_statement is None:
+            conditions, registers = self.condition(statement.condition)
+            self.free_registers(registers)
+            with self.capture() as then_code:
+                statement.then_statement.accept(self)
+            self.branch(conditions, then_code)
+        else:
+            # The then branch could change the operands of the condition, so the result has to be stored
+            result = self.name_manager.create_register(BooleanType())
+            self.store_condition(result, statement.condition)
+            with self.capture() as then_code:
+                statement.then_statement.accept(self)
+            with self.capture() as else_code:
+                statement.else_statement.accept(self)
+            self.branch([ScoreMatchesCondition(result, "0", True)], then_code)
+            self.branch([ScoreMatchesCondition(result, "0")], else_code)
+            self.name_manager.free_register()
+
+    def switch_statement(self, statement: SwitchStatement):
+        """
+        Compiles a switch to a balanced tree of "matches" tests, so a dispatch costs O(log n) commands in the number
+        of cases instead of testing every case.
+
+        The values of all cases are sorted into ranges of the same case. Values without a case run the default case,
+        so together with it the ranges cover all integers. Adjacent ranges of the same case are merged, as are cases
+        that compile to the same code. The value is stored in a register, so at most one case runs even if the cases
+        change the variables of the expression.
+        """
         statement.expression.accept(self)
-        statement.code = statement.expression.code
+        subject = self.name_manager.get_register()
+        bodies: Dict[Tuple[str, ...], int] = {}
+        actions: List[List[Instruction]] = []
+        ranges: List[Tuple[Optional[int], Optional[int], Optional[int]]] = []
+        default = None
+        for case in statement.cases:
+            with self.capture() as code:
+                case.accept(self)
+            if code:
+                key = tuple(instruction.to_string() for instruction in code)
+                action = bodies.setdefault(key, len(actions))
+                if action == len(actions):
+                    actions.append(code)
+            else:
+                # Empty cases run nothing, but still keep the default case from running
+                action = None
+            ranges += [(value, value, action) for value in case.values]
+            if case.default:
+                default = action
+        ranges.sort(key=lambda range_: range_[0])
+        if default is not None:
+            gaps = []
+            # The first value after the previous range, None is unbounded
+            start = None
+            for index, (low, high, _) in enumerate(ranges):
+                if index == 0 or start < low:
+                    gaps.append((start, low - 1, default))
+                start = high + 1
+            gaps.append((start, None, default))
+            ranges = sorted(ranges + gaps, key=lambda range_: -math.inf if range_[0] is None else range_[0])
+        merged = []
+        for low, high, action in ranges:
+            if merged and merged[-1][2] == action and merged[-1][1] is not None and merged[-1][1] + 1 == low:
+                merged[-1] = (merged[-1][0], high, action)
+            else:
+                merged.append((low, high, action))
+        for index, code in enumerate(actions):
+            if len(code) > 1:
+                # Shared by all ranges of the case, so it's only created once
+                function_name = self.name_manager.create_function()
+                self.add_function(function_name, code)
+                actions[index] = [CallInstruction(self.namespace_, function_name)]
+        self.switch_tree(subject, [range_ for range_ in merged if range_[2] is not None], actions)
+        self.name_manager.free_register()
+
+    def switch_case(self, case: SwitchCase):
+        case.block.accept(self)
+
+    def switch_tree(self, subject: Variable, ranges: List[Tuple[Optional[int], Optional[int], int]],
+                    actions: List[List[Instruction]]):
+        """Emits code that runs the action of the range the subject is in, testing each half of the ranges."""
+        if len(ranges) <= SWITCH_LEAF_SIZE:
+            halves = [[range_] for range_ in ranges]
+        else:
+            middle = len(ranges) // 2
+            halves = [ranges[:middle], ranges[middle:]]
+        for half in halves:
+            low, high = half[0][0], half[-1][1]
+            conditions = [ScoreMatchesCondition(subject, matches_range(low, high))] \
+                if low is not None or high is not None else []
+            if len(half) == 1:
+                self.branch(conditions, actions[half[0][2]])
+            else:
+                function_name = self.name_manager.create_function()
+                with self.capture() as code:
+                    self.switch_tree(subject, half, actions)
+                self.add_function(function_name, code)
+                self.emit(ConditionalInstruction(conditions, CallInstruction(self.namespace_, function_name)))
+
+    def while_statement(self, statement: WhileStatement):
+        if statement.slice_size is not None:
+            raise InvalidSlicedLoopException("Sliced loops must be statements of a function body")
+        self.loop(statement)
+
+    def for_statement(self, statement: ForStatement):
+        self.while_statement(statement)
+
+    def loop(self, statement: WhileStatement):
+        """Compiles a loop to a tail recursive function that runs the body and tests the condition again."""
+        self.loop_init(statement)
+        function_name = self.name_manager.create_function()
+        with self.capture() as check:
+            conditions, registers = self.condition(statement.condition)
+            self.free_registers(registers)
+            self.branch(conditions, [CallInstruction(self.namespace_, function_name)])
+        with self.capture() as body:
+            self.loop_body(statement)
+        self.add_function(function_name, body + check)
+        self.emit(*check)
+
+    def sliced_loop(self, statement: WhileStatement, continuation: List[Statement]):
+        """
+        Compiles a loop that runs at most slice_size iterations per tick.
+
+        After that many iterations the check function schedules itself for the next tick instead of continuing.
+        Because that returns to the caller, the statements after the loop are run by the check function once the
+        condition fails. Later ticks run as the server, so neither may depend on the executing entity. Calls of the
+        function while one of its loops is running are ignored, apart from the arguments they store.
+        """
+        function_ = self.name_manager.function
+        if function_.recursive:
+            raise InvalidSlicedLoopException(f"Sliced loops can't be used in recursive function '{function_.name}'")
+        if function_.sliced_context_dependent:
+            raise InvalidSlicedLoopException(f"Sliced loop of function '{function_.name}' depends on the executing "
+                                             f"entity, but later ticks run as the server")
+        if statement.slice_size < 1:
+            raise InvalidSlicedLoopException("Sliced loops must run at least one iteration per tick")
+        self.loop_init(statement)
+        check_name = self.name_manager.create_function()
+        step_name = self.name_manager.create_function()
+        slice_name = self.name_manager.create_function()
+        loop = self.name_manager.create_loop()
+        # Locals of non-recursive functions are static, so they survive until the next tick
+        running = BlockScope.LocalVariable(McfcNamespace(), f"loop{loop}", BooleanType(), function_)
+        self.sliced_loops.append(running)
+        iterations = BlockScope.LocalVariable(McfcNamespace(), f"loop{loop}.count", IntType(), function_)
+        # Nothing the check function calls writes running, so only one of its branches can run
+        with self.capture() as check:
+            self.store_condition(running, statement.condition)
+            with self.capture() as rest:
+                self.statements(continuation, True)
+            self.branch([ScoreMatchesCondition(running, "0")], rest)
+            self.emit(
+                ConditionalInstruction([ScoreMatchesCondition(running, "0", True),
+                                        ScoreMatchesCondition(iterations, f"{statement.slice_size}..")],
+                                       ScheduleInstruction(self.namespace_, slice_name, 1)),
+                ConditionalInstruction([ScoreMatchesCondition(running, "0", True),
+                                        ScoreMatchesCondition(iterations, f"..{statement.slice_size - 1}")],
+                                       CallInstruction(self.namespace_, step_name)),
+            )
+        self.add_function(check_name, check)
+        with self.capture() as step:
+            self.loop_body(statement)
+            self.emit(AddConstantInstruction(iterations, 1), CallInstruction(self.namespace_, check_name))
+        self.add_function(step_name, step)
+        with self.capture() as start_slice:
+            self.emit(StoreInstruction(iterations, Constant(Token("INT", "0"))),
+                      CallInstruction(self.namespace_, check_name))
+        self.add_function(slice_name, start_slice)
+        self.emit(*start_slice)
+
+    def loop_init(self, statement: WhileStatement):
+        if isinstance(statement, ForStatement) and statement.init is not None:
+            statement.init.accept(self)
+
+    def loop_body(self, statement: WhileStatement):
+        statement.body.accept(self)
+        if isinstance(statement, ForStatement) and statement.update is not None:
+            statement.update.accept(self)
+            self.free_value(statement.update)
+
+    def call(self, call: Call):
+        """
+        Calls a function. All arguments are evaluated before any of them is passed, as evaluating one can call the
+        same function again. A function that can't be reentered is never running when it is called, so its
+        parameters are fixed fake players the arguments are stored in directly. Reentrant functions get them in the
+        argument registers and copy them into their new stack frame. The result is returned in a register as well.
+        """
+        if call.intrinsic is not None:
+            self.intrinsic(call)
+            return
+        function_ = call.reference.target
+        values = []
+        registers = 0
+        for index, argument in enumerate(call.arguments):
+            # Variables and constants are read when they are passed, unless a later argument could change them
+            if is_simple(argument) and all(is_pure(later) for later in call.arguments[index + 1:]):
+                values.append(argument.target if isinstance(argument, VariableReference) else argument)
+            else:
+                argument.accept(self)
+                values.append(self.name_manager.get_register())
+                registers += 1
+        for index, (parameter, value) in enumerate(zip(function_.parameters, values)):
+            target = CallRegister(f"arg{index}", parameter.type) if function_.recursive else parameter
+            self.emit(StoreInstruction(target, value))
+        self.free_registers(registers)
+        self.emit(CallInstruction(self.namespace_, function_.name))
+        if function_.return_type is not None:
+            result = self.name_manager.create_register(function_.return_type)
+            self.emit(StoreInstruction(result, CallRegister("return", function_.return_type)))
+
+    def intrinsic(self, call: Call):
+        """
+        Compiles an intrinsic to the native scoreboard operations: "<" for min, ">" for max and "><" for swap. abs
+        multiplies negative values by -1, clamp is a max and a min. A constant bound is applied with a single
+        conditional set instead of storing it in a register first.
+        """
+        if call.intrinsic == "swap":
+            first, second = call.arguments
+            self.emit(SwapInstruction(first.target, second.target))
+            return
+        arguments = list(call.arguments)
+        if call.intrinsic in ("min", "max") and isinstance(arguments[0], Constant):
+            # Both are commutative, and the first operand is the one copied into the result
+            arguments.reverse()
+        arguments[0].accept(self)
+        result = self.name_manager.get_register()
+        if call.intrinsic == "abs":
+            self.emit(
+                StoreInstruction(self.name_manager.create_register(IntType()), Constant(Token("INT", "-1"))),
+                ConditionalInstruction([ScoreMatchesCondition(result, "..-1")],
+                                       MultiplicationInstruction(result, self.name_manager.get_register())),
+            )
+            self.name_manager.free_register()
+        else:
+            bounds = [(">", arguments[1]), ("<", arguments[2])] if call.intrinsic == "clamp" else \
+                [(">" if call.intrinsic == "max" else "<", arguments[1])]
+            for operator, bound in bounds:
+                self.bound(result, operator, bound)
+
+    def bound(self, result: Variable, operator: str, bound: Expression):
+        """Emits code that raises (">") or lowers ("<") the value of result to the bound, if it's beyond it."""
+        if isinstance(bound, Constant):
+            value = int(bound.value)
+            beyond = f"..{value - 1}" if operator == ">" else f"{value + 1}.."
+            self.emit(ConditionalInstruction([ScoreMatchesCondition(result, beyond)], StoreInstruction(result, bound)))
+            return
+        operation = MaximumInstruction if operator == ">" else MinimumInstruction
+        if isinstance(bound, VariableReference):
+            self.emit(operation(result, bound.target))
+            return
+        bound.accept(self)
+        self.emit(operation(result, self.name_manager.get_register()))
+        self.name_manager.free_register()
+
+    def return_statement(self, statement: ReturnStatement):
+        register = CallRegister("return", statement.expression.type)
+        if is_simple(statement.expression):
+            value = statement.expression
+            self.emit(StoreInstruction(register, value.target if isinstance(value, VariableReference) else value))
+            return
+        statement.expression.accept(self)
+        self.emit(StoreInstruction(register, self.name_manager.get_register()))
+        self.name_manager.free_register()
+
+    def array_access(self, access: ArrayAccess):
+        array = access.reference.target
+        if isinstance(access.index, Constant):
+            element = array.elements[int(access.index.value)]
+            self.emit(StoreInstruction(self.name_manager.create_register(access.type), element))
+            return
+        self.array_index(access)
+        self.emit(CallInstruction(self.namespace_, self.dispatcher(array, "get")),
+                  StoreInstruction(self.name_manager.create_register(access.type), ARRAY_VALUE))
+
+    def array_assignment(self, assignment: ArrayAssignment):
+        access = assignment.access
+        array = access.reference.target
+        assignment.expression.accept(self)
+        # The register stays allocated, it holds the value of the assignment expression
+        if isinstance(access.index, Constant):
+            self.emit(StoreInstruction(array.elements[int(access.index.value)], self.name_manager.get_register()))
+        else:
+            # The index may read an array itself, which overwrites ARRAY_VALUE, so it's stored after the index
+            self.array_index(access)
+            self.emit(StoreInstruction(ARRAY_VALUE, self.name_manager.get_register()),
+                      CallInstruction(self.namespace_, self.dispatcher(array, "set")))
+
+    def array_index(self, access: ArrayAccess):
+        """Emits the code storing a dynamic index in ARRAY_INDEX. Variables are copied without a register."""
+        if is_simple(access.index):
+            self.emit(StoreInstruction(ARRAY_INDEX, access.index.target))
+            return
+        access.index.accept(self)
+        self.emit(StoreInstruction(ARRAY_INDEX, self.name_manager.get_register()))
+        self.name_manager.free_register()
+
+    def dispatcher(self, array: Variable, kind: str) -> str:
+        """
+        Returns the function that reads ("get") or writes ("set") the element of an array at a dynamic index. It's
+        shared by all accesses, so it's created once. Local arrays get theirs with the function they belong to,
+        global ones once all functions were generated, and only if they are used.
+        """
+        if isinstance(array, GlobalScope.GlobalVariable):
+            function_name = f"{array.name}.{kind}"
+            self.called_dispatchers.add(function_name)
+        else:
+            function_name = f"{array.function.name}.{array.name}.{kind}"
+            if function_name not in self.functions:
+                self.dispatch_tree(function_name, array, kind, 0, len(array.elements))
+        return function_name
+
+    def dispatch_tree(self, root: str, array: Variable, kind: str, low: int, high: int) -> str:
+        """
+        Creates a function that accesses the element at the index in ARRAY_INDEX, if it's in low..high-1, and returns
+        its name. The range is halved with a "matches" test per half, so an access costs two commands per level of
+        the tree and O(log n) in total. Indices outside of the array match no element, so nothing is read or written.
+        """
+        function_name = root if (low, high) == (0, len(array.elements)) else f"{root}.{low}-{high - 1}"
+        code = []
+        middle = (low + high) // 2
+        for start, end in ((low, middle), (middle, high)):
+            if end - start == 1:
+                element = array.elements[start]
+                access = StoreInstruction(ARRAY_VALUE, element) if kind == "get" else \
+                    StoreInstruction(element, ARRAY_VALUE)
+                code.append(ConditionalInstruction([ScoreMatchesCondition(ARRAY_INDEX, str(start))], access))
+            elif end - start > 1:
+                child = self.dispatch_tree(root, array, kind, start, end)
+                code.append(ConditionalInstruction([ScoreMatchesCondition(ARRAY_INDEX, f"{start}..{end - 1}")],
+                                                   CallInstruction(self.namespace_, child)))
+        self.add_function(function_name, code)
+        return function_name
 
     def run_expression(self, expression: RunExpression):
-        expression.code = [RunInstruction(expression.command)]
+        self.emit(StoreResultInstruction(self.name_manager.create_register(expression.type), expression.command))
 
     def assignment(self, assignment: Assignment):
         assignment.expression.accept(self)
-        assignment.code = assignment.expression.code
-        assignment.code.append(StoreInstruction(assignment.ref.target, self.name_manager.get_register()))
-        self.name_manager.free_register()
+        # The register stays allocated, it holds the value of the assignment expression
+        self.emit(StoreInstruction(assignment.ref.target, self.name_manager.get_register()))
 
     def or_operation(self, operation: OrOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        function_name = self.name_manager.create_function()
-        operation.code = operation.left_expression.code + [
-            CallIfZeroInstruction(self.name_manager.get_register(), self.namespace_, function_name)
-        ]
-        self.functions[function_name] = operation.right_expression.code
-        self.name_manager.free_register()
+        self.short_circuit(operation, True)
 
     def and_operation(self, operation: AndOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        function_name = self.name_manager.create_function()
-        operation.code = operation.left_expression.code + [
-            CallIfNotZeroInstruction(self.name_manager.get_register(), self.namespace_, function_name)
-        ]
-        self.functions[function_name] = operation.right_expression.code
-        self.name_manager.free_register()
+        self.short_circuit(operation, False)
+
+    def short_circuit(self, operation: TwoSidedOperation, is_or: bool):
+        if is_pure(operation.right_expression):
+            self.branchless_short_circuit(operation, is_or)
+            return
+        result = self.name_manager.create_register(BooleanType())
+        conditions, registers = self.condition(operation.left_expression)
+        if is_or and len(conditions) == 1:
+            self.emit(StoreInstruction(result, boolean_constant(True)))
+            conditions = [conditions[0].negate()]
+        elif is_or:
+            # A chain of conditions can't be negated in a single execute command
+            self.store_conditions(result, conditions)
+            conditions = [ScoreMatchesCondition(result, "0")] if conditions else None
+        else:
+            self.emit(StoreInstruction(result, boolean_constant(False)))
+        self.free_registers(registers)
+        if conditions is not None:
+            with self.capture() as right:
+                self.store_condition(result, operation.right_expression)
+            self.branch(conditions, right)
+
+    def branchless_short_circuit(self, operation: TwoSidedOperation, is_or: bool):
+        """
+        Evaluates both sides unconditionally, which is only allowed if the right side has no side effects.
+
+        && becomes a single chain of conditions, || stores the left side and then the right side if the left side
+        was false. Neither needs a helper function.
+        """
+        result = self.name_manager.create_register(BooleanType())
+        left_conditions, left_registers = self.condition(operation.left_expression)
+        right_conditions, right_registers = self.condition(operation.right_expression)
+        if not is_or:
+            self.store_conditions(result, left_conditions + right_conditions)
+        else:
+            self.store_conditions(result, left_conditions)
+            left_failed = ScoreMatchesCondition(result, "0")
+            if len(right_conditions) == 1:
+                self.emit(ConditionalInstruction([left_failed], StoreConditionInstruction(result, right_conditions[0])))
+            else:
+                self.emit(ConditionalInstruction([left_failed] + right_conditions,
+                                                 StoreInstruction(result, boolean_constant(True))))
+        self.free_registers(right_registers + left_registers)
 
     def equality_operation(self, operation: EqualityOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            EqualityInstruction(self.name_manager.get_register(1), self.name_manager.get_register())
-        ]
-        self.name_manager.free_register()
+        self.boolean_value(operation)
 
     def unequality_operation(self, operation: UnequalityOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            UnequalityInstruction(self.name_manager.get_register(1), self.name_manager.get_register()),
-        ]
-        self.name_manager.free_register()
+        self.boolean_value(operation)
 
     def less_then_operation(self, operation: LessThenOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            LessThenInstruction(self.name_manager.get_register(1), self.name_manager.get_register()),
-        ]
-        self.name_manager.free_register()
+        self.boolean_value(operation)
 
     def less_then_equals_operation(self, operation: LessThenEqualsOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            LessThenEqualsInstruction(self.name_manager.get_register(1), self.name_manager.get_register()),
-        ]
-        self.name_manager.free_register()
+        self.boolean_value(operation)
 
     def greater_then_operation(self, operation: GreaterThenOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            GreaterThenInstruction(self.name_manager.get_register(1), self.name_manager.get_register()),
-        ]
-        self.name_manager.free_register()
+        self.boolean_value(operation)
 
     def greater_then_equals_operation(self, operation: GreaterThenEqualsOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            GreaterThenEqualsInstruction(self.name_manager.get_register(1), self.name_manager.get_register()),
-        ]
-        self.name_manager.free_register()
+        self.boolean_value(operation)
+
+    def boolean_value(self, expression: Expression):
+        result = self.name_manager.create_register(BooleanType())
+        self.store_condition(result, expression)
+
+    def condition(self, expression: Expression) -> Tuple[List[Condition], int]:
+        """
+        Compiles a boolean expression to conditions of an execute command instead of storing its value.
+
+        Emits the code that has to run before the conditions are tested, and returns the conditions and the number of
+        registers that have to be freed after the conditions have been used.
+        """
+        if type(expression) in COMPARISON_OPERATORS:
+            return self.comparison_condition(expression)
+        elif isinstance(expression, VariableReference):
+            return [ScoreMatchesCondition(expression.target, "0", True)], 0
+        elif isinstance(expression, Constant) and bool_to_int(expression.value) == 1:
+            return [], 0
+        elif isinstance(expression, UnaryNotOperation) and self.condition_count(expression.expression) == 1:
+            conditions, registers = self.condition(expression.expression)
+            return [conditions[0].negate()], registers
+        elif isinstance(expression, UnaryNotOperation):
+            expression.expression.accept(self)
+            return [ScoreMatchesCondition(self.name_manager.get_register(), "0")], 1
+        elif isinstance(expression, AndOperation) and is_pure(expression.right_expression):
+            # The right side has no side effects, so it can be evaluated up front and tested in the same command
+            left_conditions, left_registers = self.condition(expression.left_expression)
+            right_conditions, right_registers = self.condition(expression.right_expression)
+            return left_conditions + right_conditions, left_registers + right_registers
+        else:
+            expression.accept(self)
+            return [ScoreMatchesCondition(self.name_manager.get_register(), "0", True)], 1
+
+    def condition_count(self, expression: Expression) -> int:
+        """Returns the number of conditions self.condition() compiles the expression to."""
+        if isinstance(expression, Constant) and bool_to_int(expression.value) == 1:
+            return 0
+        elif isinstance(expression, AndOperation) and is_pure(expression.right_expression):
+            return self.condition_count(expression.left_expression) + \
+                self.condition_count(expression.right_expression)
+        return 1
+
+    def condition_needs_code(self, expression: Expression) -> bool:
+        """Returns whether self.condition() has to emit code to test the expression."""
+        if type(expression) in COMPARISON_OPERATORS:
+            return not (is_simple(expression.left_expression) and is_simple(expression.right_expression))
+        elif isinstance(expression, VariableReference):
+            return False
+        elif isinstance(expression, Constant):
+            return bool_to_int(expression.value) == 0
+        elif isinstance(expression, UnaryNotOperation):
+            return self.condition_count(expression.expression) != 1 or \
+                self.condition_needs_code(expression.expression)
+        elif isinstance(expression, AndOperation):
+            return self.condition_needs_code(expression.left_expression) or \
+                self.condition_needs_code(expression.right_expression)
+        return True
+
+    def comparison_condition(self, operation: TwoSidedOperation) -> Tuple[List[Condition], int]:
+        left, right = operation.left_expression, operation.right_expression
+        operator, negated = COMPARISON_OPERATORS[type(operation)]
+        if isinstance(left, Constant) and not isinstance(right, Constant):
+            left, right = right, left
+            operator = MIRRORED_OPERATORS[operator]
+        # Variables can only be read directly if the other side can't change them
+        direct = is_simple(left) and is_simple(right)
+        registers = 0
+        operands = []
+        for operand in (left, right):
+            if isinstance(operand, VariableReference) and direct:
+                operands.append(operand.target)
+            elif isinstance(operand, Constant) and operands:
+                operands.append(operand)
+            else:
+                operand.accept(self)
+                registers += 1
+                operands.append(self.name_manager.get_register())
+        if isinstance(operands[1], Constant):
+            value = int(operands[1].value) if operands[1].type == IntType() else bool_to_int(operands[1].value)
+            condition = ScoreMatchesCondition(operands[0], MATCHES_RANGES[operator].format(value=value,
+                                                                                        below=value - 1,
+                                                                                        above=value + 1))
+        else:
+            condition = ScoreComparisonCondition(operands[0], operator, operands[1])
+        return [condition.negate() if negated else condition], registers
+
+    def store_condition(self, target: Variable, expression: Expression):
+        conditions, registers = self.condition(expression)
+        self.store_conditions(target, conditions)
+        self.free_registers(registers)
+
+    def store_conditions(self, target: Variable, conditions: List[Condition]):
+        if not conditions:
+            self.emit(StoreInstruction(target, boolean_constant(True)))
+        elif len(conditions) == 1:
+            condition = conditions[0]
+            if isinstance(condition, ScoreMatchesCondition) and condition.negated and condition.range == "0" and \
+                    condition.variable.type == BooleanType():
+                # Testing a boolean for not being 0 is the boolean itself
+                self.emit(StoreInstruction(target, condition.variable))
+            else:
+                self.emit(StoreConditionInstruction(target, condition))
+        else:
+            # If one condition of a chain fails the store isn't executed at all
+            self.emit(StoreInstruction(target, boolean_constant(False)))
+            self.branch(conditions, [StoreInstruction(target, boolean_constant(True))])
+
+    def branch(self, conditions: List[Condition], code: List[Instruction]):
+        """Emits code that only executes the given code if all conditions are met."""
+        if not code:
+            return
+        if not conditions:
+            self.emit(*code)
+        elif len(code) == 1:
+            # Single commands can be run directly by the execute command
+            if isinstance(code[0], ConditionalInstruction):
+                self.emit(ConditionalInstruction(conditions + code[0].conditions, code[0].instruction))
+            else:
+                self.emit(ConditionalInstruction(conditions, code[0]))
+        else:
+            function_name = self.name_manager.create_function()
+            self.add_function(function_name, code)
+            self.emit(ConditionalInstruction(conditions, CallInstruction(self.namespace_, function_name)))
+
+    def free_registers(self, count: int):
+        for _ in range(count):
+            self.name_manager.free_register()
 
     def addition_operation(self, operation: AdditionOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            AdditionInstruction(self.name_manager.get_register(1), self.name_manager.get_register())
-        ]
-        self.name_manager.free_register()
+        self.binary_operation(operation, AdditionInstruction)
 
     def subtraction_operation(self, operation: SubtractionOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            SubtractionInstruction(self.name_manager.get_register(1), self.name_manager.get_register())
-        ]
-        self.name_manager.free_register()
+        self.binary_operation(operation, SubtractionInstruction)
 
     def multiplication_operation(self, operation: MultiplicationOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            MultiplicationInstruction(self.name_manager.get_register(1), self.name_manager.get_register())
-        ]
-        self.name_manager.free_register()
+        self.binary_operation(operation, MultiplicationInstruction)
 
     def division_operation(self, operation: DivisionOperation):
-        operation.left_expression.accept(self)
-        operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            DivisionInstruction(self.name_manager.get_register(1), self.name_manager.get_register())
-        ]
-        self.name_manager.free_register()
+        self.binary_operation(operation, DivisionInstruction)
 
     def modulo_operation(self, operation: ModuloOperation):
+        self.binary_operation(operation, ModuloInstruction)
+
+    def binary_operation(self, operation: TwoSidedOperation, instruction: Callable[[Variable, Variable], Instruction]):
+        """The result replaces the value of the left operand in its register."""
         operation.left_expression.accept(self)
         operation.right_expression.accept(self)
-        operation.code = operation.left_expression.code + operation.right_expression.code + [
-            ModuloInstruction(self.name_manager.get_register(1), self.name_manager.get_register())
-        ]
+        self.emit(instruction(self.name_manager.get_register(1), self.name_manager.get_register()))
         self.name_manager.free_register()
 
     def unary_plus_operation(self, operation: UnaryPlusOperation):
         operation.expression.accept(self)
-        operation.code = operation.expression.code
 
     def unary_minus_operation(self, operation: UnaryMinusOperation):
         operation.expression.accept(self)
-        operation.code = operation.expression.code + [
-            StoreInstruction(self.name_manager.get_register(), Constant(Token("INT", "-1"))),
-            MultiplicationInstruction(self.name_manager.get_register(1), self.name_manager.get_register())
-        ]
+        self.emit(StoreInstruction(self.name_manager.create_register(IntType()), Constant(Token("INT", "-1"))),
+                  MultiplicationInstruction(self.name_manager.get_register(1), self.name_manager.get_register()))
         self.name_manager.free_register()
 
     def unary_not_operation(self, operation: UnaryNotOperation):
-        operation.expression.accept(self)
-        operation.code = operation.expression.code + [InvertInstruction(self.name_manager.get_register())]
+        self.boolean_value(operation)
 
     def variable_ref(self, reference: VariableReference):
-        reference.code = [StoreInstruction(self.name_manager.create_register(reference.type), reference.target)]
+        self.emit(StoreInstruction(self.name_manager.create_register(reference.type), reference.target))
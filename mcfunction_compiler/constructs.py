@@ -10,7 +10,7 @@ from symboltable import IntType, BooleanType
 if TYPE_CHECKING:
     from typing import List, Any
     from lark.lexer import Token
-    from instructions import Instruction
+    from incremental import FunctionDependencies, CachedFunction
     from visitor import Visitor
 
 
@@ -19,7 +19,11 @@ class Construct(Tree):
 
     def __init__(self, children: List[Construct]):
         super().__init__(self.construct_name, children)
-        self.code: List[Instruction] = None
+        # Position in the source file, if the parser tracked positions
+        self.line: Optional[int] = None
+        self.column: Optional[int] = None
+        self.start_pos: Optional[int] = None
+        self.end_pos: Optional[int] = None
 
     def accept(self, visitor: Visitor):
         visitor.visit(self.construct_name, self)
@@ -61,9 +65,9 @@ class ArgumentsDeclaration(Construct):
 class ArgumentDeclaration(Construct):
     construct_name: str = "argument"
 
-    def __init__(self, type_: TypeReference, reference: VariableReference):
-        super().__init__([type_, reference])
-        self.type: TypeReference = type
+    def __init__(self, type_ref: TypeReference, reference: VariableReference):
+        super().__init__([type_ref, reference])
+        self.type_ref: TypeReference = type_ref
         self.reference: VariableReference = reference
 
 
@@ -90,12 +94,20 @@ class Event(Construct):
 class FunctionDeclaration(Construct):
     construct_name: str = "function_declaration"
 
-    def __init__(self, reference: FunctionReference, arguments: ArgumentsDeclaration, event: Event, block: Block):
+    def __init__(self, reference: FunctionReference, arguments: ArgumentsDeclaration, event: Event, block: Block,
+                 return_type: Optional[TypeReference] = None):
         super().__init__([x for x in [reference, arguments, block] if x is not None])
         self.reference: FunctionReference = reference
         self.arguments: ArgumentsDeclaration = arguments
         self.event: Event = event
         self.block: Block = block
+        self.return_type: Optional[TypeReference] = return_type
+        # Set by the NameResolver
+        self.dependencies: Optional[FunctionDependencies] = None
+        self.environment: Optional[dict] = None
+        self.storage: Optional[dict] = None
+        # Code of a previous build to use instead of generating the body again
+        self.cached: Optional[CachedFunction] = None
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} '{self.reference}'>"
@@ -139,6 +151,58 @@ class Block(Statement):
         self.statements: List[Statement] = statements
 
 
+class IfStatement(Statement):
+    construct_name: str = "if_statement"
+
+    def __init__(self, condition: Expression, then_statement: Statement, else_statement: Optional[Statement] = None):
+        super().__init__([x for x in [condition, then_statement, else_statement] if x is not None])
+        self.condition: Expression = condition
+        self.then_statement: Statement = then_statement
+        self.else_statement: Optional[Statement] = else_statement
+
+
+class WhileStatement(Statement):
+    construct_name: str = "while_statement"
+
+    def __init__(self, condition: Expression, body: Statement, slice_size: Optional[int] = None,
+                 children: Optional[List[Construct]] = None):
+        super().__init__(children if children is not None else [condition, body])
+        self.condition: Expression = condition
+        self.body: Statement = body
+        self.slice_size: Optional[int] = slice_size
+
+
+class ForStatement(WhileStatement):
+    construct_name: str = "for_statement"
+
+    def __init__(self, init: Optional[Statement], condition: Expression, update: Optional[Expression],
+                 body: Statement, slice_size: Optional[int] = None):
+        super().__init__(condition, body, slice_size,
+                         [x for x in [init, condition, update, body] if x is not None])
+        self.init: Optional[Statement] = init
+        self.update: Optional[Expression] = update
+
+
+class SwitchStatement(Statement):
+    construct_name: str = "switch_statement"
+
+    def __init__(self, expression: Expression, cases: List[SwitchCase]):
+        super().__init__([expression] + cases)
+        self.expression: Expression = expression
+        self.cases: List[SwitchCase] = cases
+
+
+class SwitchCase(Construct):
+    construct_name: str = "switch_case"
+
+    def __init__(self, values: List[int], default: bool, block: Block):
+        super().__init__([block])
+        self.values: List[int] = values
+        # Whether the case also runs for all values no other case has
+        self.default: bool = default
+        self.block: Block = block
+
+
 class Expression(Construct):
     construct_name: str = "expression"
 
@@ -156,6 +220,24 @@ class Assignment(Expression):
         self.expression: Expression = expression
 
 
+class ArrayAccess(Expression):
+    construct_name: str = "array_access"
+
+    def __init__(self, reference: VariableReference, index: Expression):
+        super().__init__([reference, index])
+        self.reference: VariableReference = reference
+        self.index: Expression = index
+
+
+class ArrayAssignment(Expression):
+    construct_name: str = "array_assignment"
+
+    def __init__(self, access: ArrayAccess, expression: Expression):
+        super().__init__([access, expression])
+        self.access: ArrayAccess = access
+        self.expression: Expression = expression
+
+
 class TwoSidedOperation(Expression):
     construct_name: str = "two_sided_operation"
 
@@ -249,6 +331,20 @@ class RunExpression(Expression):
         return f"<{self.__class__.__name__} '{self.command}'>"
 
 
+class Call(Expression):
+    construct_name: str = "call"
+
+    def __init__(self, reference: FunctionReference, arguments: List[Expression]):
+        super().__init__([reference] + arguments)
+        self.reference: FunctionReference = reference
+        self.arguments: List[Expression] = arguments
+        # Set by the NameResolver if the call is an intrinsic instead of a function
+        self.intrinsic: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} '{self.reference.name}'>"
+
+
 class Constant(Expression):
     construct_name: str = "constant"
 
@@ -282,8 +378,10 @@ class Reference(Construct):
 class TypeReference(Reference):
     construct_name: str = "type_ref"
 
-    def __init__(self, name):
+    def __init__(self, name, size: Optional[int] = None):
         super().__init__(name)
+        # Number of elements, if this is an array type
+        self.size: Optional[int] = size
         self.type: Type = None
 
 
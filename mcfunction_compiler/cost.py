@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import math
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from callgraph import FUNCTION_COMMAND
+from constructs import Namespace
+from encoding import EncodedCode
+from instructions import CALL, CALL_IN_FRAME, RUN
+
+TICK_EVENT = "minecraft:tick"
+DEFAULT_MAX_COMMAND_CHAIN_LENGTH = 65536
+SELECTOR = re.compile(r"@e\[")
+CONDITIONAL_COMMAND = re.compile(r"^execute\s.*\b(if|unless)\b")
+
+
+class Cost:
+    """Bounds for the number of commands and @e selector evaluations of one function call."""
+
+    def __init__(self, min_commands: float = 0, max_commands: float = 0, min_selectors: float = 0,
+                 max_selectors: float = 0):
+        self.min_commands: float = min_commands
+        self.max_commands: float = max_commands
+        self.min_selectors: float = min_selectors
+        self.max_selectors: float = max_selectors
+
+    def __add__(self, other: Cost) -> Cost:
+        return Cost(self.min_commands + other.min_commands, self.max_commands + other.max_commands,
+                    self.min_selectors + other.min_selectors, self.max_selectors + other.max_selectors)
+
+    def optional(self) -> Cost:
+        """Returns the cost of something that only runs if a condition is met."""
+        return Cost(0, self.max_commands, 0, self.max_selectors)
+
+    def is_bounded(self) -> bool:
+        return self.max_commands != math.inf
+
+
+UNBOUNDED = Cost(0, math.inf, 0, math.inf)
+
+
+class FunctionSummary:
+    """What the cost model needs to know about a generated function, so its code doesn't have to be kept."""
+
+    def __init__(self, namespace: str, code: EncodedCode):
+        self.commands: int = len(code)
+        self.selectors: int = 0
+        self.selector_commands: int = 0
+        # The functions it calls, and whether the call only runs if a condition is met
+        self.calls: List[Tuple[str, bool]] = []
+        for index, command in enumerate(code.commands()):
+            selectors = len(SELECTOR.findall(command))
+            self.selectors += selectors
+            self.selector_commands += selectors > 0
+            conditional = code.is_conditional(index)
+            opcode = code.opcodes[index]
+            if opcode in (CALL, CALL_IN_FRAME):
+                self.calls.append((code.callee(index)[1], conditional))
+            elif opcode == RUN:
+                command = code.operand(index)
+                conditional = conditional or CONDITIONAL_COMMAND.match(command) is not None
+                self.calls += [(name, conditional) for namespace_, name in FUNCTION_COMMAND.findall(command)
+                               if namespace_ == namespace]
+
+
+class CostModel:
+    """
+    Estimates how many commands a call of a generated function executes, including the functions it calls.
+
+    Every instruction is one command. Calls inside a condition may or may not run, which gives the lower and upper
+    bound. Functions that can call themselves have no upper bound. Functions whose code was already released, like
+    the ones a streaming build wrote, are passed as summaries.
+    """
+
+    def __init__(self, namespace: Namespace, functions: Dict[str, EncodedCode], events: Dict[str, List[str]],
+                 summaries: Optional[Dict[str, FunctionSummary]] = None):
+        self.namespace: Namespace = namespace
+        self.summaries: Dict[str, FunctionSummary] = dict(summaries or {})
+        self.summaries.update({name: FunctionSummary(namespace.name, code) for name, code in functions.items()})
+        self.events: Dict[str, List[str]] = events
+        self.costs: Dict[str, Cost] = {}
+        self.in_progress: Set[str] = set()
+
+    def function_cost(self, name: str) -> Cost:
+        if name in self.costs:
+            return self.costs[name]
+        if name in self.in_progress:
+            return UNBOUNDED
+        self.in_progress.add(name)
+        summary = self.summaries[name]
+        cost = Cost(summary.commands, summary.commands, summary.selectors, summary.selectors)
+        for callee, conditional in summary.calls:
+            call_cost = self.call_cost(callee)
+            cost += call_cost.optional() if conditional else call_cost
+        self.in_progress.remove(name)
+        self.costs[name] = cost
+        return cost
+
+    def call_cost(self, name: str) -> Cost:
+        if name not in self.summaries:
+            return Cost()
+        return self.function_cost(name)
+
+    def selector_commands(self, name: str) -> int:
+        return self.summaries[name].selector_commands
+
+    def report(self) -> str:
+        lines = []
+        for name in sorted(self.summaries):
+            cost = self.function_cost(name)
+            line = f"{self.namespace.name}:{name}: {format_bounds(cost.min_commands, cost.max_commands)} commands, " \
+                f"{format_bounds(cost.min_selectors, cost.max_selectors)} selector evaluations per call"
+            selector_commands = self.selector_commands(name)
+            if selector_commands:
+                line += f" ({selector_commands} of {self.summaries[name].commands} commands use @e selectors)"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def warnings(self, tick_budget: float = math.inf,
+                 max_command_chain_length: int = DEFAULT_MAX_COMMAND_CHAIN_LENGTH) -> List[str]:
+        warnings = []
+        total = Cost()
+        for name in self.events.get(TICK_EVENT, []):
+            cost = self.function_cost(name)
+            total += cost
+            if not cost.is_bounded():
+                warnings.append(f"Tick function '{self.namespace.name}:{name}' can execute an unbounded number of "
+                                f"commands")
+            elif cost.max_commands > max_command_chain_length:
+                warnings.append(f"Tick function '{self.namespace.name}:{name}' can execute {cost.max_commands} "
+                                f"commands, more than maxCommandChainLength ({max_command_chain_length})")
+        if total.is_bounded() and total.max_commands > tick_budget:
+            warnings.append(f"Tick functions can execute {total.max_commands} commands per tick, more than the budget "
+                            f"of {tick_budget}")
+        return warnings
+
+
+def format_bounds(minimum: float, maximum: float) -> str:
+    if maximum == math.inf:
+        return f"{minimum}..unbounded"
+    if minimum == maximum:
+        return f"{minimum}"
+    return f"{minimum}..{maximum}"
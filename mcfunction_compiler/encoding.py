@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+from array import array
+from string import Formatter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from instructions import Instruction, TEMPLATES, RUN, CALL, CALL_IN_FRAME, SCHEDULE, STORE_SUCCESS
+from sourcemap import SourceLocation
+
+# Opcodes whose first operand is a function, as "namespace:name"
+CALLING_OPCODES = (CALL, CALL_IN_FRAME, SCHEDULE)
+
+
+def split_template(template: str) -> Tuple[str, str, str]:
+    """Splits a template into the text before {0}, between {0} and {1}, and after {1}."""
+    pieces = [""]
+    for text, field, _, _ in Formatter().parse(template):
+        pieces[-1] += text
+        if field is not None:
+            pieces.append("")
+    return pieces[0], pieces[1] if len(pieces) > 1 else "", pieces[2] if len(pieces) > 2 else ""
+
+
+# Commands are written as pieces of their templates and operands, which is faster than formatting the templates
+PIECES = [split_template(template) for template in TEMPLATES]
+
+
+class OperandTable:
+    """
+    The operands of all encoded functions.
+
+    Strings, like score identifiers, constants, function names and raw commands, are interned, as are source
+    locations. Index 0 is the empty string and no location. Conditions refer to a template like
+    "if score {0} matches {1}" and two strings. Registers are different in every function, so most conditions are
+    unique; they are appended to a flat array as three indices each instead of being interned. Condition list 0 is
+    empty, so a zero index means an instruction runs unconditionally.
+    """
+
+    def __init__(self):
+        self.strings: List[str] = [""]
+        self.string_indices: Dict[str, int] = {"": 0}
+        self.locations: List[Optional[SourceLocation]] = [None]
+        self.location_indices: Dict[tuple, int] = {}
+        # Condition list i are the triples in condition_operands[condition_offsets[i]:condition_offsets[i + 1]]
+        self.condition_offsets: array = array("I", [0, 0])
+        self.condition_operands: array = array("I")
+        # The pieces of the condition templates, by their string index. There are only a few different ones.
+        self.template_pieces: Dict[int, Tuple[str, str, str]] = {}
+
+    def intern(self, string: str) -> int:
+        index = self.string_indices.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.strings.append(string)
+            self.string_indices[string] = index
+        return index
+
+    def intern_location(self, location: Optional[SourceLocation]) -> int:
+        if location is None:
+            return 0
+        key = (location.line, location.column, location.construct, location.function)
+        index = self.location_indices.get(key)
+        if index is None:
+            index = len(self.locations)
+            self.locations.append(location)
+            self.location_indices[key] = index
+        return index
+
+    def add_conditions(self, conditions: List[Tuple[int, int, int]]) -> int:
+        index = len(self.condition_offsets) - 1
+        for condition in conditions:
+            self.condition_operands.extend(condition)
+        self.condition_offsets.append(len(self.condition_operands))
+        return index
+
+    def import_conditions(self, other: OperandTable, index: int) -> int:
+        """Adds a condition list of another table to this one and returns its index here."""
+        if not index:
+            return 0
+        strings = other.strings
+        return self.add_conditions([(self.intern(strings[template]), self.intern(strings[first]),
+                                     self.intern(strings[second]))
+                                    for template, first, second in other.conditions(index)])
+
+    def conditions(self, index: int) -> List[Tuple[int, int, int]]:
+        operands = self.condition_operands
+        return [(operands[position], operands[position + 1], operands[position + 2])
+                for position in range(self.condition_offsets[index], self.condition_offsets[index + 1], 3)]
+
+    def write_conditions(self, parts: List[str], index: int):
+        """Appends the subcommands of a condition list to parts, separated by spaces."""
+        strings = self.strings
+        operands = self.condition_operands
+        separator = ""
+        for position in range(self.condition_offsets[index], self.condition_offsets[index + 1], 3):
+            template = operands[position]
+            pieces = self.template_pieces.get(template)
+            if pieces is None:
+                pieces = self.template_pieces[template] = split_template(strings[template])
+            parts += separator, pieces[0], strings[operands[position + 1]], pieces[1], \
+                strings[operands[position + 2]], pieces[2]
+            separator = " "
+
+
+class EncodedCode:
+    """
+    The code of a generated function as an opcode byte array with parallel arrays of operand table indices, 17 bytes
+    per instruction instead of a tree of instruction and variable objects. Instructions are encoded as they are
+    added; the optimization passes, the cost model and the serializer work on the arrays.
+    """
+
+    def __init__(self, operands: OperandTable, instructions: Iterable[Instruction] = ()):
+        self.operands: OperandTable = operands
+        self.opcodes: bytearray = bytearray()
+        self.first: array = array("I")
+        # The conditions of a STORE_SUCCESS instruction, a string otherwise
+        self.second: array = array("I")
+        # The conditions a conditional instruction runs under, 0 if it always runs
+        self.conditions: array = array("I")
+        self.locations: array = array("I")
+        self.extend(instructions)
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def append(self, instruction: Instruction):
+        self.extend([instruction])
+
+    def extend(self, instructions: Iterable[Instruction]):
+        instructions = list(instructions)
+        if not instructions:
+            return
+        operands = self.operands
+        opcodes, first, second, conditions = zip(*[instruction.encode(operands) for instruction in instructions])
+        # Columns are added at once, so the arrays are not over-allocated for every instruction
+        self.opcodes += bytes(opcodes)
+        self.first += array("I", first)
+        self.second += array("I", second)
+        self.conditions += array("I", conditions)
+        # Without a source map, no instruction has a location
+        intern_location = operands.intern_location
+        self.locations += array("I", [0 if instruction.source_location is None
+                                      else intern_location(instruction.source_location)
+                                      for instruction in instructions])
+
+    def copy(self, other: EncodedCode, start: int = 0, end: Optional[int] = None):
+        """Appends the instructions start..end-1 of other code."""
+        if other.operands is not self.operands:
+            self.translate(other, start, end)
+            return
+        self.opcodes += other.opcodes[start:end]
+        self.first += other.first[start:end]
+        self.second += other.second[start:end]
+        self.conditions += other.conditions[start:end]
+        self.locations += other.locations[start:end]
+
+    def translate(self, other: EncodedCode, start: int, end: Optional[int]):
+        """Copies instructions of code with another operand table, whose operands have to be interned again."""
+        operands = self.operands
+        strings = other.operands.strings
+        for index in range(len(other))[start:end]:
+            opcode = other.opcodes[index]
+            self.opcodes.append(opcode)
+            self.first.append(operands.intern(strings[other.first[index]]))
+            self.second.append(operands.import_conditions(other.operands, other.second[index])
+                               if opcode == STORE_SUCCESS else operands.intern(strings[other.second[index]]))
+            self.conditions.append(operands.import_conditions(other.operands, other.conditions[index]))
+            self.locations.append(operands.intern_location(other.location(index)))
+
+    def command(self, index: int) -> str:
+        return self.format(self.opcodes[index], self.first[index], self.second[index], self.conditions[index])
+
+    def commands(self) -> Iterator[str]:
+        return map(self.format, self.opcodes, self.first, self.second, self.conditions)
+
+    def format(self, opcode: int, first: int, second: int, conditions: int) -> str:
+        parts = []
+        self.write_command(parts, opcode, first, second, conditions)
+        return "".join(parts)
+
+    def write(self, parts: List[str]):
+        """
+        Appends the commands to parts, each followed by a line break. The operands are decoded right into the output,
+        so no command or instruction is built as an object of its own.
+        """
+        strings = self.operands.strings
+        for opcode, first, second, conditions in zip(self.opcodes, self.first, self.second, self.conditions):
+            if conditions or opcode == STORE_SUCCESS:
+                self.write_command(parts, opcode, first, second, conditions)
+                parts.append("\n")
+            else:
+                # Most commands are unconditional, writing them inline saves a call per command
+                prefix, infix, suffix = PIECES[opcode]
+                parts += prefix, strings[first], infix, strings[second], suffix, "\n"
+
+    def write_command(self, parts: List[str], opcode: int, first: int, second: int, conditions: int):
+        prefix, infix, suffix = PIECES[opcode]
+        operand = self.operands.strings[first]
+        if conditions:
+            parts.append("execute ")
+            self.operands.write_conditions(parts, conditions)
+            # "execute ... run execute ..." is the same as a single execute with all subcommands
+            if prefix.startswith("execute "):
+                prefix = prefix[len("execute"):]
+            elif opcode == RUN and operand.startswith("execute "):
+                operand = operand[len("execute"):]
+            else:
+                prefix = f" run {prefix}"
+        if opcode == STORE_SUCCESS:
+            parts += prefix, operand, infix
+            self.operands.write_conditions(parts, second)
+            parts.append(suffix)
+        else:
+            parts += prefix, operand, infix, self.operands.strings[second], suffix
+
+    def operand(self, index: int) -> str:
+        """Returns the first operand of an instruction, the command of a RUN instruction for example."""
+        return self.operands.strings[self.first[index]]
+
+    def callee(self, index: int) -> Optional[Tuple[str, str]]:
+        """Returns the namespace and name of the function a call, scheduled call or call in a stack frame runs."""
+        if self.opcodes[index] not in CALLING_OPCODES:
+            return None
+        namespace, name = self.operand(index).split(":", 1)
+        return namespace, name
+
+    def is_conditional(self, index: int) -> bool:
+        return self.conditions[index] != 0
+
+    def location(self, index: int) -> Optional[SourceLocation]:
+        return self.operands.locations[self.locations[index]]
+
+    def source_locations(self) -> List[Optional[SourceLocation]]:
+        locations = self.operands.locations
+        return [locations[index] for index in self.locations]
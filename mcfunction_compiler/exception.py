@@ -20,6 +20,10 @@ class DuplicateVariableException(CompilerException):
     pass
 
 
+class DuplicateCaseException(CompilerException):
+    pass
+
+
 class UndeclaredVariableException(CompilerException):
     def __init__(self, name):
         self.name = name
@@ -37,6 +41,18 @@ class TypeMissmatchException(CompilerException):
     pass
 
 
+class InvalidSlicedLoopException(CompilerException):
+    pass
+
+
+class InvalidReturnException(CompilerException):
+    pass
+
+
+class InvalidIndexException(CompilerException):
+    pass
+
+
 class BadOperandException(CompilerException):
     def __init__(self, operand: str, *types: "Type"):
         if len(types) > 1:
@@ -44,3 +60,7 @@ class BadOperandException(CompilerException):
             super().__init__(f"Operand '{operand}' cannot be applied to types {types_string}")
         else:
             super().__init__(f"Operand '{operand}' cannot be applied to type '{types[0].name}'")
+
+
+class InterpreterException(Exception):
+    pass
@@ -1,3 +1,9 @@
+import re
+
+# A function command calling the function of the given namespace and name
+FUNCTION_COMMAND = re.compile(r"(?:^|\s)function\s+([a-z0-9_.\-]+):([a-z0-9_.\-/]+)")
+
+
 class Singleton(type):
     _instances = {}
     def __call__(cls, *args, **kwargs):
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, TYPE_CHECKING
+
+from instructions import RunInstruction, Instruction
+from sourcemap import SourceLocation
+
+if TYPE_CHECKING:
+    from constructs import FunctionDeclaration
+    from encoding import EncodedCode
+    from symboltable import Scope, Function
+
+CACHE_NAME = ".mcfc-cache.json"
+# Bump whenever the generated code changes, so caches of older versions aren't used
+CACHE_VERSION = 2
+
+
+class FunctionDependencies:
+    """Everything declared outside of a function that its body refers to."""
+
+    def __init__(self):
+        self.globals_read: Set[str] = set()
+        self.globals_written: Set[str] = set()
+        self.functions_called: Set[str] = set()
+        self.types_used: Set[str] = set()
+
+    def environment(self, scope: Scope) -> Dict[str, Dict[str, Optional[str]]]:
+        """Describes what the dependencies resolve to in the given scope. The generated code only changes with it."""
+        return {
+            "globals": {name: scope.get_variable(name).type.name if scope.has_variable(name) else None
+                        for name in sorted(self.globals_read | self.globals_written)},
+            "types": {name: scope.get_type(name).name if scope.has_type(name) else None
+                      for name in sorted(self.types_used)},
+            "functions": {name: signature(scope.get_function(name)) if scope.has_function(name) else None
+                          for name in sorted(self.functions_called)},
+        }
+
+    def storage(self, function_: Function, scope: Scope) -> Dict[str, Any]:
+        """
+        Describes how the function and the functions it calls store their locals. Arguments of reentrant functions
+        are passed differently, so the code of a caller changes with it as well. Also records whether its sliced loops
+        depend on the executing entity, which depends on its callees and makes it fail to compile.
+        """
+        return {
+            "recursive": function_.recursive,
+            "runs_as_frame": function_.runs_as_frame,
+            "sliced_context_dependent": function_.sliced_context_dependent,
+            "reentrant_callees": sorted(name for name in self.functions_called
+                                        if scope.has_function(name) and scope.get_function(name).recursive),
+        }
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return {
+            "globals_read": sorted(self.globals_read),
+            "globals_written": sorted(self.globals_written),
+            "functions_called": sorted(self.functions_called),
+            "types_used": sorted(self.types_used),
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, List[str]]) -> FunctionDependencies:
+        dependencies = FunctionDependencies()
+        dependencies.globals_read = set(data["globals_read"])
+        dependencies.globals_written = set(data["globals_written"])
+        dependencies.functions_called = set(data["functions_called"])
+        dependencies.types_used = set(data["types_used"])
+        return dependencies
+
+
+class CachedFunction:
+    """The functions generated for one function declaration by a previous build."""
+
+    def __init__(self, data: dict):
+        self.text: str = data["text"]
+        self.environment: dict = data["environment"]
+        self.storage: Dict[str, Any] = data["storage"]
+        self.dependencies: FunctionDependencies = FunctionDependencies.from_dict(data["dependencies"])
+        self.functions: List[dict] = data["functions"]
+
+    def restore(self, line: int) -> Dict[str, List[Instruction]]:
+        """Returns the generated functions with their source locations moved to a declaration starting at line."""
+        functions = {}
+        for function in self.functions:
+            code = []
+            for command, location in zip(function["commands"], function["locations"]):
+                instruction = RunInstruction(command)
+                instruction.source_location = relocate(location, line)
+                code.append(instruction)
+            functions[function["name"]] = code
+        return functions
+
+    def origins(self, line: int) -> Dict[str, SourceLocation]:
+        return {function["name"]: relocate(function["origin"], line)
+                for function in self.functions if function["origin"] is not None}
+
+
+class BuildCache:
+    """
+    Keeps the code generated for every function declaration between builds of the same file.
+
+    A declaration is reused if its source text, what its dependencies resolve to and the way its locals are stored
+    are unchanged. The first two are checked by the NameResolver, which then skips the body, the storage after the
+    call graph was analysed. Helper functions are numbered per declaration, so reused code never conflicts with the
+    code generated for other declarations. Source locations are stored relative to the declaration, so moving a
+    function doesn't invalidate it.
+    """
+
+    def __init__(self, path: Optional[Path], source: str, settings: Optional[Dict[str, Any]] = None):
+        self.path: Optional[Path] = path
+        self.source: str = source
+        # Compiler options that change the generated code. The cache is only used if they are the same.
+        self.settings: Dict[str, Any] = settings if settings is not None else {}
+        self.entries: Dict[str, CachedFunction] = {}
+        self.new_entries: Dict[str, dict] = {}
+        if path is not None and path.exists():
+            self.read()
+
+    def read(self):
+        with self.path.open() as file:
+            data = json.load(file)
+        if data.get("version") != CACHE_VERSION or data.get("settings", {}) != self.settings:
+            return
+        self.entries = {name: CachedFunction(entry) for name, entry in data["functions"].items()}
+
+    def write(self):
+        if self.path is None:
+            return
+        with self.path.open("w") as file:
+            json.dump({"version": CACHE_VERSION, "settings": self.settings, "functions": self.new_entries}, file,
+                      sort_keys=True)
+
+    def text_key(self, declaration: FunctionDeclaration) -> str:
+        """Identifies the source text of a declaration, independent of the line it starts at."""
+        text = self.source[declaration.start_pos:declaration.end_pos]
+        namespace = declaration.reference.target.namespace.name
+        return hashlib.sha256(f"{namespace}:{declaration.column}:{text}".encode()).hexdigest()
+
+    def lookup(self, declaration: FunctionDeclaration, scope: Scope) -> Optional[CachedFunction]:
+        """Returns the cached code of a declaration if neither its text nor its environment changed."""
+        if declaration.start_pos is None:
+            return None
+        entry = self.entries.get(declaration.reference.name)
+        if entry is None or entry.text != self.text_key(declaration) or \
+                entry.environment != entry.dependencies.environment(scope):
+            return None
+        return entry
+
+    def store(self, declaration: FunctionDeclaration, functions: Dict[str, EncodedCode],
+              origins: Dict[str, SourceLocation]):
+        if declaration.start_pos is None:
+            return
+        self.new_entries[declaration.reference.name] = {
+            "text": self.text_key(declaration),
+            "environment": declaration.environment,
+            "storage": declaration.storage,
+            "dependencies": declaration.dependencies.to_dict(),
+            # A list, so the functions keep the order they were generated in
+            "functions": [{
+                "name": name,
+                "commands": list(code.commands()),
+                "locations": [relative(location, declaration.line) for location in code.source_locations()],
+                "origin": relative(origins.get(name), declaration.line),
+            } for name, code in functions.items()],
+        }
+
+
+def signature(function_: Function) -> list:
+    """
+    Returns the parameters of a function, followed by its return type. Callers store arguments in the parameters
+    directly, so their names are part of the signature as well.
+    """
+    return_type = function_.return_type.name if function_.return_type is not None else None
+    return [[parameter.type.name, parameter.name] for parameter in function_.parameters] + [return_type]
+
+
+def relative(location: Optional[SourceLocation], line: int) -> Optional[list]:
+    if location is None:
+        return None
+    return [location.line - line, location.column, location.construct, location.function]
+
+
+def relocate(values: Optional[list], line: int) -> Optional[SourceLocation]:
+    if values is None:
+        return None
+    return SourceLocation(values[0] + line, values[1], values[2], values[3])
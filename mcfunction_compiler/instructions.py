@@ -1,9 +1,76 @@
-from typing import Union
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Union, List, Optional, Tuple
 
 from lark.lexer import Token
 
 from constructs import Constant, Namespace
-from symboltable import IntType, Variable
+from sourcemap import SourceLocation
+from symboltable import IntType, Variable, STACK_FRAME
+
+if TYPE_CHECKING:
+    from encoding import OperandTable
+
+SUMMON_STACK_FRAME = "summon minecraft:armor_stand 0 0 0 {Marker: 1b, Invisible: 1b, NoGravity: 1b, " \
+                     "Invulnerable: 1b, Tags: [\"stack_frame\"]}"
+INCREASE_STACK_DEPTH = "scoreboard players add @e[type=armor_stand,tag=stack_frame] mcfc.stack_depth 1"
+KILL_STACK_FRAME = "kill @e[type=armor_stand,tag=stack_frame,scores={mcfc.stack_depth=1}]"
+DECREASE_STACK_DEPTH = "scoreboard players remove @e[type=armor_stand,tag=stack_frame] mcfc.stack_depth 1"
+CALL_IN_STACK_FRAME = f"execute as {STACK_FRAME} run function "
+
+# Opcodes of the compact encoding, see encoding.py
+RUN = 0
+SET = 1
+STORE = 2
+ADD = 3
+ADD_CONSTANT = 4
+SUBTRACT = 5
+MULTIPLY = 6
+DIVIDE = 7
+MODULO = 8
+MINIMUM = 9
+MAXIMUM = 10
+SWAP = 11
+STORE_SUCCESS = 12
+STORE_RESULT = 13
+CALL = 14
+SCHEDULE = 15
+CALL_IN_FRAME = 16
+SUMMON_FRAME = 17
+INCREASE_DEPTH = 18
+KILL_FRAME = 19
+DECREASE_DEPTH = 20
+
+
+def literal(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+# The command of every opcode, with the first and second operand as {0} and {1}. The second operand of STORE_SUCCESS
+# is a condition.
+TEMPLATES = [
+    "{0}",
+    "scoreboard players set {0} {1}",
+    "scoreboard players operation {0} = {1}",
+    "scoreboard players operation {0} += {1}",
+    "scoreboard players add {0} {1}",
+    "scoreboard players operation {0} -= {1}",
+    "scoreboard players operation {0} *= {1}",
+    "scoreboard players operation {0} /= {1}",
+    "scoreboard players operation {0} %= {1}",
+    "scoreboard players operation {0} < {1}",
+    "scoreboard players operation {0} > {1}",
+    "scoreboard players operation {0} >< {1}",
+    "execute store success score {0} {1}",
+    "execute store result score {0} run {1}",
+    "function {0}",
+    "schedule function {0} {1}t",
+    literal(CALL_IN_STACK_FRAME) + "{0}",
+    literal(SUMMON_STACK_FRAME),
+    literal(INCREASE_STACK_DEPTH),
+    literal(KILL_STACK_FRAME),
+    literal(DECREASE_STACK_DEPTH),
+]
 
 
 def bool_to_int(boolean: Token) -> int:
@@ -16,9 +83,16 @@ def bool_to_int(boolean: Token) -> int:
 
 
 class Instruction:
+    # The source construct this instruction was generated for, set by the code generator
+    source_location: Optional[SourceLocation] = None
+
     def to_string(self) -> str:
         raise NotImplementedError
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        """Returns the opcode, the operand table indices of both operands and the index of its conditions."""
+        raise NotImplementedError
+
 
 class StoreInstruction(Instruction):
     def __init__(self, target: Variable, source: Union[Variable, Constant]):
@@ -34,6 +108,14 @@ class StoreInstruction(Instruction):
             else:
                 return f"scoreboard players set {self.target.get_identifier()} {bool_to_int(self.source.value)}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        target = operands.intern(self.target.get_identifier())
+        if isinstance(self.source, Variable):
+            return STORE, target, operands.intern(self.source.get_identifier()), 0
+        # Compares the token type, which is cheaper than getting the type singleton for every constant
+        value = self.source.value if self.source.value.type == "INT" else bool_to_int(self.source.value)
+        return SET, target, operands.intern(str(value)), 0
+
 
 class RunInstruction(Instruction):
     def __init__(self, command: str):
@@ -42,146 +124,296 @@ class RunInstruction(Instruction):
     def to_string(self) -> str:
         return self.command
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return RUN, operands.intern(self.command), 0, 0
+
 
-class EqualityInstruction(Instruction):
+class AdditionInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"execute store success score {self.target.get_identifier()} if score {self.target.get_identifier()} = {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} += {self.source.get_identifier()}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return ADD, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
-class UnequalityInstruction(Instruction):
-    def __init__(self, target: Variable, source: Variable):
+
+class AddConstantInstruction(Instruction):
+    def __init__(self, target: Variable, value: int):
         self.target: Variable = target
-        self.source: Variable = source
+        self.value: int = value
 
     def to_string(self) -> str:
-        return f"execute store success score {self.target.get_identifier()} unless score {self.target.get_identifier()} = {self.source.get_identifier()}"
+        return f"scoreboard players add {self.target.get_identifier()} {self.value}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return ADD_CONSTANT, operands.intern(self.target.get_identifier()), operands.intern(str(self.value)), 0
 
 
-class LessThenInstruction(Instruction):
+class SubtractionInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"execute store success score {self.target.get_identifier()} if score {self.target.get_identifier()} < {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} -= {self.source.get_identifier()}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return SUBTRACT, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
 
-class LessThenEqualsInstruction(Instruction):
+class MultiplicationInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"execute store success score {self.target.get_identifier()} if score {self.target.get_identifier()} <= {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} *= {self.source.get_identifier()}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return MULTIPLY, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
-class GreaterThenInstruction(Instruction):
+
+class DivisionInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"execute store success score {self.target.get_identifier()} if score {self.target.get_identifier()} > {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} /= {self.source.get_identifier()}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return DIVIDE, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
-class GreaterThenEqualsInstruction(Instruction):
+
+class ModuloInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"execute store success score {self.target.get_identifier()} if score {self.target.get_identifier()} >= {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} %= {self.source.get_identifier()}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return MODULO, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
-class AdditionInstruction(Instruction):
+
+class MinimumInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"scoreboard players operation {self.target.get_identifier()} += {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} < {self.source.get_identifier()}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return MINIMUM, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
-class SubtractionInstruction(Instruction):
+
+class MaximumInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"scoreboard players operation {self.target.get_identifier()} -= {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} > {self.source.get_identifier()}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return MAXIMUM, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
-class MultiplicationInstruction(Instruction):
+
+class SwapInstruction(Instruction):
     def __init__(self, target: Variable, source: Variable):
         self.target: Variable = target
         self.source: Variable = source
 
     def to_string(self) -> str:
-        return f"scoreboard players operation {self.target.get_identifier()} *= {self.source.get_identifier()}"
+        return f"scoreboard players operation {self.target.get_identifier()} >< {self.source.get_identifier()}"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return SWAP, operands.intern(self.target.get_identifier()), operands.intern(self.source.get_identifier()), 0
 
-class DivisionInstruction(Instruction):
-    def __init__(self, target: Variable, source: Variable):
-        self.target: Variable = target
-        self.source: Variable = source
 
-    def to_string(self) -> str:
+class Negateinstruction(Instruction):
+    def __init__(self, variable: Variable):
+        self.variable = variable
+
+    def to_string(self):
         return f"scoreboard players operation {self.target.get_identifier()} /= {self.source.get_identifier()}"
 
 
-class ModuloInstruction(Instruction):
-    def __init__(self, target: Variable, source: Variable):
-        self.target: Variable = target
-        self.source: Variable = source
+class Condition:
+    def __init__(self, negated: bool):
+        self.negated: bool = negated
+
+    def negate(self) -> "Condition":
+        raise NotImplementedError
 
     def to_string(self) -> str:
-        return f"scoreboard players operation {self.target.get_identifier()} %= {self.source.get_identifier()}"
+        raise NotImplementedError
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int]:
+        """Returns the operand table indices of a template with {0} and {1} and of both operands."""
+        raise NotImplementedError
 
-class Negateinstruction(Instruction):
-    def __init__(self, variable: Variable):
-        self.variable = variable
 
-    def to_string(self):
-        return f"scoreboard players operation {self.target.get_identifier()} /= {self.source.get_identifier()}"
+class ScoreComparisonCondition(Condition):
+    def __init__(self, left: Variable, operator: str, right: Variable, negated: bool = False):
+        super().__init__(negated)
+        self.left: Variable = left
+        self.operator: str = operator
+        self.right: Variable = right
 
+    def negate(self) -> Condition:
+        return ScoreComparisonCondition(self.left, self.operator, self.right, not self.negated)
 
-class InvertInstruction(Instruction):
-    def __init__(self, variable: Variable):
-        self.variable = variable
+    def to_string(self) -> str:
+        keyword = "unless" if self.negated else "if"
+        return f"{keyword} score {self.left.get_identifier()} {self.operator} {self.right.get_identifier()}"
 
-    def to_string(self):
-        return f"execute store success score {self.variable.get_identifier()} if score {self.variable.get_identifier()} 0"
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int]:
+        keyword = "unless" if self.negated else "if"
+        return operands.intern(f"{keyword} score {{0}} {self.operator} {{1}}"), \
+            operands.intern(self.left.get_identifier()), operands.intern(self.right.get_identifier())
+
+
+class ScoreMatchesCondition(Condition):
+    def __init__(self, variable: Variable, range_: str, negated: bool = False):
+        super().__init__(negated)
+        self.variable: Variable = variable
+        self.range: str = range_
+
+    def negate(self) -> Condition:
+        return ScoreMatchesCondition(self.variable, self.range, not self.negated)
+
+    def to_string(self) -> str:
+        keyword = "unless" if self.negated else "if"
+        return f"{keyword} score {self.variable.get_identifier()} matches {self.range}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int]:
+        keyword = "unless" if self.negated else "if"
+        return operands.intern(f"{keyword} score {{0}} matches {{1}}"), \
+            operands.intern(self.variable.get_identifier()), operands.intern(self.range)
 
 
-class CallIfZeroInstruction(Instruction):
-    def __init__(self, condition: Variable, namespace: Namespace, function_name: str):
-        self.condition: Variable = condition
+class ConditionalInstruction(Instruction):
+    def __init__(self, conditions: List[Condition], instruction: Instruction):
+        self.conditions: List[Condition] = conditions
+        self.instruction: Instruction = instruction
+
+    def to_string(self) -> str:
+        if not self.conditions:
+            return self.instruction.to_string()
+        conditions = " ".join(condition.to_string() for condition in self.conditions)
+        command = self.instruction.to_string()
+        if command.startswith("execute "):
+            # "execute ... run execute ..." is the same as a single execute with all subcommands
+            return f"execute {conditions} {command[len('execute '):]}"
+        return f"execute {conditions} run {command}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        opcode, first, second, inner = self.instruction.encode(operands)
+        if not self.conditions:
+            return opcode, first, second, inner
+        # Nested conditions end up in the same execute command
+        conditions = [condition.encode(operands) for condition in self.conditions]
+        if inner:
+            conditions += operands.conditions(inner)
+        return opcode, first, second, operands.add_conditions(conditions)
+
+
+class StoreConditionInstruction(Instruction):
+    def __init__(self, target: Variable, condition: Condition):
+        self.target: Variable = target
+        self.condition: Condition = condition
+
+    def to_string(self) -> str:
+        return f"execute store success score {self.target.get_identifier()} {self.condition.to_string()}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return STORE_SUCCESS, operands.intern(self.target.get_identifier()), \
+            operands.add_conditions([self.condition.encode(operands)]), 0
+
+
+class StoreResultInstruction(Instruction):
+    def __init__(self, target: Variable, command: str):
+        self.target: Variable = target
+        self.command: str = command
+
+    def to_string(self) -> str:
+        return f"execute store result score {self.target.get_identifier()} run {self.command}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return STORE_RESULT, operands.intern(self.target.get_identifier()), operands.intern(self.command), 0
+
+
+class CallInstruction(Instruction):
+    def __init__(self, namespace: Namespace, function_name: str):
         self.namespace: Namespace = namespace
         self.function_name: str = function_name
 
     def to_string(self) -> str:
-        return f"execute if score {self.condition.get_identifier()} matches 0 run function {self.namespace.name}:{self.function_name}"
+        return f"function {self.namespace.name}:{self.function_name}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return CALL, operands.intern(f"{self.namespace.name}:{self.function_name}"), 0, 0
 
 
-class CallIfNotZeroInstruction(Instruction):
-    def __init__(self, condition: Variable, namespace: Namespace, function_name: str):
-        self.condition: Variable = condition
+class ScheduleInstruction(Instruction):
+    def __init__(self, namespace: Namespace, function_name: str, ticks: int):
         self.namespace: Namespace = namespace
         self.function_name: str = function_name
+        self.ticks: int = ticks
 
     def to_string(self) -> str:
-        return f"execute unless score {self.condition.get_identifier()} matches 0 run function {self.namespace.name}:{self.function_name}"
+        return f"schedule function {self.namespace.name}:{self.function_name} {self.ticks}t"
 
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return SCHEDULE, operands.intern(f"{self.namespace.name}:{self.function_name}"), \
+            operands.intern(str(self.ticks)), 0
 
-class CallInstruction(Instruction):
+
+class CallInStackFrameInstruction(Instruction):
     def __init__(self, namespace: Namespace, function_name: str):
         self.namespace: Namespace = namespace
         self.function_name: str = function_name
 
     def to_string(self) -> str:
-        return f"function {self.namespace.name}:{self.function_name}"
+        return f"{CALL_IN_STACK_FRAME}{self.namespace.name}:{self.function_name}"
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return CALL_IN_FRAME, operands.intern(f"{self.namespace.name}:{self.function_name}"), 0, 0
+
+
+class SummonStackFrameInstruction(Instruction):
+    def to_string(self) -> str:
+        return SUMMON_STACK_FRAME
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return SUMMON_FRAME, 0, 0, 0
+
+
+class IncreaseStackDepthInstruction(Instruction):
+    def to_string(self) -> str:
+        return INCREASE_STACK_DEPTH
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return INCREASE_DEPTH, 0, 0, 0
+
+
+class KillStackFrameInstruction(Instruction):
+    def to_string(self) -> str:
+        return KILL_STACK_FRAME
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return KILL_FRAME, 0, 0, 0
+
+
+class DecreaseStackDepthInstruction(Instruction):
+    def to_string(self) -> str:
+        return DECREASE_STACK_DEPTH
+
+    def encode(self, operands: OperandTable) -> Tuple[int, int, int, int]:
+        return DECREASE_DEPTH, 0, 0, 0
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Dict, Any
+
+
+class Phase:
+    def __init__(self, name: str, wall_time: float, cpu_time: float, peak_memory: int, allocated_memory: int):
+        self.name: str = name
+        self.wall_time: float = wall_time
+        self.cpu_time: float = cpu_time
+        self.peak_memory: int = peak_memory
+        self.allocated_memory: int = allocated_memory
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "peak_memory": self.peak_memory,
+            "allocated_memory": self.allocated_memory,
+        }
+
+
+class PhaseTimer:
+    """
+    Measures wall time, CPU time and memory of the phases of a build.
+
+    Memory is traced with tracemalloc, which slows down the build noticeably, so it's only started when the timer is
+    enabled. A disabled timer measures nothing. Peak memory is the highest amount of traced memory during the phase,
+    allocated memory is how much more memory is in use after the phase than before it.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled: bool = enabled
+        self.phases: List[Phase] = []
+
+    def start(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop(self):
+        if self.enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            cpu_time = time.process_time() - cpu_start
+            wall_time = time.perf_counter() - wall_start
+            memory_after, peak_memory = tracemalloc.get_traced_memory()
+            self.phases.append(Phase(name, wall_time, cpu_time, peak_memory, memory_after - memory_before))
+
+    def report(self) -> str:
+        name_width = max([len("total")] + [len(phase.name) for phase in self.phases])
+        lines = [f"{'phase':<{name_width}}  {'wall':>10}  {'cpu':>10}  {'peak memory':>12}  {'allocated':>12}"]
+        for phase in self.phases:
+            lines.append(f"{phase.name:<{name_width}}  {format_seconds(phase.wall_time):>10}  "
+                         f"{format_seconds(phase.cpu_time):>10}  {format_bytes(phase.peak_memory):>12}  "
+                         f"{format_bytes(phase.allocated_memory):>12}")
+        lines.append(f"{'total':<{name_width}}  {format_seconds(self.total_wall_time()):>10}  "
+                     f"{format_seconds(self.total_cpu_time()):>10}")
+        return "\n".join(lines)
+
+    def report_json(self) -> str:
+        return json.dumps({
+            "phases": [phase.to_dict() for phase in self.phases],
+            "wall_time": self.total_wall_time(),
+            "cpu_time": self.total_cpu_time(),
+        }, indent=4)
+
+    def total_wall_time(self) -> float:
+        return sum(phase.wall_time for phase in self.phases)
+
+    def total_cpu_time(self) -> float:
+        return sum(phase.cpu_time for phase in self.phases)
+
+
+def format_seconds(seconds: float) -> str:
+    return f"{seconds * 1000:.1f} ms"
+
+
+def format_bytes(size: int) -> str:
+    if abs(size) < 1024:
+        return f"{size} B"
+    if abs(size) < 1024 * 1024:
+        return f"{size / 1024:.1f} KiB"
+    return f"{size / (1024 * 1024):.1f} MiB"
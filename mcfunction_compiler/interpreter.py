@@ -0,0 +1,418 @@
+from __future__ import annotations
+
+import json
+import re
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple, Union, Iterable
+
+from cost import DEFAULT_MAX_COMMAND_CHAIN_LENGTH, TICK_EVENT
+from codegeneration import LOAD_EVENT
+from exception import InterpreterException
+
+FUNCTION_PATH = re.compile(r"^data/([a-z0-9_.-]+)/functions/(.+)\.mcfunction$")
+TAG_PATH = re.compile(r"^data/([a-z0-9_.-]+)/tags/functions/(.+)\.json$")
+SUMMON_TAGS = re.compile(r"Tags: ?\[([^\]]*)\]")
+
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+
+def to_int32(value: int) -> int:
+    """Wraps a value around like a Java int."""
+    return (value - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+class Entity:
+    def __init__(self, type_: str, tags: List[str]):
+        self.type: str = type_
+        self.tags: List[str] = tags
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} {self.type} {self.tags}>"
+
+
+Holder = Union[str, Entity]
+
+
+class ChainLimitReached(Exception):
+    pass
+
+
+class Selector:
+    """An @e or @s target selector with the arguments the compiler uses: type, tag, scores and limit."""
+
+    def __init__(self, text: str):
+        self.text: str = text
+        self.self_: bool = text == "@s"
+        self.type: Optional[str] = None
+        self.tags: List[str] = []
+        self.scores: Dict[str, Tuple[int, int]] = {}
+        self.limit: Optional[int] = None
+        if self.self_:
+            return
+        if text == "@e":
+            return
+        if not text.startswith("@e[") or not text.endswith("]"):
+            raise InterpreterException(f"Unsupported selector '{text}'")
+        for argument in split_arguments(text[3:-1]):
+            key, value = argument.split("=", 1)
+            if key == "type":
+                self.type = value if ":" in value else f"minecraft:{value}"
+            elif key == "tag":
+                self.tags.append(value)
+            elif key == "scores":
+                for score in split_arguments(value[1:-1]):
+                    objective, range_ = score.split("=", 1)
+                    self.scores[objective] = parse_range(range_)
+            elif key == "limit":
+                self.limit = int(value)
+            else:
+                raise InterpreterException(f"Unsupported selector argument '{key}' in '{text}'")
+
+    def matches(self, entity: Entity, interpreter: Interpreter) -> bool:
+        if self.type is not None and entity.type != self.type:
+            return False
+        if any(tag not in entity.tags for tag in self.tags):
+            return False
+        for objective, (minimum, maximum) in self.scores.items():
+            score = interpreter.get_score(entity, objective)
+            if score is None or not minimum <= score <= maximum:
+                return False
+        return True
+
+
+def split_arguments(text: str) -> List[str]:
+    """Splits selector arguments at commas that are not inside braces."""
+    arguments = []
+    depth = 0
+    start = 0
+    for index, character in enumerate(text):
+        if character == "{":
+            depth += 1
+        elif character == "}":
+            depth -= 1
+        elif character == "," and depth == 0:
+            arguments.append(text[start:index])
+            start = index + 1
+    if text[start:]:
+        arguments.append(text[start:])
+    return arguments
+
+
+def parse_range(text: str) -> Tuple[int, int]:
+    if ".." not in text:
+        return int(text), int(text)
+    minimum, maximum = text.split("..")
+    return int(minimum) if minimum else INT_MIN, int(maximum) if maximum else INT_MAX
+
+
+class Interpreter:
+    """
+    Runs generated datapacks without a Minecraft server.
+
+    Only the commands the compiler emits are understood: scoreboard players set/add/remove/operation, execute with
+    if/unless score and entity, store result/success and as, function, schedule, and the summon and kill commands of
+    stack frames. Other commands, like the ones in run statements, are recorded in output and succeed without an effect.
+
+    Executed commands, selector evaluations and calls per function are counted, and the final scoreboard can be read
+    with get_score(). Like in Minecraft, a chain of more than max_command_chain_length commands is aborted.
+    """
+
+    def __init__(self, max_command_chain_length: int = DEFAULT_MAX_COMMAND_CHAIN_LENGTH):
+        self.max_command_chain_length: int = max_command_chain_length
+        self.functions: Dict[str, List[str]] = {}
+        self.tags: Dict[str, List[str]] = {}
+        self.scores: Dict[str, Dict[Holder, int]] = {}
+        self.objectives: Set[str] = set()
+        self.entities: List[Entity] = []
+        self.scheduled: Dict[str, int] = {}
+        self.time: int = 0
+        self.commands: int = 0
+        self.selectors: int = 0
+        self.calls: Dict[str, int] = {}
+        self.output: List[str] = []
+        self.chain_length: int = 0
+        self.chain_limit_reached: bool = False
+        self.selector_cache: Dict[str, Selector] = {}
+        self.pending: List[Tuple[str, Optional[Entity]]] = []
+
+    def load_files(self, files: Iterable[Tuple[str, bytes]]):
+        """Loads files given as paths relative to the root of the pack, like CodeGenerator.serialize() yields them."""
+        for path, content in files:
+            self.load_file(path, content)
+
+    def load_directory(self, directory: Path):
+        for path in sorted(directory.rglob("*")):
+            if path.is_file():
+                self.load_file(path.relative_to(directory).as_posix(), path.read_bytes())
+
+    def load_zip(self, path: Path):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                self.load_file(name, archive.read(name))
+
+    def load_file(self, path: str, content: bytes):
+        match = FUNCTION_PATH.match(path)
+        if match:
+            self.functions[f"{match.group(1)}:{match.group(2)}"] = [
+                line for line in content.decode().splitlines() if line.strip() and not line.startswith("#")]
+            return
+        match = TAG_PATH.match(path)
+        if match:
+            self.tags[f"{match.group(1)}:{match.group(2)}"] = json.loads(content)["values"]
+
+    def get_score(self, holder: Holder, objective: str) -> Optional[int]:
+        return self.scores.get(objective, {}).get(holder)
+
+    def set_score(self, holder: Holder, objective: str, value: int):
+        self.scores.setdefault(objective, {})[holder] = to_int32(value)
+
+    def load(self):
+        """Runs the functions of the minecraft:load tag, like a server does after (re)loading datapacks."""
+        self.run_tag(LOAD_EVENT)
+
+    def tick(self):
+        """Runs the functions of the minecraft:tick tag, then the scheduled functions that are due."""
+        self.time += 1
+        self.run_tag(TICK_EVENT)
+        for function_name, time in list(self.scheduled.items()):
+            if time <= self.time:
+                del self.scheduled[function_name]
+                self.run_function(function_name)
+
+    def run_tag(self, tag: str):
+        for value in self.tags.get(tag, []):
+            if value.startswith("#"):
+                self.run_tag(value[1:])
+            else:
+                self.run_function(value)
+
+    def run_function(self, name: str):
+        """Runs a function as a new command chain."""
+        self.chain_length = 0
+        self.queue_function(name, None)
+        try:
+            self.run_queue()
+        except ChainLimitReached:
+            self.chain_limit_reached = True
+            self.pending = []
+
+    def queue_function(self, name: str, executor: Optional[Entity]) -> int:
+        """
+        Schedules a function call to start after the current command, like Minecraft inserts the commands of called
+        functions into its command queue. The result of a function command is the number of commands in the function.
+        """
+        if name not in self.functions:
+            raise InterpreterException(f"Unknown function '{name}'")
+        self.pending.append((name, executor))
+        return len(self.functions[name])
+
+    def run_queue(self):
+        # Each frame is the commands of a function, the position of the next command and the executing entity
+        stack: List[list] = []
+        while True:
+            # Calls are pushed in reverse, so the first one queued runs first
+            for name, executor in reversed(self.pending):
+                self.calls[name] = self.calls.get(name, 0) + 1
+                stack.append([self.functions[name], 0, executor])
+            self.pending = []
+            if not stack:
+                return
+            frame = stack[-1]
+            commands, position, executor = frame
+            if position == len(commands):
+                stack.pop()
+                continue
+            frame[1] += 1
+            self.chain_length += 1
+            if self.chain_length > self.max_command_chain_length:
+                raise ChainLimitReached()
+            self.commands += 1
+            self.execute(commands[position], executor)
+
+    def execute(self, command: str, executor: Optional[Entity]) -> Tuple[bool, int]:
+        """Executes a single command and returns whether it succeeded and its result."""
+        arguments = command.split(" ")
+        if arguments[0] == "scoreboard" and arguments[1] == "players":
+            return self.scoreboard(arguments[2:], executor)
+        elif arguments[0] == "scoreboard" and arguments[1:3] == ["objectives", "add"]:
+            # Scores of objectives that weren't added are accepted as well, so this only fails for duplicates
+            created = arguments[3] not in self.objectives
+            self.objectives.add(arguments[3])
+            return created, int(created)
+        elif arguments[0] == "execute":
+            return self.execute_subcommands(arguments, 1, executor, [])
+        elif arguments[0] == "function":
+            return True, self.queue_function(arguments[1], executor)
+        elif arguments[0] == "schedule" and arguments[1] == "function":
+            self.scheduled[arguments[2]] = self.time + int(arguments[3].rstrip("t"))
+            return True, self.time
+        elif arguments[0] == "summon":
+            tags = SUMMON_TAGS.search(command)
+            tag_names = [tag.strip().strip("\"") for tag in tags.group(1).split(",")] if tags else []
+            self.entities.append(Entity(arguments[1], [tag for tag in tag_names if tag]))
+            return True, 1
+        elif arguments[0] == "kill":
+            killed = self.select(arguments[1], executor)
+            for entity in killed:
+                self.entities.remove(entity)
+                for scores in self.scores.values():
+                    scores.pop(entity, None)
+            return bool(killed), len(killed)
+        self.output.append(command)
+        return True, 0
+
+    def scoreboard(self, arguments: List[str], executor: Optional[Entity]) -> Tuple[bool, int]:
+        action = arguments[0]
+        targets = self.holders(arguments[1], executor)
+        objective = arguments[2]
+        result = 0
+        if action in ("set", "add", "remove"):
+            value = int(arguments[3])
+            for target in targets:
+                if action == "set":
+                    score = value
+                elif action == "add":
+                    score = (self.get_score(target, objective) or 0) + value
+                else:
+                    score = (self.get_score(target, objective) or 0) - value
+                self.set_score(target, objective, score)
+                result += self.get_score(target, objective)
+        elif action == "operation":
+            operator = arguments[3]
+            sources = self.holders(arguments[4], executor)
+            source_objective = arguments[5]
+            for target in targets:
+                for source in sources:
+                    self.operation(target, objective, operator, source, source_objective)
+                result += self.get_score(target, objective) or 0
+        elif action == "reset":
+            for target in targets:
+                self.scores.get(objective, {}).pop(target, None)
+        else:
+            raise InterpreterException(f"Unsupported scoreboard command 'scoreboard players {' '.join(arguments)}'")
+        return bool(targets), result
+
+    def operation(self, target: Holder, objective: str, operator: str, source: Holder, source_objective: str):
+        value = self.get_score(target, objective) or 0
+        operand = self.get_score(source, source_objective) or 0
+        if operator == "=":
+            value = operand
+        elif operator == "+=":
+            value += operand
+        elif operator == "-=":
+            value -= operand
+        elif operator == "*=":
+            value *= operand
+        elif operator == "/=":
+            # Minecraft uses floor division and ignores division by zero
+            if operand != 0:
+                value //= operand
+        elif operator == "%=":
+            if operand != 0:
+                value %= operand
+        elif operator == "<":
+            value = min(value, operand)
+        elif operator == ">":
+            value = max(value, operand)
+        elif operator == "><":
+            self.set_score(source, source_objective, value)
+            value = operand
+        else:
+            raise InterpreterException(f"Unsupported scoreboard operation '{operator}'")
+        self.set_score(target, objective, value)
+
+    def execute_subcommands(self, arguments: List[str], index: int, executor: Optional[Entity],
+                            stores: List[Tuple[str, str, str]]) -> Tuple[bool, int]:
+        while index < len(arguments):
+            subcommand = arguments[index]
+            if subcommand in ("if", "unless"):
+                passed, result, index = self.condition(arguments, index + 1, executor)
+                if subcommand == "unless":
+                    passed, result = not passed, int(not passed)
+                if index == len(arguments):
+                    self.store(stores, passed, result, executor)
+                    return passed, result
+                if not passed:
+                    return False, 0
+            elif subcommand == "store":
+                if arguments[index + 2] != "score":
+                    raise InterpreterException(f"Unsupported store target '{arguments[index + 2]}'")
+                stores = stores + [(arguments[index + 1], arguments[index + 3], arguments[index + 4])]
+                index += 5
+            elif subcommand == "as":
+                entities = self.select(arguments[index + 1], executor)
+                successes = 0
+                for entity in entities:
+                    success, _ = self.execute_subcommands(arguments, index + 2, entity, stores)
+                    successes += success
+                return successes > 0, successes
+            elif subcommand == "run":
+                success, result = self.execute(" ".join(arguments[index + 1:]), executor)
+                self.store(stores, success, result, executor)
+                return success, result
+            else:
+                raise InterpreterException(f"Unsupported execute subcommand '{subcommand}'")
+        raise InterpreterException(f"Incomplete execute command '{' '.join(arguments)}'")
+
+    def condition(self, arguments: List[str], index: int, executor: Optional[Entity]) -> Tuple[bool, int, int]:
+        """Evaluates an if/unless condition and returns whether it passed, its result and the next index."""
+        kind = arguments[index]
+        if kind == "entity":
+            count = len(self.select(arguments[index + 1], executor))
+            return count > 0, count, index + 2
+        if kind != "score":
+            raise InterpreterException(f"Unsupported execute condition '{kind}'")
+        holders = self.holders(arguments[index + 1], executor)
+        objective = arguments[index + 2]
+        if len(holders) != 1:
+            raise InterpreterException(f"'{arguments[index + 1]}' must select exactly one score holder")
+        score = self.get_score(holders[0], objective)
+        if arguments[index + 3] == "matches":
+            minimum, maximum = parse_range(arguments[index + 4])
+            passed = score is not None and minimum <= score <= maximum
+            return passed, int(passed), index + 5
+        operator = arguments[index + 3]
+        sources = self.holders(arguments[index + 4], executor)
+        if len(sources) != 1:
+            raise InterpreterException(f"'{arguments[index + 4]}' must select exactly one score holder")
+        other = self.get_score(sources[0], arguments[index + 5])
+        if score is None or other is None:
+            passed = False
+        elif operator == "=":
+            passed = score == other
+        elif operator == "<":
+            passed = score < other
+        elif operator == "<=":
+            passed = score <= other
+        elif operator == ">":
+            passed = score > other
+        elif operator == ">=":
+            passed = score >= other
+        else:
+            raise InterpreterException(f"Unsupported score comparison '{operator}'")
+        return passed, int(passed), index + 6
+
+    def store(self, stores: List[Tuple[str, str, str]], success: bool, result: int, executor: Optional[Entity]):
+        for mode, holder, objective in stores:
+            value = int(success) if mode == "success" else result
+            for target in self.holders(holder, executor):
+                self.set_score(target, objective, value)
+
+    def holders(self, text: str, executor: Optional[Entity]) -> List[Holder]:
+        if text.startswith("@"):
+            return self.select(text, executor)
+        return [text]
+
+    def select(self, text: str, executor: Optional[Entity]) -> List[Entity]:
+        selector = self.selector_cache.get(text)
+        if selector is None:
+            selector = self.selector_cache[text] = Selector(text)
+        if selector.self_:
+            return [executor] if executor is not None else []
+        self.selectors += 1
+        entities = [entity for entity in self.entities if selector.matches(entity, self)]
+        if selector.limit is not None:
+            entities = entities[:selector.limit]
+        return entities
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Dict, List
+
+from constructs import Construct, Namespace, VariableDeclaration, FunctionDeclaration
+from instructions import Instruction, RunInstruction
+from symboltable import Variable
+from visitor import Visitor
+
+SEPARATE = "separate"
+PACKED = "packed"
+# Objective names of pack format 1 can be at most 16 characters long
+MAX_OBJECTIVE_LENGTH = 16
+
+
+class GlobalLayout(Visitor):
+    """
+    Decides which score holder and objective store each global variable.
+
+    With the separate layout every global gets its own objective. The packed layout puts all globals of the same
+    type into one shared objective, with the name of the global as a fake player. That keeps the objective registry
+    small for packs with many globals. The objectives it uses are created by the load function.
+    Must run after the NameResolver and before the CodeGenerator.
+    """
+
+    def __init__(self, mode: str = SEPARATE):
+        self.mode: str = mode
+        self.namespace_: Namespace = None
+        self.objectives: Dict[str, List[Variable]] = {}
+
+    def __default__(self, construct: Construct):
+        for child in construct.children:
+            if isinstance(child, Construct):
+                child.accept(self)
+
+    def namespace(self, namespace: Namespace):
+        self.namespace_ = namespace
+
+    def function_declaration(self, declaration: FunctionDeclaration):
+        # Only contains locals
+        pass
+
+    def variable_declaration(self, declaration: VariableDeclaration):
+        variable = declaration.reference.target
+        if self.mode == PACKED:
+            slots = variable.elements if variable.elements is not None else [variable]
+            for slot in slots:
+                slot.holder = f"#{slot.name}"
+                slot.objective = self.shared_objective(slot.type.name)
+            objective = slots[0].objective
+        else:
+            # The elements of an array share the objective of the array
+            objective = f"{self.namespace_.name}.{variable.name}"
+        self.objectives.setdefault(objective, []).append(variable)
+
+    def shared_objective(self, type_name: str) -> str:
+        """Returns the objective of the globals of a type, like "test.g.i" for ints in the test namespace."""
+        objective = f"{self.namespace_.name}.g.{type_name[0]}"
+        if len(objective) <= MAX_OBJECTIVE_LENGTH:
+            return objective
+        # Long namespaces are replaced by a digest, which still keeps the objectives of different packs apart
+        digest = hashlib.sha256(self.namespace_.name.encode()).hexdigest()[:MAX_OBJECTIVE_LENGTH - len(".g.i")]
+        return f"{digest}.g.{type_name[0]}"
+
+    def setup(self) -> List[Instruction]:
+        """Returns the commands creating the shared objectives. Separate objectives are left to the user."""
+        if self.mode != PACKED:
+            return []
+        return [RunInstruction(f"scoreboard objectives add {objective} dummy") for objective in self.objectives]
+
+    def report(self) -> str:
+        lines = [f"{len(self.objectives)} objectives for "
+                 f"{sum(len(variables) for variables in self.objectives.values())} globals ({self.mode} layout)"]
+        for objective, variables in self.objectives.items():
+            names = [variable.name if variable.elements is None else f"{variable.name}[{len(variable.elements)}]"
+                     for variable in variables]
+            lines.append(f"{objective}: {', '.join(names)}")
+        return "\n".join(lines)
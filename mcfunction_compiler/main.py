@@ -1,18 +1,202 @@
+import cProfile
+import gc
+import json
 import sys
+import zipfile
 
 from lark import Lark
 from argparse import ArgumentParser
 from pkg_resources import resource_string
 from pathlib import Path
+from typing import List
 
+from callgraph import CallGraph
 from codegeneration import CodeGenerator
+from cost import CostModel, DEFAULT_MAX_COMMAND_CHAIN_LENGTH
+from incremental import BuildCache, CACHE_NAME
+from instrumentation import PhaseTimer
+from interpreter import Interpreter
+from layout import GlobalLayout, SEPARATE, PACKED
+from sourcemap import SourceMap, ProfileReport, SOURCE_MAP_NAME
 from transformer import TreeTransformer
 from visitor import NameResolver
+from writer import PackWriter, DirectoryWriter, ZipWriter, write_all
 
-if __name__ == "__main__":
+
+def create_writer(args, output_path: Path) -> PackWriter:
+    if args.output_format == "zip":
+        return ZipWriter(output_path)
+    return DirectoryWriter(output_path)
+
+
+def compile_file(args, input_path: Path, output_path: Path, timer: PhaseTimer):
+    profile_counts = None
+    if args.profile_data is not None:
+        with open(args.profile_data) as file:
+            profile_counts = json.load(file)
+    cache_path = None
+    if args.cache is not None:
+        cache_path = Path(args.cache)
+    elif args.output_format == "directory":
+        cache_path = output_path.joinpath(CACHE_NAME)
+    # Profile data changes what is generated without changing the source, so it can't be cached. The cache also keeps
+    # the code of every function until the build is done, which streaming is meant to avoid.
+    if args.no_cache or profile_counts is not None or args.stream:
+        cache_path = None
+    timer.start()
+    with timer.phase("grammar"):
+        grammar = resource_string("mcfunction_compiler.resources", "grammar.lark").decode()
+        l = Lark(grammar, parser="earley", propagate_positions=True)
+
+    with input_path.open() as file:
+        code = file.read()
+    cache = None
+    if cache_path is not None:
+        cache = BuildCache(cache_path, code, {"global_layout": args.global_layout})
+    with timer.phase("parse"):
+        tree = l.parse(code)
+    with timer.phase("transform"):
+        ast = TreeTransformer().transform(tree)
+        # Only the AST is used from here on. The Earley parser leaves its parse forest behind as reference cycles, which
+        # would otherwise stay around until the garbage collector happens to run.
+        del tree
+        gc.collect()
+    with timer.phase("name resolution"):
+        name_resolver = NameResolver(cache)
+        ast.accept(name_resolver)
+    with timer.phase("call graph"):
+        call_graph = CallGraph()
+        ast.accept(call_graph)
+        call_graph.analyse()
+        if cache is not None:
+            name_resolver.resolve_changed_storage()
+    if args.storage_report:
+        print(call_graph.report())
+    with timer.phase("global layout"):
+        layout = GlobalLayout(args.global_layout)
+        ast.accept(layout)
+    if args.layout_report:
+        print(layout.report())
+    writer = None
+    try:
+        if args.stream:
+            writer = create_writer(args, output_path)
+        with timer.phase("code generation"):
+            # When streaming, functions are also serialized and written here
+            generator = CodeGenerator(input_path.name, profile_counts, cache, layout, writer)
+            ast.accept(generator)
+        with timer.phase("cost analysis"):
+            cost_model = CostModel(generator.namespace_, generator.functions, generator.events, generator.summaries)
+            tick_budget = args.tick_budget if args.tick_budget is not None else float("inf")
+            warnings = cost_model.warnings(tick_budget, args.max_command_chain_length)
+            cost_report = cost_model.report() if args.cost_report else None
+        if cost_report is not None:
+            print(cost_report)
+        for warning in warnings:
+            print(f"Warning: {warning}", file=sys.stderr)
+
+        if writer is None:
+            writer = create_writer(args, output_path)
+        if timer.enabled:
+            # Serialize everything up front, so serialization and writing can be measured separately
+            with timer.phase("serialization"):
+                files = list(generator.serialize(args.jobs))
+        else:
+            files = generator.serialize(args.jobs)
+        with timer.phase("writing"):
+            write_all(writer, files, args.jobs)
+            writer.close()
+    except BaseException:
+        # Doesn't leave an unfinished zip file behind
+        if writer is not None:
+            writer.abort()
+        raise
+    if args.write_report and isinstance(writer, DirectoryWriter):
+        print(writer.summary())
+    if cache is not None:
+        # Only after the build succeeded, so a failed build never leaves a cache behind that doesn't match the output
+        cache.write()
+        if args.verbose_cache:
+            print(f"{len(name_resolver.cached_declarations)} of {len(cache.new_entries)} functions reused from "
+                  f"the cache", file=sys.stderr)
+    timer.stop()
+
+
+def profile_report(arguments: List[str]):
+    parser = ArgumentParser(prog="mcfc profile-report",
+                            description="Attribute the costs of a Minecraft profile-results file to source lines")
+    parser.add_argument("pack", metavar="PACK", type=str, help="generated datapack directory or zip file")
+    parser.add_argument("report", metavar="REPORT", type=str, help="profile-results file written by /debug stop")
+    parser.add_argument("--limit", action="store", type=int, default=20, help="number of source lines to show")
+    args = parser.parse_args(arguments)
+
+    pack_path = Path(args.pack)
+    if pack_path.is_dir():
+        files = [(path.relative_to(pack_path).as_posix(), path.read_bytes())
+                 for path in sorted(pack_path.rglob("*")) if path.is_file()]
+    elif zipfile.is_zipfile(pack_path):
+        with zipfile.ZipFile(pack_path) as archive:
+            files = [(name, archive.read(name)) for name in archive.namelist()]
+    else:
+        print(f"'{pack_path}' is not a datapack directory or zip file", file=sys.stderr)
+        exit(1)
+    source_maps = [content for path, content in files if path == SOURCE_MAP_NAME]
+    if not source_maps:
+        print(f"'{pack_path}' has no source map", file=sys.stderr)
+        exit(1)
+
+    interpreter = Interpreter()
+    interpreter.load_files(files)
+    report = ProfileReport(SourceMap.from_json(source_maps[0].decode()))
+    report.index_commands(interpreter.functions)
+    report.read(Path(args.report).read_text())
+    print(report.report(args.limit))
+
+
+def main():
+    if sys.argv[1:2] == ["profile-report"]:
+        profile_report(sys.argv[2:])
+        return
     parser = ArgumentParser(description="Compile .mccode files to .mcfunction")
     parser.add_argument("input", metavar="INPUT", type=str, help=".mccode file to compile")
-    parser.add_argument("-o", "--output", action="store", default="out", help="directory to store the datapack in")
+    parser.add_argument("-o", "--output", action="store", default=None,
+                        help="directory or zip file to store the datapack in (default: out or out.zip)")
+    parser.add_argument("--output-format", action="store", choices=["directory", "zip"], default="directory",
+                        help="write the datapack as a directory or stream it into a zip file")
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=1,
+                        help="number of threads used to serialize and write function files")
+    parser.add_argument("--storage-report", action="store_true",
+                        help="print which functions store their locals statically and which use a stack frame")
+    parser.add_argument("--global-layout", action="store", choices=[SEPARATE, PACKED], default=SEPARATE,
+                        help="store every global in its own objective, or pack the globals of each type into one "
+                             "shared objective that is created on load")
+    parser.add_argument("--layout-report", action="store_true",
+                        help="print which objectives store the global variables")
+    parser.add_argument("--cost-report", action="store_true",
+                        help="print the estimated number of commands each function executes per call")
+    parser.add_argument("--write-report", action="store_true",
+                        help="print how many files of the output directory were written, left unchanged and deleted")
+    parser.add_argument("--tick-budget", action="store", type=int, default=None,
+                        help="warn if the functions running every tick can execute more commands than this")
+    parser.add_argument("--max-command-chain-length", action="store", type=int,
+                        default=DEFAULT_MAX_COMMAND_CHAIN_LENGTH,
+                        help="value of the maxCommandChainLength gamerule to check tick functions against")
+    parser.add_argument("--time-phases", action="store", nargs="?", choices=["human", "json"], const="human",
+                        default=None, help="print wall time, CPU time and memory of each compiler phase to stderr")
+    parser.add_argument("--profile-data", action="store", metavar="FILE", default=None,
+                        help="JSON file mapping function names to observed call counts, used to inline hot functions "
+                             "and keep cold ones compact")
+    parser.add_argument("--cache", action="store", metavar="FILE", default=None,
+                        help=f"file to keep the generated code of every function in between builds, so only changed "
+                             f"functions are generated again (default: {CACHE_NAME} in the output directory)")
+    parser.add_argument("--no-cache", action="store_true", help="generate all functions and don't write a cache")
+    parser.add_argument("--verbose-cache", action="store_true",
+                        help="print how many functions were reused from the cache to stderr")
+    parser.add_argument("--stream", action="store_true",
+                        help="write every function as soon as it was generated and release its code, so memory use "
+                             "depends on the largest function instead of the whole pack (implies --no-cache)")
+    parser.add_argument("--profile", action="store", metavar="FILE", default=None,
+                        help="profile the compilation with cProfile and store the statistics in FILE")
 
     args = parser.parse_args()
 
@@ -21,23 +205,40 @@ if __name__ == "__main__":
         print(f"No such file: '{input_path}'", file=sys.stderr)
         exit(1)
 
-    output_path = Path(args.output)
-    if not output_path.exists():
-        output_path.mkdir()
-    if not output_path.is_dir():
-        print(f"'{output_path}' is not a directory", file=sys.stderr)
+    if args.output_format == "zip":
+        output_path = Path(args.output if args.output is not None else "out.zip")
+        if output_path.is_dir():
+            print(f"'{output_path}' is a directory", file=sys.stderr)
+            exit(1)
+    else:
+        output_path = Path(args.output if args.output is not None else "out")
+        if not output_path.exists():
+            output_path.mkdir()
+        if not output_path.is_dir():
+            print(f"'{output_path}' is not a directory", file=sys.stderr)
+            exit(1)
+
+    if args.jobs < 1:
+        print("--jobs must be at least 1", file=sys.stderr)
         exit(1)
 
-    grammar = resource_string("mcfunction_compiler.resources", "grammar.lark").decode()
-    l = Lark(grammar, parser="earley")
+    if args.stream and args.profile_data is not None:
+        print("--stream can't be used with --profile-data, inlining hot functions needs the code of all functions",
+              file=sys.stderr)
+        exit(1)
 
-    with input_path.open() as file:
-        tree = l.parse(file.read())
+    timer = PhaseTimer(args.time_phases is not None)
+    if args.profile is not None:
+        profile = cProfile.Profile()
+        profile.runcall(compile_file, args, input_path, output_path, timer)
+        profile.dump_stats(args.profile)
+    else:
+        compile_file(args, input_path, output_path, timer)
+    if args.time_phases == "json":
+        print(timer.report_json(), file=sys.stderr)
+    elif args.time_phases == "human":
+        print(timer.report(), file=sys.stderr)
 
-        t = TreeTransformer()
-        ast = t.transform(tree)
-        ast.accept(NameResolver())
-        generator = CodeGenerator()
-        ast.accept(generator)
-        generator.write_to_files(output_path)
 
+if __name__ == "__main__":
+    main()
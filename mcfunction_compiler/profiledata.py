@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from typing import Dict
+
+# Functions called at least this share of the most called function's count are hot
+HOT_SHARE = 0.1
+# Functions called less than this share of the most called function's count are cold
+COLD_SHARE = 0.001
+
+
+class ProfileData:
+    """
+    Observed invocation counts of functions, used to optimize hot functions for speed and cold ones for size.
+
+    Keys can be generated function names with or without namespace ("test:17", "17") or source function names, which
+    are the same as the names of the functions generated for them. Functions that aren't listed never ran.
+    """
+
+    def __init__(self, namespace: str, counts: Dict[str, int]):
+        self.namespace: str = namespace
+        self.counts: Dict[str, int] = {}
+        for name, count in counts.items():
+            if ":" in name:
+                function_namespace, name = name.split(":", 1)
+                if function_namespace != namespace:
+                    continue
+            self.counts[name] = self.counts.get(name, 0) + int(count)
+        self.max_count: int = max(self.counts.values(), default=0)
+
+    def count(self, function_name: str) -> int:
+        return self.counts.get(function_name, 0)
+
+    def is_hot(self, function_name: str) -> bool:
+        return self.max_count > 0 and self.count(function_name) >= self.max_count * HOT_SHARE
+
+    def is_cold(self, function_name: str) -> bool:
+        return self.count(function_name) < self.max_count * COLD_SHARE or self.count(function_name) == 0
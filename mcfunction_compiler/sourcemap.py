@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import json
+import re
+import tempfile
+from typing import IO, Dict, List, Optional, Tuple
+
+SOURCE_MAP_NAME = "mcfc-sourcemap.json"
+SOURCE_MAP_VERSION = 1
+JSON_SEPARATORS = (",", ":")
+
+# A line of a profile-results file written by /debug stop, e.g. "[03] |   |   |   function test:f(200/1) - 42.00%/3.10%"
+PROFILE_ENTRY = re.compile(r"^\[(\d+)\] ((?:\|   )*)(.*)\((\d+)/(\d+)\) - ([\d.]+)%/([\d.]+)%$")
+
+
+class SourceLocation:
+    """The construct of a source file that produced a command, and the source function it belongs to."""
+
+    def __init__(self, line: int, column: int, construct: str, function: Optional[str]):
+        self.line: int = line
+        self.column: int = column
+        self.construct: str = construct
+        self.function: Optional[str] = function
+
+    def to_list(self) -> list:
+        return [self.line, self.column, self.construct, self.function]
+
+    @staticmethod
+    def from_list(values: Optional[list]) -> Optional[SourceLocation]:
+        return SourceLocation(*values) if values is not None else None
+
+
+class SourceMap:
+    """
+    Maps every line of the generated function files to the source construct that produced it.
+
+    Helper functions also record their origin, the construct whose code generation created them, so a hot helper like
+    test:17 can be traced back to the loop or condition it was made for.
+    """
+
+    def __init__(self, source: Optional[str]):
+        self.source: Optional[str] = source
+        self.lines: Dict[str, List[Optional[SourceLocation]]] = {}
+        self.origins: Dict[str, SourceLocation] = {}
+
+    def location(self, function: str, line: int) -> Optional[SourceLocation]:
+        """Returns the source location of a line (starting at 1) of a generated function."""
+        lines = self.lines.get(function, [])
+        return lines[line - 1] if 0 < line <= len(lines) else None
+
+    def function_location(self, function: str) -> Optional[SourceLocation]:
+        """Returns the origin of a helper function or the location of the first mapped line of other functions."""
+        if function in self.origins:
+            return self.origins[function]
+        return next((location for location in self.lines.get(function, []) if location is not None), None)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "version": SOURCE_MAP_VERSION,
+            "source": self.source,
+            "functions": {name: function_entry(lines, self.origins.get(name)) for name, lines in self.lines.items()},
+        }, separators=JSON_SEPARATORS)
+
+    @staticmethod
+    def from_json(text: str) -> SourceMap:
+        data = json.loads(text)
+        source_map = SourceMap(data["source"])
+        for name, function in data["functions"].items():
+            source_map.lines[name] = [SourceLocation.from_list(location) for location in function["lines"]]
+            if function["origin"] is not None:
+                source_map.origins[name] = SourceLocation.from_list(function["origin"])
+        return source_map
+
+
+class SourceMapSpool:
+    """
+    The source map entries of functions that a streaming build already wrote, encoded in a temporary file as they
+    are added, so no location is kept for every written command. The complete source map is only built as one
+    string when it's written at the end.
+    """
+
+    def __init__(self):
+        self.file: IO[bytes] = tempfile.TemporaryFile()
+        self.count: int = 0
+
+    def add(self, name: str, lines: List[Optional[SourceLocation]], origin: Optional[SourceLocation]):
+        if self.count:
+            self.file.write(b",")
+        self.file.write(entry_json(name, lines, origin).encode())
+        self.count += 1
+
+    def to_json(self, source_map: SourceMap) -> str:
+        """Returns the JSON of a source map with the spooled functions before the functions of source_map."""
+        self.file.seek(0)
+        entries = [self.file.read().decode()] if self.count else []
+        entries += [entry_json(name, lines, source_map.origins.get(name)) for name, lines in source_map.lines.items()]
+        # The header is the same as SourceMap.to_json writes it, with the entries spliced into "functions"
+        header = json.dumps({"version": SOURCE_MAP_VERSION, "source": source_map.source, "functions": {}},
+                            separators=JSON_SEPARATORS)
+        return f"{header[:-2]}{','.join(entries)}}}}}"
+
+
+def function_entry(lines: List[Optional[SourceLocation]], origin: Optional[SourceLocation]) -> dict:
+    return {
+        "origin": origin.to_list() if origin is not None else None,
+        "lines": [location.to_list() if location is not None else None for location in lines],
+    }
+
+
+def entry_json(name: str, lines: List[Optional[SourceLocation]], origin: Optional[SourceLocation]) -> str:
+    """Returns the entry of a function as it appears in the "functions" object of the source map."""
+    return json.dumps({name: function_entry(lines, origin)}, separators=JSON_SEPARATORS)[1:-1]
+
+
+class ProfileReport:
+    """
+    Attributes the entries of a Minecraft profile-results file (/debug start and /debug stop) to source functions
+    and lines.
+
+    Function entries ("function ns:name") are attributed to the origin of the function. Command entries are
+    attributed to every generated line with that exact command, split evenly if a command occurs more than once.
+    Costs are percentages of the total profiled time, excluding the time of nested entries, so nothing is counted
+    twice. Other entries are ignored.
+    """
+
+    def __init__(self, source_map: SourceMap):
+        self.source_map: SourceMap = source_map
+        self.commands: Dict[str, List[Tuple[str, int]]] = {}
+        self.functions: Dict[str, Tuple[float, int]] = {}
+        self.lines: Dict[Tuple[Optional[str], int], Tuple[float, int]] = {}
+        self.unattributed: float = 0
+
+    def index_commands(self, functions: Dict[str, List[str]]):
+        """Remembers where each command of the generated pack occurs, so command entries can be attributed."""
+        for name, commands in functions.items():
+            for line, command in enumerate(commands, 1):
+                self.commands.setdefault(command, []).append((name, line))
+
+    def read(self, text: str):
+        entries = []
+        # Each entry is [depth, name, count, cost], cost becomes the time spent outside of the children
+        stack = []
+        for line in text.splitlines():
+            match = PROFILE_ENTRY.match(line.rstrip())
+            if not match:
+                continue
+            entry = [int(match.group(1)), match.group(3), int(match.group(4)), float(match.group(7))]
+            while stack and stack[-1][0] >= entry[0]:
+                stack.pop()
+            if stack:
+                stack[-1][3] -= entry[3]
+            stack.append(entry)
+            entries.append(entry)
+        for _, name, count, cost in entries:
+            if name.startswith("function "):
+                self.add(self.source_map.function_location(name[len("function "):]), cost, count)
+            elif name in self.commands:
+                occurrences = self.commands[name]
+                for function, line in occurrences:
+                    self.add(self.source_map.location(function, line), cost / len(occurrences), count)
+
+    def add(self, location: Optional[SourceLocation], cost: float, count: int):
+        if location is None:
+            self.unattributed += cost
+            return
+        key = location.function or "<global>"
+        total_cost, total_count = self.functions.get(key, (0, 0))
+        self.functions[key] = (total_cost + cost, total_count + count)
+        key = (location.function, location.line)
+        total_cost, total_count = self.lines.get(key, (0, 0))
+        self.lines[key] = (total_cost + cost, total_count + count)
+
+    def report(self, limit: int = 20) -> str:
+        source = self.source_map.source or "<unknown>"
+        lines = ["Cost per source function:"]
+        for function, (cost, count) in sorted(self.functions.items(), key=lambda item: -item[1][0]):
+            lines.append(f"  {cost:7.2f}%  {count:8d}  {function}")
+        lines.append("Most expensive source lines:")
+        for (function, line), (cost, count) in sorted(self.lines.items(), key=lambda item: -item[1][0])[:limit]:
+            lines.append(f"  {cost:7.2f}%  {count:8d}  {source}:{line} ({function or '<global>'})")
+        if self.unattributed:
+            lines.append(f"Not attributable to the source map: {self.unattributed:.2f}%")
+        return "\n".join(lines)
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from typing import Dict, TYPE_CHECKING, List
+import sys
+from typing import Dict, TYPE_CHECKING, List, Optional
 
 from exception import UndeclaredVariableException, UndeclaredFunctionException, UndeclaredTypeException
 from helper import Singleton
@@ -8,6 +9,9 @@ from helper import Singleton
 if TYPE_CHECKING:
     from constructs import Namespace, VariableReference, TypeReference, FunctionReference
 
+STACK_FRAME = "@e[type=armor_stand,tag=stack_frame,scores={mcfc.stack_depth=1},limit=1]"
+CALL_OBJECTIVE = "mcfc.call"
+
 
 class Variable:
     def __init__(self, namespace: Namespace, name: str, type_: Type):
@@ -15,8 +19,19 @@ class Variable:
         self.name: str = name
         self.type: Type = type_
         self.compiled_name: str = None
+        # Variables of array types consist of one variable per element
+        self.elements: Optional[List[Variable]] = None
 
     def get_identifier(self) -> str:
+        """
+        Returns the score holder and objective of this variable. It's computed on first use and then cached, so it
+        must not be requested before the call graph has decided how the function stores its locals.
+        """
+        if self.compiled_name is None:
+            self.compiled_name = sys.intern(self.compile_identifier())
+        return self.compiled_name
+
+    def compile_identifier(self) -> str:
         raise NotImplementedError
 
     def get_type(self) -> Type:
@@ -27,11 +42,30 @@ class Function:
     def __init__(self, namespace: Namespace, name: str):
         self.namespace: Namespace = namespace
         self.name: str = name
+        self.recursive: bool = False
+        self.runs_as_frame: bool = False
+        # Whether a sliced loop or the statements after it depend on the executing entity
+        self.sliced_context_dependent: bool = False
+        self.parameters: List[Variable] = []
+        self.return_type: Optional[Type] = None
 
     def get_identifier(self) -> str:
         raise NotImplementedError
 
 
+class CallRegister(Variable):
+    """
+    A fixed fake player that passes a value between a caller and the function it calls. Arguments of reentrant
+    functions are passed in arg0, arg1, ..., return values of all functions in return.
+    """
+
+    def __init__(self, name: str, type_: Type):
+        super().__init__(None, name, type_)
+
+    def compile_identifier(self) -> str:
+        return f"#{self.name} {CALL_OBJECTIVE}"
+
+
 class Type:
     def __init__(self, namespace: Namespace, name: str):
         self.namespace: Namespace = namespace
@@ -80,7 +114,16 @@ class GlobalScope(Scope):
         self.types["boolean"] = BooleanType()
 
     def declare_variable(self, name: str, type_: Type):
-        self.variables[name] = self.GlobalVariable(self.namespace, name, type_)
+        variable = self.GlobalVariable(self.namespace, name, type_)
+        if isinstance(type_, ArrayType):
+            variable.elements = []
+            for index in range(type_.size):
+                element = self.GlobalVariable(self.namespace, f"{name}.{index}", type_.element_type)
+                # The elements share one objective instead of creating one per element
+                element.holder = f"#{index}"
+                element.objective = f"{self.namespace.reference.name}.{name}"
+                variable.elements.append(element)
+        self.variables[name] = variable
 
     def declare_function(self, name: str):
         self.functions[name] = self.GlobalFunction(self.namespace, name)
@@ -89,7 +132,15 @@ class GlobalScope(Scope):
         raise NotImplementedError
 
     class GlobalVariable(Variable):
-        def get_identifier(self) -> str:
+        def __init__(self, namespace: Namespace, name: str, type_: Type):
+            super().__init__(namespace, name, type_)
+            # Set by the GlobalLayout if the variable shares an objective with other globals
+            self.holder: Optional[str] = None
+            self.objective: Optional[str] = None
+
+        def compile_identifier(self) -> str:
+            if self.objective is not None:
+                return f"{self.holder} {self.objective}"
             return f"global {self.namespace.reference.name}.{self.name}"
 
     class GlobalFunction(Function):
@@ -101,12 +152,18 @@ class GlobalScope(Scope):
 
 
 class BlockScope(Scope):
-    def __init__(self, namespace: Namespace):
+    def __init__(self, namespace: Namespace, function: Function):
         super().__init__()
         self.namespace: Namespace = namespace
+        self.function: Function = function
 
     def declare_variable(self, name: str, type_: Type):
-        self.variables[name] = self.LocalVariable(self.namespace, name, type_)
+        variable = self.LocalVariable(self.namespace, name, type_, self.function)
+        if isinstance(type_, ArrayType):
+            # Frames are entities, so elements can't be told apart by their holder and each needs an objective
+            variable.elements = [self.LocalVariable(self.namespace, f"{name}.{index}", type_.element_type,
+                                                    self.function) for index in range(type_.size)]
+        self.variables[name] = variable
 
     def declare_function(self, name: str):
         raise NotImplementedError
@@ -115,8 +172,17 @@ class BlockScope(Scope):
         raise NotImplementedError
 
     class LocalVariable(Variable):
-        def get_identifier(self) -> str:
-            return f"@e[type=armor_stand,tag=stack_frame,scores={{mcfc.stack_depth=1}},limit=1] {self.namespace.name}.{self.name}"
+        def __init__(self, namespace: Namespace, name: str, type_: Type, function: Function):
+            super().__init__(namespace, name, type_)
+            self.function: Function = function
+
+        def compile_identifier(self) -> str:
+            # Only functions that can be reentered need a stack frame. All others store their locals on a fake player.
+            if self.function.runs_as_frame:
+                return f"@s {self.namespace.name}.{self.name}"
+            if self.function.recursive:
+                return f"{STACK_FRAME} {self.namespace.name}.{self.name}"
+            return f"#{self.function.name} {self.namespace.name}.{self.name}"
 
 
 class ClassScope(Scope):
@@ -139,6 +205,21 @@ class BooleanType(BuiltinType, metaclass=Singleton):
         super().__init__("boolean")
 
 
+class ArrayType(Type):
+    """A fixed number of elements of a builtin type."""
+
+    def __init__(self, element_type: Type, size: int):
+        super().__init__(None, f"{element_type.name}[{size}]")
+        self.element_type: Type = element_type
+        self.size: int = size
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ArrayType) and self.element_type == other.element_type and self.size == other.size
+
+    def __hash__(self) -> int:
+        return hash((self.element_type, self.size))
+
+
 class SymbolTable:
     def __init__(self):
         self.stack: List[Scope] = []
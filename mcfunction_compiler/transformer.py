@@ -7,6 +7,16 @@ from constructs import *
 
 
 class TreeTransformer(Transformer):
+    def _call_userfunc(self, tree, new_children=None):
+        result = super()._call_userfunc(tree, new_children)
+        # Positions are only available if the parser was created with propagate_positions=True
+        if isinstance(result, Construct) and result.line is None and not tree.meta.empty:
+            result.line = tree.meta.line
+            result.column = tree.meta.column
+            result.start_pos = tree.meta.start_pos
+            result.end_pos = tree.meta.end_pos
+        return result
+
     def start(self, args: List[Any]):
         for arg in args:
             assert isinstance(arg, Construct)
@@ -37,12 +47,19 @@ class TreeTransformer(Transformer):
         assert isinstance(args[1], FunctionReference)
         return Event(args[0], args[1])
 
+    def return_type(self, args: List[Any]):
+        if not args:
+            return None
+        assert isinstance(args[0], TypeReference)
+        return args[0]
+
     def function_declaration(self, args: List[Any]):
         assert isinstance(args[0], FunctionReference)
         assert isinstance(args[1], ArgumentsDeclaration)
-        assert isinstance(args[2], Events)
-        assert isinstance(args[3], Block)
-        return FunctionDeclaration(args[0], args[1], args[2], args[3])
+        assert args[2] is None or isinstance(args[2], TypeReference)
+        assert isinstance(args[3], Events)
+        assert isinstance(args[4], Block)
+        return FunctionDeclaration(args[0], args[1], args[3], args[4], args[2])
 
     def variable_declaration(self, args: List[Any]):
         assert isinstance(args[0], TypeReference)
@@ -73,11 +90,96 @@ class TreeTransformer(Transformer):
         assert isinstance(args[0], Expression)
         return ReturnStatement(args[0])
 
+    def if_statement(self, args: List[Any]):
+        assert isinstance(args[0], Expression)
+        assert isinstance(args[1], Statement)
+        if len(args) > 2:
+            assert isinstance(args[2], Statement)
+            return IfStatement(args[0], args[1], args[2])
+        else:
+            return IfStatement(args[0], args[1], None)
+
+    def while_statement(self, args: List[Any]):
+        assert isinstance(args[0], Expression)
+        assert args[1] is None or isinstance(args[1], int)
+        assert isinstance(args[2], Statement)
+        return WhileStatement(args[0], args[2], args[1])
+
+    def for_statement(self, args: List[Any]):
+        assert args[0] is None or isinstance(args[0], Statement)
+        assert args[1] is None or isinstance(args[1], Expression)
+        assert args[2] is None or isinstance(args[2], Expression)
+        assert args[3] is None or isinstance(args[3], int)
+        assert isinstance(args[4], Statement)
+        # A missing condition loops forever
+        condition = args[1] if args[1] is not None else Constant(Token("BOOLEAN", "true"))
+        return ForStatement(args[0], condition, args[2], args[4], args[3])
+
+    def switch_statement(self, args: List[Any]):
+        assert isinstance(args[0], Expression)
+        for arg in args[1:]:
+            assert isinstance(arg, SwitchCase)
+        return SwitchStatement(args[0], args[1:])
+
+    def switch_case(self, args: List[Any]):
+        # The labels come first, a default label is None
+        labels = [arg for arg in args if not isinstance(arg, Statement)]
+        statements = args[len(labels):]
+        for arg in statements:
+            assert isinstance(arg, Statement)
+        return SwitchCase([label for label in labels if label is not None], None in labels, Block(statements))
+
+    def case_label(self, args: List[Any]):
+        assert isinstance(args[0], int)
+        return args[0]
+
+    def default_label(self, args: List[Any]):
+        return None
+
+    def case_value(self, args: List[Any]):
+        assert isinstance(args[0], Token)
+        assert args[0].type == "INT"
+        return int(args[0])
+
+    def negative_case_value(self, args: List[Any]):
+        return -self.case_value(args)
+
+    def for_init(self, args: List[Any]):
+        if not args:
+            return None
+        if isinstance(args[0], VariableDeclaration):
+            return args[0]
+        assert isinstance(args[0], Expression)
+        return ExpressionStatement(args[0])
+
+    def for_condition(self, args: List[Any]):
+        return args[0] if args else None
+
+    def for_update(self, args: List[Any]):
+        return args[0] if args else None
+
+    def loop_slice(self, args: List[Any]):
+        if not args:
+            return None
+        assert isinstance(args[0], Token)
+        assert args[0].type == "INT"
+        return int(args[0])
+
     def assignment(self, args: List[Any]):
         assert isinstance(args[0], VariableReference)
         assert isinstance(args[1], Expression)
         return Assignment(args[0], args[1])
 
+    def array_access(self, args: List[Any]):
+        assert isinstance(args[0], VariableReference)
+        assert isinstance(args[1], Expression)
+        return ArrayAccess(args[0], args[1])
+
+    def array_assignment(self, args: List[Any]):
+        assert isinstance(args[0], ArrayAccess)
+        assert isinstance(args[1], Expression)
+        return ArrayAssignment(args[0], args[1])
+
     def or_operation(self, args: List[Any]):
         assert isinstance(args[0], Expression)
         assert isinstance(args[1], Expression)
@@ -155,6 +257,18 @@ class TreeTransformer(Transformer):
         assert isinstance(args[0], Expression)
         return UnaryNotOperation(args[0])
 
+    def arguments(self, args: List[Any]):
+        for arg in args:
+            assert isinstance(arg, Expression)
+        return args
+
+    def call(self, args: List[Any]):
+        assert isinstance(args[0], FunctionReference)
+        if len(args) > 1:
+            assert isinstance(args[1], list)
+            return Call(args[0], args[1])
+        return Call(args[0], [])
+
     def run_expression(self, args: List[Any]):
         assert isinstance(args[0], Token)
         assert args[0].type == "STRING"
@@ -163,6 +277,9 @@ class TreeTransformer(Transformer):
     def type_ref(self, args: List[Any]):
         assert isinstance(args[0], Token)
         assert args[0].type == "IDENTIFIER"
+        if len(args) > 1:
+            assert args[1].type == "INT"
+            return TypeReference(args[0], int(args[1]))
         return TypeReference(args[0])
 
     def function_ref(self, args: List[Any]):
@@ -1,12 +1,22 @@
-from typing import Any
+from typing import Any, List, Optional
 
-from constructs import FunctionReference, Namespace, Construct, FunctionDeclaration, Block, VariableDeclaration, \
+from constructs import Namespace, Construct, FunctionDeclaration, Block, VariableDeclaration, \
     TypeReference, VariableReference, Assignment, Expression, OrOperation, AndOperation, EqualityOperation, \
     UnequalityOperation, LessThenOperation, LessThenEqualsOperation, GreaterThenOperation, GreaterThenEqualsOperation, \
     AdditionOperation, SubtractionOperation, MultiplicationOperation, DivisionOperation, UnaryPlusOperation, \
-    UnaryMinusOperation, UnaryNotOperation, ModuloOperation
-from exception import BadOperandException
-from symboltable import SymbolTable, BlockScope, GlobalScope, BooleanType, IntType
+    UnaryMinusOperation, UnaryNotOperation, ModuloOperation, IfStatement, RunExpression, \
+    WhileStatement, ForStatement, Start, Call, ReturnStatement, ArrayAccess, ArrayAssignment, Constant, \
+    SwitchStatement, ExpressionStatement
+from exception import BadOperandException, TypeMissmatchException, InvalidReturnException, InvalidIndexException, \
+    DuplicateCaseException
+from helper import FUNCTION_COMMAND
+from incremental import BuildCache, FunctionDependencies
+from symboltable import SymbolTable, BlockScope, GlobalScope, BooleanType, IntType, Function, ArrayType
+
+
+# Builtin functions that are compiled to scoreboard operations, with their number of arguments. Functions declared
+# with the same name take precedence.
+INTRINSICS = {"min": 2, "max": 2, "abs": 1, "clamp": 3, "swap": 2}
 
 
 class Visitor:
@@ -18,9 +28,22 @@ class Visitor:
 
 
 class NameResolver(Visitor):
-    def __init__(self):
+    """
+    Resolves names and checks types. Records what every function depends on, and with a build cache skips the bodies
+    of functions that can reuse the code of the previous build.
+    """
+
+    def __init__(self, cache: Optional[BuildCache] = None):
         self.namespace_: Namespace = None
+        self.function_: Function = None
+        self.body: Optional[Block] = None
+        # The expression whose value is discarded, the only place a call without a value can be used
+        self.discarded: Optional[Expression] = None
+        self.dependencies: Optional[FunctionDependencies] = None
         self.table: SymbolTable = SymbolTable()
+        self.cache: Optional[BuildCache] = cache
+        self.declarations: List[FunctionDeclaration] = []
+        self.cached_declarations: List[FunctionDeclaration] = []
 
     def __default__(self, construct: Construct):
         for child in construct.children:
@@ -31,39 +54,199 @@ class NameResolver(Visitor):
         namespace.name = namespace.reference.name
         self.table.push(GlobalScope(self.namespace_))
 
-    def function_declaration(self, function_: FunctionDeclaration):
-        self.table.declare_function(function_.reference)
-        for child in (x for x in function_.children if not isinstance(x, FunctionReference)):
+    def start(self, start: Start):
+        start.children[0].accept(self)
+        # Functions can be called before they are declared, so all signatures are known before any body is resolved
+        for child in start.children:
+            if isinstance(child, FunctionDeclaration):
+                self.declare_function(child)
+        for child in start.children[1:]:
             child.accept(self)
 
+    def declare_function(self, declaration: FunctionDeclaration):
+        self.table.declare_function(declaration.reference)
+        function_ = self.table.search_function(declaration.reference.name)
+        declaration.reference.target = function_
+        for argument in declaration.arguments.arguments:
+            argument.type_ref.accept(self)
+            if isinstance(argument.type_ref.type, ArrayType):
+                raise TypeMissmatchException(f"Argument '{argument.reference.name}' of function "
+                                             f"'{function_.name}' can't be an array")
+            argument.reference.target = BlockScope.LocalVariable(self.namespace_, argument.reference.name,
+                                                                 argument.type_ref.type, function_)
+            argument.reference.type = argument.type_ref.type
+            function_.parameters.append(argument.reference.target)
+        if declaration.return_type is not None:
+            declaration.return_type.accept(self)
+            if isinstance(declaration.return_type.type, ArrayType):
+                raise TypeMissmatchException(f"Function '{function_.name}' can't return an array")
+            function_.return_type = declaration.return_type.type
+        self.declarations.append(declaration)
+
+    def function_declaration(self, function_: FunctionDeclaration):
+        if self.cache is not None:
+            function_.cached = self.cache.lookup(function_, self.table.stack[-1])
+        if function_.cached is not None:
+            function_.dependencies = function_.cached.dependencies
+            function_.environment = function_.cached.environment
+            self.cached_declarations.append(function_)
+        else:
+            self.resolve_body(function_)
+
+    def resolve_body(self, function_: FunctionDeclaration):
+        self.function_ = function_.reference.target
+        self.body = function_.block
+        self.dependencies = FunctionDependencies()
+        parameters = BlockScope(self.namespace_, self.function_)
+        for parameter in self.function_.parameters:
+            parameters.variables[parameter.name] = parameter
+        self.table.push(parameters)
+        function_.block.accept(self)
+        self.table.pop()
+        if self.function_.return_type is not None and \
+                not (function_.block.statements and isinstance(function_.block.statements[-1], ReturnStatement)):
+            raise InvalidReturnException(f"Function '{self.function_.name}' must end with a return statement")
+        function_.dependencies = self.dependencies
+        # Functions can't declare globals, so the global scope is the same as before the body
+        function_.environment = self.dependencies.environment(self.table.stack[0])
+        self.dependencies = None
+        self.body = None
+        self.function_ = None
+
+    def resolve_changed_storage(self):
+        """
+        Records how every function and the functions it calls store their locals, once the call graph decided it.
+        Skipped functions for which this changed since the previous build are resolved now. Their environment is
+        unchanged, so resolving them late gives the same result.
+        """
+        for declaration in self.declarations:
+            declaration.storage = declaration.dependencies.storage(declaration.reference.target, self.table.stack[0])
+        for declaration in self.cached_declarations:
+            if declaration.cached.storage != declaration.storage:
+                declaration.cached = None
+                self.resolve_body(declaration)
+        self.cached_declarations = [declaration for declaration in self.cached_declarations
+                                    if declaration.cached is not None]
+
     def block(self, block: Block):
-        self.table.push(BlockScope(self.namespace_))
+        self.table.push(BlockScope(self.namespace_, self.function_))
         self.__default__(block)
         self.table.pop()
 
     def variable_declaration(self, declaration: VariableDeclaration):
         declaration.type_ref.accept(self)
         self.table.declare_variable(declaration.reference, declaration.type_ref.type)
-        declaration.reference.accept(self)
+        self.resolve_variable(declaration.reference)
         if declaration.expression is not None:
             declaration.expression.accept(self)
+            if isinstance(declaration.reference.type, ArrayType):
+                raise TypeMissmatchException(f"Array '{declaration.reference.name}' can't be initialised")
 
     #def class_declaration(self, declaration: ClassDeclaration):
     #    self.table.declare_class(declaration.reference)
 
     def type_ref(self, ref: TypeReference):
         ref.type = self.table.search_type(ref.name)
+        if ref.size is not None:
+            if ref.size < 1:
+                raise TypeMissmatchException("Arrays must have at least one element")
+            ref.type = ArrayType(ref.type, ref.size)
+        if self.dependencies is not None:
+            self.dependencies.types_used.add(ref.name)
 
     def variable_ref(self, ref: VariableReference):
+        self.resolve_variable(ref)
+        if isinstance(ref.type, ArrayType):
+            raise TypeMissmatchException(f"Array '{ref.name}' can only be used with an index")
+        if self.dependencies is not None and isinstance(ref.target, GlobalScope.GlobalVariable):
+            self.dependencies.globals_read.add(ref.name)
+
+    def resolve_variable(self, ref: VariableReference):
         ref.target = self.table.search_variable(ref.name)
         ref.type = ref.target.type
 
+    def if_statement(self, statement: IfStatement):
+        self.__default__(statement)
+        if statement.condition.type != BooleanType():
+            raise TypeMissmatchException("Condition of if statement must be of type 'boolean'")
+
+    def while_statement(self, statement: WhileStatement):
+        self.__default__(statement)
+        if statement.condition.type != BooleanType():
+            raise TypeMissmatchException("Condition of while loop must be of type 'boolean'")
+
+    def expression_statement(self, statement: ExpressionStatement):
+        self.discarded = statement.expression
+        self.__default__(statement)
+        self.discarded = None
+
+    def for_statement(self, statement: ForStatement):
+        # Variables declared in the head of the loop are only visible inside the loop
+        self.table.push(BlockScope(self.namespace_, self.function_))
+        for child in statement.children:
+            # Like an expression statement, the update is only run for its effects
+            self.discarded = child if child is statement.update else None
+            child.accept(self)
+        self.discarded = None
+        self.table.pop()
+        if statement.condition.type != BooleanType():
+            raise TypeMissmatchException("Condition of for loop must be of type 'boolean'")
+
+    def switch_statement(self, statement: SwitchStatement):
+        self.__default__(statement)
+        if statement.expression.type != IntType():
+            raise TypeMissmatchException("Expression of switch statement must be of type 'int'")
+        values = set()
+        defaults = 0
+        for case in statement.cases:
+            for value in case.values:
+                if value in values:
+                    raise DuplicateCaseException(f"Duplicate case {value} in switch statement")
+                values.add(value)
+            defaults += case.default
+        if defaults > 1:
+            raise DuplicateCaseException("Switch statement has more than one default case")
+
     def assignment(self, assignment: Assignment):
-        self.__default__(assignment)
+        self.resolve_variable(assignment.ref)
+        if isinstance(assignment.ref.type, ArrayType):
+            raise TypeMissmatchException(f"Array '{assignment.ref.name}' can only be assigned element by element")
+        if self.dependencies is not None and isinstance(assignment.ref.target, GlobalScope.GlobalVariable):
+            self.dependencies.globals_written.add(assignment.ref.name)
+        assignment.expression.accept(self)
         if assignment.ref.type != assignment.expression.type:
             raise BadOperandException("=", assignment.ref.type, assignment.expression.type)
         assignment.type = assignment.ref.type
 
+    def array_access(self, access: ArrayAccess):
+        self.resolve_variable(access.reference)
+        if self.dependencies is not None and isinstance(access.reference.target, GlobalScope.GlobalVariable):
+            self.dependencies.globals_read.add(access.reference.name)
+        self.resolve_index(access)
+
+    def array_assignment(self, assignment: ArrayAssignment):
+        access = assignment.access
+        self.resolve_variable(access.reference)
+        if self.dependencies is not None and isinstance(access.reference.target, GlobalScope.GlobalVariable):
+            self.dependencies.globals_written.add(access.reference.name)
+        self.resolve_index(access)
+        assignment.expression.accept(self)
+        if access.type != assignment.expression.type:
+            raise BadOperandException("=", access.type, assignment.expression.type)
+        assignment.type = access.type
+
+    def resolve_index(self, access: ArrayAccess):
+        array_type = access.reference.type
+        if not isinstance(array_type, ArrayType):
+            raise TypeMissmatchException(f"'{access.reference.name}' is not an array")
+        access.index.accept(self)
+        if access.index.type != IntType():
+            raise TypeMissmatchException("Array index must be of type 'int'")
+        if isinstance(access.index, Constant) and not 0 <= int(access.index.value) < array_type.size:
+            raise InvalidIndexException(f"Index {access.index.value} is out of bounds for array "
+                                        f"'{access.reference.name}' of size {array_type.size}")
+        access.type = array_type.element_type
+
     def or_operation(self, expression: OrOperation):
         self.__default__(expression)
         if expression.left_expression.type != BooleanType() or expression.right_expression.type != BooleanType():
@@ -142,17 +325,89 @@ class NameResolver(Visitor):
             raise BadOperandException("%", expression.left_expression.type, expression.right_expression.type)
         expression.type = IntType()
 
+    def run_expression(self, expression: RunExpression):
+        # Used as a value, a command evaluates to its result
+        expression.type = IntType()
+        if self.dependencies is not None:
+            self.dependencies.functions_called.update(name for namespace, name in
+                                                      FUNCTION_COMMAND.findall(expression.command)
+                                                      if namespace == self.namespace_.name)
+
+    def call(self, call: Call):
+        if call.reference.name in INTRINSICS and not self.table.stack[0].has_function(call.reference.name):
+            self.intrinsic(call)
+            return
+        function_ = self.table.search_function(call.reference.name)
+        call.reference.target = function_
+        for argument in call.arguments:
+            argument.accept(self)
+        if len(call.arguments) != len(function_.parameters):
+            raise TypeMissmatchException(f"Function '{function_.name}' takes {len(function_.parameters)} arguments, "
+                                         f"but {len(call.arguments)} were given")
+        for argument, parameter in zip(call.arguments, function_.parameters):
+            if argument.type != parameter.type:
+                raise TypeMissmatchException(f"Argument '{parameter.name}' of function '{function_.name}' must be of "
+                                             f"type '{parameter.type.name}'")
+        call.type = function_.return_type
+        if call.type is None and call is not self.discarded:
+            raise TypeMissmatchException(f"Function '{function_.name}' doesn't return a value")
+        if self.dependencies is not None:
+            self.dependencies.functions_called.add(function_.name)
+
+    def intrinsic(self, call: Call):
+        name = call.reference.name
+        call.intrinsic = name
+        for argument in call.arguments:
+            argument.accept(self)
+        if len(call.arguments) != INTRINSICS[name]:
+            raise TypeMissmatchException(f"Intrinsic '{name}' takes {INTRINSICS[name]} arguments, "
+                                         f"but {len(call.arguments)} were given")
+        if self.dependencies is not None:
+            # A function declared with the same name later would replace the intrinsic
+            self.dependencies.functions_called.add(name)
+        if name == "swap":
+            for argument in call.arguments:
+                if not isinstance(argument, VariableReference):
+                    raise TypeMissmatchException("Arguments of intrinsic 'swap' must be variables")
+                if self.dependencies is not None and isinstance(argument.target, GlobalScope.GlobalVariable):
+                    self.dependencies.globals_written.add(argument.name)
+            if call.arguments[0].type != call.arguments[1].type:
+                raise BadOperandException("swap", call.arguments[0].type, call.arguments[1].type)
+            # Like a function without a return type, swap has no value
+            if call is not self.discarded:
+                raise TypeMissmatchException("Intrinsic 'swap' doesn't return a value")
+            call.type = None
+            return
+        for argument in call.arguments:
+            if argument.type != IntType():
+                raise TypeMissmatchException(f"Arguments of intrinsic '{name}' must be of type 'int'")
+        call.type = IntType()
+
+    def return_statement(self, statement: ReturnStatement):
+        self.__default__(statement)
+        if self.function_.return_type is None:
+            raise TypeMissmatchException(f"Function '{self.function_.name}' doesn't return a value")
+        if statement.expression.type != self.function_.return_type:
+            raise TypeMissmatchException(f"Function '{self.function_.name}' must return a value of type "
+                                         f"'{self.function_.return_type.name}'")
+        # Functions can't stop early, every command after a return would still run
+        if statement is not self.body.statements[-1]:
+            raise InvalidReturnException(f"Return must be the last statement of function '{self.function_.name}'")
+
     def unary_plus_operation(self, expression: UnaryPlusOperation):
+        self.__default__(expression)
         if expression.expression.type != IntType():
             raise BadOperandException("+", expression.expression.type)
         expression.type = IntType()
 
     def unary_minus_operation(self, expression: UnaryMinusOperation):
+        self.__default__(expression)
         if expression.expression.type != IntType():
             raise BadOperandException("-", expression.expression.type)
         expression.type = IntType()
 
     def unary_not_operation(self, expression: UnaryNotOperation):
+        self.__default__(expression)
         if expression.expression.type != BooleanType():
             raise BadOperandException("!", expression.expression.type)
         expression.type = BooleanType()
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, Tuple
+
+MANIFEST_NAME = ".mcfc-manifest.json"
+# Zip files can't store timestamps before 1980. Using a fixed one makes archives reproducible.
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
+class PackWriter:
+    """Receives the files of a datapack as paths relative to the root of the pack."""
+
+    # Whether write() may be called from several threads at once
+    thread_safe: bool = False
+
+    def write(self, path: str, content: bytes):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        """Called instead of close() when the build failed."""
+        pass
+
+
+def default_mode() -> int:
+    """Returns the mode open() gives new files. Temporary files are only readable by their owner."""
+    # The umask can only be read by replacing it
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def write_all(writer: PackWriter, files: Iterable[Tuple[str, bytes]], jobs: int = 1):
+    """Writes files in order, or with a pool of worker threads if there are several jobs and the writer allows it."""
+    if jobs <= 1 or not writer.thread_safe:
+        for path, content in files:
+            writer.write(path, content)
+    else:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # list() re-raises the first exception of a worker
+            list(executor.map(lambda file: writer.write(*file), files))
+
+
+class DirectoryWriter(PackWriter):
+    """
+    Writes a datapack into a directory, only touching files whose content changed since the last build.
+
+    A manifest with the hashes of all written files is kept in the output directory. Files that were written by the
+    previous build but not by this one are deleted, files not listed in the manifest are never touched.
+    Changed files are written to a temporary file first and then renamed, so readers never see partial files.
+    Before the first file is changed, the manifest is invalidated. A build that fails halfway, like a streaming build
+    with an error in a later function, then can't make the next build skip files whose content it changed.
+    """
+
+    thread_safe = True
+
+    def __init__(self, directory: Path):
+        self.directory: Path = directory
+        self.previous: Dict[str, str] = self.read_manifest()
+        self.current: Dict[str, str] = {}
+        self.written: int = 0
+        self.unchanged: int = 0
+        self.deleted: int = 0
+        self.invalidated: bool = False
+        # Read once, setting the umask from several threads would race
+        self.mode: int = default_mode()
+        self.lock: threading.Lock = threading.Lock()
+
+    def read_manifest(self) -> Dict[str, str]:
+        manifest = self.directory.joinpath(MANIFEST_NAME)
+        if not manifest.exists():
+            return {}
+        with manifest.open() as manifest_file:
+            return json.load(manifest_file)
+
+    def write(self, path: str, content: bytes):
+        digest = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            self.current[path] = digest
+        target = self.directory.joinpath(PurePosixPath(path))
+        if self.previous.get(path) == digest and target.exists():
+            with self.lock:
+                self.unchanged += 1
+            return
+        self.invalidate_manifest()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        self.replace(target, content)
+        with self.lock:
+            self.written += 1
+
+    def invalidate_manifest(self):
+        """
+        Replaces the hashes of the previous build with empty ones, so all its files count as changed until this build
+        wrote a new manifest. They are still listed, so files this build doesn't write are deleted by the next one.
+        """
+        with self.lock:
+            if self.invalidated:
+                return
+            manifest = json.dumps({path: "" for path in self.previous}, indent=4, sort_keys=True).encode()
+            self.replace(self.directory.joinpath(MANIFEST_NAME), manifest)
+            self.invalidated = True
+
+    def close(self):
+        for path in sorted(set(self.previous) - set(self.current)):
+            target = self.directory.joinpath(PurePosixPath(path))
+            if target.exists():
+                target.unlink()
+                self.deleted += 1
+            self.remove_empty_parents(target)
+        manifest = json.dumps(self.current, indent=4, sort_keys=True).encode()
+        self.replace(self.directory.joinpath(MANIFEST_NAME), manifest)
+
+    def remove_empty_parents(self, path: Path):
+        parent = path.parent
+        while parent != self.directory and parent.exists() and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+    def replace(self, target: Path, content: bytes):
+        file_descriptor, temporary = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as temporary_file:
+                temporary_file.write(content)
+            os.chmod(temporary, self.mode)
+            os.replace(temporary, target)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def summary(self) -> str:
+        return f"{self.written} files written, {self.unchanged} unchanged, {self.deleted} deleted"
+
+
+class ZipWriter(PackWriter):
+    """
+    Streams a datapack directly into a zip file.
+
+    Entries are written in the order they are received with a fixed timestamp and permissions, so identical input
+    produces byte-identical archives. Only the zip directory is kept in memory until the archive is closed.
+    """
+
+    def __init__(self, path: Path):
+        self.path: Path = path
+        file_descriptor, self.temporary = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        os.close(file_descriptor)
+        self.mode: int = default_mode()
+        self.archive: zipfile.ZipFile = zipfile.ZipFile(self.temporary, "w", zipfile.ZIP_DEFLATED)
+
+    def write(self, path: str, content: bytes):
+        info = zipfile.ZipInfo(path, ZIP_TIMESTAMP)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        self.archive.writestr(info, content)
+
+    def close(self):
+        self.archive.close()
+        os.chmod(self.temporary, self.mode)
+        os.replace(self.temporary, self.path)
+
+    def abort(self):
+        """Deletes the unfinished archive, the previous one at the path stays untouched."""
+        try:
+            self.archive.close()
+        finally:
+            # Already gone if close() failed after renaming it
+            if os.path.exists(self.temporary):
+                os.unlink(self.temporary)
@@ -0,0 +1,37 @@
+from functools import lru_cache
+
+from lark import Lark
+from pkg_resources import resource_string
+
+from callgraph import CallGraph
+from codegeneration import CodeGenerator
+from constructs import Start
+from layout import GlobalLayout
+from transformer import TreeTransformer
+from visitor import NameResolver
+
+
+@lru_cache()
+def parser() -> Lark:
+    """Returns the parser the compiler uses. Building it takes a while, so it's shared by all tests."""
+    return Lark(resource_string("resources", "grammar.lark").decode(), parser="earley", propagate_positions=True)
+
+
+def resolve(code: str, name_resolver: NameResolver = None) -> Start:
+    """Parses code and runs the passes before code generation on it."""
+    ast = TreeTransformer().transform(parser().parse(code))
+    ast.accept(name_resolver if name_resolver is not None else NameResolver())
+    call_graph = CallGraph()
+    ast.accept(call_graph)
+    call_graph.analyse()
+    return ast
+
+
+def generate(code: str, layout: GlobalLayout = None, **arguments) -> CodeGenerator:
+    """Compiles code with a CodeGenerator created with the given arguments."""
+    ast = resolve(code)
+    if layout is not None:
+        ast.accept(layout)
+    generator = CodeGenerator(layout=layout, **arguments)
+    ast.accept(generator)
+    return generator
@@ -0,0 +1,62 @@
+import unittest
+
+from callgraph import CallGraph
+from test import resolve
+
+
+class CallGraphTest(unittest.TestCase):
+    def analyse(self, code: str) -> CallGraph:
+        call_graph = CallGraph()
+        resolve(code).accept(call_graph)
+        call_graph.analyse()
+        return call_graph
+
+    def testStaticLocals(self):
+        call_graph = self.analyse("""
+            namespace test;
+            function a() { int x = 1; run "function test:b"; }
+            function b() { int y = 2; }
+        """)
+        self.assertFalse(call_graph.functions["a"].recursive)
+        self.assertFalse(call_graph.functions["b"].recursive)
+        self.assertEqual(call_graph.report(), "a: static\nb: static")
+
+    def testRecursion(self):
+        call_graph = self.analyse("""
+            namespace test;
+            function a() { run "function test:a"; }
+            function b() { run "execute if entity @s run function test:c"; }
+            function c() { run "function test:b"; }
+            function d() { run "function test:b"; run "function other:d"; }
+        """)
+        self.assertTrue(call_graph.functions["a"].recursive)
+        self.assertTrue(call_graph.functions["b"].recursive)
+        self.assertTrue(call_graph.functions["c"].recursive)
+        self.assertFalse(call_graph.functions["d"].recursive)
+        self.assertIn(["b", "c"], call_graph.components)
+
+    def testFrameAddressing(self):
+        call_graph = self.analyse("""
+            namespace test;
+            function a() { run "function test:a"; }
+            function b() { run "tp @s ~ ~1 ~"; }
+            function c() {
+                run "function test:b";
+                run "function test:c";
+            }
+        """)
+        self.assertTrue(call_graph.functions["a"].runs_as_frame)
+        self.assertFalse(call_graph.functions["b"].runs_as_frame)
+        self.assertTrue(call_graph.functions["c"].recursive)
+        self.assertFalse(call_graph.functions["c"].runs_as_frame)
+
+    def testChatCommandsKeepExecutor(self):
+        call_graph = self.analyse("""
+            namespace test;
+            function a() { run "say hi"; run "function test:a"; }
+            function b() { run "execute if score x y matches 1 run tell @p hi"; run "function test:b"; }
+            function c() { run "tellraw @a \\"saying hi\\""; run "function test:c"; }
+        """)
+        self.assertFalse(call_graph.functions["a"].runs_as_frame)
+        self.assertFalse(call_graph.functions["b"].runs_as_frame)
+        self.assertTrue(call_graph.functions["c"].runs_as_frame)
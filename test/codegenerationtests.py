@@ -0,0 +1,511 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from codegeneration import CodeGenerator
+from constructs import FunctionDeclaration
+from exception import InvalidSlicedLoopException, InvalidReturnException, TypeMissmatchException, \
+    InvalidIndexException, DuplicateCaseException
+from test import resolve, generate
+from writer import DirectoryWriter, ZipWriter, PackWriter
+
+
+class MemoryWriter(PackWriter):
+    def __init__(self):
+        self.files = {}
+
+    def write(self, path: str, content: bytes):
+        self.files[path] = content
+
+    def close(self):
+        pass
+
+
+class CodeGenerationTest(unittest.TestCase):
+    def commands(self, generator: CodeGenerator, function_name: str):
+        return list(generator.functions[function_name].commands())
+
+    def testFusedIf(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            int b;
+            function f() {
+                if (a < b && a > 2) run "say yes";
+            }
+        """)
+        self.assertEqual(self.commands(generator, "f"), [
+            "execute if score global test.a < global test.b if score global test.a matches 3.. run say yes"
+        ])
+
+    def testIfElse(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            function f() {
+                if (!(a == 1)) run "say a";
+                else run "say b";
+            }
+        """)
+        self.assertEqual(self.commands(generator, "f"), [
+            "execute store success score #f mcfc.r0 unless score global test.a matches 1",
+            "execute unless score #f mcfc.r0 matches 0 run say a",
+            "execute if score #f mcfc.r0 matches 0 run say b",
+        ])
+
+    def testShortCircuit(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            boolean c;
+            function f() {
+                c = a < 5 || run "say side effect" == 1;
+            }
+        """)
+        self.assertEqual(self.commands(generator, "f"), [
+            "scoreboard players set #f mcfc.r0 1",
+            "execute unless score global test.a matches ..4 run function test:f.1",
+            "scoreboard players operation global test.c = #f mcfc.r0",
+        ])
+        self.assertEqual(self.commands(generator, "f.1"), [
+            "execute store result score #f mcfc.r1 run say side effect",
+            "execute store success score #f mcfc.r0 if score #f mcfc.r1 matches 1",
+        ])
+
+    def testWhileLoop(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            function f() {
+                while (a < 10) a = a + 1;
+            }
+        """)
+        self.assertEqual(self.commands(generator, "f"),
+                         ["execute if score global test.a matches ..9 run function test:f.1"])
+        self.assertEqual(self.commands(generator, "f.1")[-1],
+                         "execute if score global test.a matches ..9 run function test:f.1")
+
+    def testSlicedLoop(self):
+        generator = generate("""
+            namespace test;
+            function f() {
+                for (int i = 0; i < 1000; i = i + 1) sliced(50) run "time add 1";
+                run "weather clear";
+            }
+        """)
+        check = self.commands(generator, "f.1")
+        self.assertEqual(check[1], "execute if score #f mcfc.loop1 matches 0 run weather clear")
+        self.assertEqual(check[2], "execute unless score #f mcfc.loop1 matches 0 "
+                                   "if score #f mcfc.loop1.count matches 50.. run schedule function test:f.3 1t")
+        self.assertNotIn("weather clear", "\n".join(self.commands(generator, "f.body")))
+        # Calls while the loop is running would restart it
+        self.assertEqual(self.commands(generator, "f"),
+                         ["execute unless score #f mcfc.loop1 matches 1 run function test:f.body"])
+
+    def testContextDependentSlicedLoop(self):
+        for body in ['while (true) sliced(10) run "say step";',
+                     'while (true) sliced(10) run "time add 1"; run "tp @s ~ ~1 ~";',
+                     'while (true) sliced(10) g();',
+                     'while (true) sliced(10) run "function test:g";',
+                     'while (true) sliced(10) run "function other:f";']:
+            with self.assertRaisesRegex(InvalidSlicedLoopException, "depends on the executing entity"):
+                generate(f"""
+                    namespace test;
+                    function f() {{ {body} }}
+                    function g() {{ run "particle flame ~ ~ ~"; }}
+                """)
+        # Statements before the loop still run as the caller
+        generate("""
+            namespace test;
+            function f() { run "say start"; while (true) sliced(10) run "time add 1"; }
+        """)
+
+    def testSlicedLoopInRecursiveFunction(self):
+        self.assertRaises(InvalidSlicedLoopException, lambda: generate("""
+            namespace test;
+            function f() {
+                while (true) sliced(10) run "function test:f";
+            }
+        """))
+
+    def testEventDispatcher(self):
+        generator = generate("""
+            namespace test;
+            int a = 1;
+            function f() on minecraft:tick { run "say f"; }
+            function g() on minecraft:tick { run "say g"; }
+            function h() on minecraft:load { run "say h"; }
+        """)
+        self.assertEqual(generator.tags["minecraft:tick"], ["test:event.minecraft.tick"])
+        self.assertEqual(self.commands(generator, "event.minecraft.tick"), ["say f", "say g"])
+        self.assertEqual(generator.tags["minecraft:load"], ["test:event.minecraft.load"])
+        self.assertEqual(self.commands(generator, "event.minecraft.load")[-1], "say h")
+
+    def testBranchlessShortCircuit(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            boolean c;
+            function f() {
+                c = a < 5 && a + 1 > 2;
+                c = c || a == 3;
+            }
+        """)
+        self.assertEqual(self.commands(generator, "f"), [
+            "scoreboard players operation #f mcfc.r1 = global test.a",
+            "scoreboard players set #f mcfc.r2 1",
+            "scoreboard players operation #f mcfc.r1 += #f mcfc.r2",
+            "scoreboard players set #f mcfc.r0 0",
+            "execute if score global test.a matches ..4 if score #f mcfc.r1 matches 3.. "
+            "run scoreboard players set #f mcfc.r0 1",
+            "scoreboard players operation global test.c = #f mcfc.r0",
+            "scoreboard players operation #f mcfc.r0 = global test.c",
+            "execute if score #f mcfc.r0 matches 0 store success score #f mcfc.r0 if score global test.a matches 3",
+            "scoreboard players operation global test.c = #f mcfc.r0",
+        ])
+        self.assertEqual(list(generator.functions), ["f", "init"])
+
+    def testParallelWriting(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            function f() on minecraft:tick { while (a < 10) a = a + 1; }
+            function g() on minecraft:tick { if (a == 2) run "say g"; }
+        """)
+        with tempfile.TemporaryDirectory() as directory:
+            archives = []
+            for jobs in (1, 4):
+                path = Path(directory).joinpath(f"{jobs}.zip")
+                writer = ZipWriter(path)
+                generator.write_to_files(writer, jobs)
+                writer.close()
+                archives.append(path.read_bytes())
+            self.assertEqual(archives[0], archives[1])
+
+    def testBoundedSerialization(self):
+        functions = "\n".join(f'function f{index}() {{ run "say {index}"; }}' for index in range(50))
+        generator = generate(f"namespace test;\n{functions}")
+        submitted = []
+        function_path = generator.function_path
+        generator.function_path = lambda name: submitted.append(name) or function_path(name)
+        files = generator.serialize(jobs=4)
+        self.assertEqual(next(files)[0], "pack.mcmeta")
+        self.assertEqual(next(files), ("data/test/functions/f0.mcfunction", b"say 0\n"))
+        # Only a window of functions is handed to the workers ahead of the one that was written
+        self.assertLessEqual(len(submitted), 9)
+        # The other functions, the tags and the source map
+        self.assertEqual(len(list(files)), len(generator.functions) - 1 + len(generator.tags) + 1)
+
+    def testStreaming(self):
+        code = """
+            namespace test;
+            int a;
+            int[4] b;
+            function small() on minecraft:tick { a = a + 1; }
+            function large() on minecraft:tick {
+                int i = 0;
+                while (i < 4) {
+                    b[i] = helper(i);
+                    i = i + 1;
+                }
+                a = a * 2 + a / 3 - a % 5;
+            }
+            function helper(int x): int { return x * 2; }
+            function recursive(int x) on minecraft:load { if (x > 0) recursive(x - 1); }
+        """
+        # With positions and a source name, so the source maps contain locations
+        generator = CodeGenerator("test.mccode")
+        resolve(code).accept(generator)
+        files = dict(generator.serialize())
+        ast = resolve(code)
+        writer = MemoryWriter()
+        generator = CodeGenerator("test.mccode", stream=writer)
+        ast.accept(generator)
+        # Everything was written, except for the tags and the source map
+        self.assertEqual(generator.functions, {})
+        for path, content in generator.serialize():
+            writer.write(path, content)
+        source_map = json.loads(writer.files.pop("mcfc-sourcemap.json"))
+        self.assertEqual(source_map, json.loads(files.pop("mcfc-sourcemap.json")))
+        self.assertEqual(source_map["functions"]["test:small"]["lines"][0], [5, 54, "variable_ref", "small"])
+        self.assertEqual(writer.files, files)
+        # The dispatcher copies the small handler, which was kept, and calls the large one, which was written
+        self.assertEqual(files["data/test/functions/event.minecraft.tick.mcfunction"].decode().splitlines()[-1],
+                         "function test:large")
+        self.assertEqual(list(writer.files)[0], "pack.mcmeta")
+        # The bodies were released once their functions were written
+        for declaration in ast.children:
+            if isinstance(declaration, FunctionDeclaration):
+                self.assertEqual(declaration.block.statements, [])
+
+    def testFailedStreamingBuild(self):
+        code = """
+            namespace test;
+            int x;
+            function a() { x = 1; }
+            function b() { x = 2; }
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory)
+            writer = DirectoryWriter(output)
+            generator = CodeGenerator(stream=writer)
+            resolve(code).accept(generator)
+            generator.write_to_files(writer)
+            writer.close()
+            original = output.joinpath("data/test/functions/a.mcfunction").read_bytes()
+            # a is written before the error in b is found
+            writer = DirectoryWriter(output)
+            failing = code.replace("x = 1;", "x = 5;").replace("x = 2;", "while (x < 3) sliced(0) x = x + 1;")
+            self.assertRaises(InvalidSlicedLoopException, lambda: resolve(failing).accept(CodeGenerator(stream=writer)))
+            self.assertIn("5", output.joinpath("data/test/functions/a.mcfunction").read_text())
+
+            writer = DirectoryWriter(output)
+            generator = CodeGenerator(stream=writer)
+            resolve(code).accept(generator)
+            generator.write_to_files(writer)
+            writer.close()
+            self.assertEqual(output.joinpath("data/test/functions/a.mcfunction").read_bytes(), original)
+
+    def testProfileGuidedInlining(self):
+        code = """
+            namespace test;
+            int a;
+            function main() on minecraft:tick {
+                run "function test:step";
+                run "function test:loop";
+            }
+            function step() { a = a + 1; }
+            function loop() { if (a < 3) run "function test:loop"; }
+            function rare() on minecraft:tick {
+                run "say a";
+                run "say b";
+            }
+        """
+        self.assertEqual(self.commands(generate(code), "main"), ["function test:step", "function test:loop"])
+        self.assertEqual(self.commands(generate(code), "event.minecraft.tick"), [
+            "function test:step", "function test:loop", "say a", "say b"
+        ])
+        generator = generate(code, profile_counts={"test:main": 1000, "step": 1000, "loop": 3000, "test:rare": 0})
+        self.assertEqual(self.commands(generator, "main"), self.commands(generator, "step") + ["function test:loop"])
+        self.assertEqual(self.commands(generator, "event.minecraft.tick"),
+                         self.commands(generator, "main") + ["function test:rare"])
+
+    def testStaticCall(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            function f() { a = g(a, 2) + 1; }
+            function g(int x, int y): int { return x * y; }
+        """)
+        self.assertEqual(self.commands(generator, "f"), [
+            "scoreboard players operation #g test.x = global test.a",
+            "scoreboard players set #g test.y 2",
+            "function test:g",
+            "scoreboard players operation #f mcfc.r0 = #return mcfc.call",
+            "scoreboard players set #f mcfc.r1 1",
+            "scoreboard players operation #f mcfc.r0 += #f mcfc.r1",
+            "scoreboard players operation global test.a = #f mcfc.r0",
+        ])
+
+    def testReentrantCall(self):
+        generator = generate("""
+            namespace test;
+            function f(int n) { if (n > 0) f(n - 1); }
+        """)
+        self.assertEqual(self.commands(generator, "f.body")[0],
+                         "scoreboard players operation @s test.n = #arg0 mcfc.call")
+        self.assertIn("scoreboard players operation #arg0 mcfc.call = @s mcfc.r0", self.commands(generator, "f.1"))
+
+    def testInvalidCalls(self):
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            function f(int x) { f(true); }
+        """))
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            function f(int x) { f(); }
+        """))
+        self.assertRaises(InvalidReturnException, lambda: generate("""
+            namespace test;
+            function f(): int { return 1; run "say unreachable"; }
+        """))
+
+    def testVoidCalls(self):
+        code = """
+            namespace test;
+            int x;
+            function g() {{ x = x + 1; }}
+            function f(): int {{ {} }}
+        """
+        for body in ["int y = g(); return y;", "x = g(); return x;", "return g() + 1;", "return g();",
+                     "if (g() == 1) x = 2; return x;", "return abs(g());", "while (g()) x = 1; return x;"]:
+            with self.assertRaisesRegex(TypeMissmatchException, "Function 'g' doesn't return a value"):
+                generate(code.format(body))
+        # Where the value is discarded a call doesn't need one
+        generator = generate(code.format("g(); for (int i = 0; i < 2; g()) i = i + 1; return x;"))
+        self.assertIn("function test:g", self.commands(generator, "f"))
+
+    def testArrayAccess(self):
+        generator = generate("""
+            namespace test;
+            int[5] a;
+            int i;
+            function f() { a[2] = a[i]; }
+        """)
+        self.assertEqual(self.commands(generator, "f"), [
+            "scoreboard players operation #index mcfc.call = global test.i",
+            "function test:a.get",
+            "scoreboard players operation #f mcfc.r0 = #value mcfc.call",
+            "scoreboard players operation #2 test.a = #f mcfc.r0",
+        ])
+        self.assertEqual(self.commands(generator, "a.get"), [
+            "execute if score #index mcfc.call matches 0..1 run function test:a.get.0-1",
+            "execute if score #index mcfc.call matches 2..4 run function test:a.get.2-4",
+        ])
+        self.assertEqual(self.commands(generator, "a.get.0-1"), [
+            "execute if score #index mcfc.call matches 0 run scoreboard players operation #value mcfc.call = #0 test.a",
+            "execute if score #index mcfc.call matches 1 run scoreboard players operation #value mcfc.call = #1 test.a",
+        ])
+        # Only the dispatchers that are used are generated
+        self.assertNotIn("a.set", generator.functions)
+
+    def testInvalidArrays(self):
+        self.assertRaises(InvalidIndexException, lambda: generate("""
+            namespace test;
+            int[3] a;
+            function f() { a[3] = 1; }
+        """))
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            int[0] a;
+        """))
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            int[3] a;
+            int b;
+            function f() { b = a; }
+        """))
+
+    def testSwitch(self):
+        generator = generate("""
+            namespace test;
+            int x;
+            function f() {
+                switch (x) {
+                    case 1: case 2: run "say low";
+                    case 3: run "say low";
+                    case 5: run "say five"; run "say 5";
+                    case 8:
+                }
+            }
+            function g() {
+                switch (x) {
+                    case 2: run "say two";
+                    default: run "say other";
+                }
+            }
+        """)
+        # Identical cases and adjacent values are merged, empty cases are left out
+        self.assertEqual(self.commands(generator, "f"), [
+            "scoreboard players operation #f mcfc.r0 = global test.x",
+            "execute if score #f mcfc.r0 matches 1..3 run say low",
+            "execute if score #f mcfc.r0 matches 5 run function test:f.1",
+        ])
+        self.assertEqual(self.commands(generator, "g")[1:], [
+            "execute if score #g mcfc.r0 matches ..1 run say other",
+            "execute if score #g mcfc.r0 matches 2 run say two",
+            "execute if score #g mcfc.r0 matches 3.. run say other",
+        ])
+
+    def testSwitchTree(self):
+        generator = generate("""
+            namespace test;
+            int x;
+            function f() {
+                switch (x) {
+                    case 0: run "say 0";
+                    case 10: run "say 10";
+                    case 20: run "say 20";
+                    case 30: run "say 30";
+                    case 40: run "say 40";
+                    case 50: run "say 50";
+                }
+            }
+        """)
+        self.assertEqual(self.commands(generator, "f")[1:], [
+            "execute if score #f mcfc.r0 matches 0..20 run function test:f.1",
+            "execute if score #f mcfc.r0 matches 30..50 run function test:f.2",
+        ])
+        self.assertEqual(self.commands(generator, "f.1"), [
+            "execute if score #f mcfc.r0 matches 0 run say 0",
+            "execute if score #f mcfc.r0 matches 10 run say 10",
+            "execute if score #f mcfc.r0 matches 20 run say 20",
+        ])
+
+    def testInvalidSwitch(self):
+        self.assertRaises(DuplicateCaseException, lambda: generate("""
+            namespace test;
+            function f() { switch (1) { case 1: run "say a"; case 1: run "say b"; } }
+        """))
+        self.assertRaises(DuplicateCaseException, lambda: generate("""
+            namespace test;
+            function f() { switch (1) { default: run "say a"; default: run "say b"; } }
+        """))
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            function f() { switch (true) { case 1: run "say a"; } }
+        """))
+
+    def testIntrinsics(self):
+        generator = generate("""
+            namespace test;
+            int a;
+            int b;
+            int c;
+            function f() { c = min(a, b); }
+            function g() { c = max(3, a); }
+            function h() { c = abs(a); }
+            function i() { c = clamp(a, 0, b); }
+            function j() { swap(a, b); }
+            function k() { for (swap(a, b); a < b; swap(a, b)) swap(a, c); }
+        """)
+        self.assertEqual(self.commands(generator, "f"), [
+            "scoreboard players operation #f mcfc.r0 = global test.a",
+            "scoreboard players operation #f mcfc.r0 < global test.b",
+            "scoreboard players operation global test.c = #f mcfc.r0",
+        ])
+        self.assertEqual(self.commands(generator, "g")[1], "execute if score #g mcfc.r0 matches ..2 run "
+                                                           "scoreboard players set #g mcfc.r0 3")
+        self.assertEqual(self.commands(generator, "j"), ["scoreboard players operation global test.a >< global test.b"])
+        # Each command is a single native operation, none needs a helper function
+        self.assertEqual({name: len(self.commands(generator, name)) for name in "fghij"},
+                         {"f": 3, "g": 3, "h": 4, "i": 4, "j": 1})
+        # Swap has no value, so no register is left behind for the condition
+        self.assertEqual(self.commands(generator, "k")[1], "execute if score global test.a < global test.b "
+                                                           "run function test:k.1")
+        self.assertEqual(set(generator.functions), {"init", "f", "g", "h", "i", "j", "k", "k.1"})
+
+    def testInvalidIntrinsics(self):
+        for body in ["a = swap(a, b);", "int c = swap(a, b);", "a = swap(a, b) + 1;", "if (swap(a, b)) a = 1;",
+                     "run \"say a\"; return swap(a, b);", "a = abs(swap(a, b));"]:
+            with self.assertRaisesRegex(TypeMissmatchException, "Intrinsic 'swap' doesn't return a value"):
+                generate(f"""
+                    namespace test;
+                    int a;
+                    int b;
+                    function f() {{ {body} }}
+                """)
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            function f() { int a = min(1); }
+        """))
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            int a;
+            function f() { swap(a, 2); }
+        """))
+        self.assertRaises(TypeMissmatchException, lambda: generate("""
+            namespace test;
+            function f() { int a = max(1, true); }
+        """))
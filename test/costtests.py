@@ -0,0 +1,47 @@
+import math
+import unittest
+
+from cost import CostModel
+from test import generate
+
+
+class CostTest(unittest.TestCase):
+    def cost_model(self, code: str) -> CostModel:
+        generator = generate(code)
+        return CostModel(generator.namespace_, generator.functions, generator.events)
+
+    def testBranchBounds(self):
+        cost_model = self.cost_model("""
+            namespace test;
+            int a;
+            function f() on minecraft:tick {
+                if (a > 1) {
+                    run "say a";
+                    run "say b";
+                }
+                run "function test:g";
+            }
+            function g() {
+                run "say g";
+            }
+        """)
+        cost = cost_model.function_cost("f")
+        self.assertEqual((cost.min_commands, cost.max_commands), (3, 5))
+        self.assertEqual(cost_model.warnings(tick_budget=4), [
+            "Tick functions can execute 5 commands per tick, more than the budget of 4"
+        ])
+        self.assertEqual(cost_model.warnings(max_command_chain_length=4), [
+            "Tick function 'test:f' can execute 5 commands, more than maxCommandChainLength (4)"
+        ])
+
+    def testRecursion(self):
+        cost_model = self.cost_model("""
+            namespace test;
+            function f() on minecraft:tick {
+                run "function test:f";
+            }
+        """)
+        cost = cost_model.function_cost("f")
+        self.assertEqual(cost.max_commands, math.inf)
+        self.assertGreater(cost.max_selectors, 0)
+        self.assertEqual(cost_model.warnings(), ["Tick function 'test:f' can execute an unbounded number of commands"])
@@ -0,0 +1,66 @@
+import unittest
+
+from constructs import Namespace, NamespaceReference
+from encoding import OperandTable, EncodedCode
+from instructions import StoreInstruction, RunInstruction, AddConstantInstruction, ConditionalInstruction, \
+    ScoreMatchesCondition, ScoreComparisonCondition, StoreConditionInstruction, StoreResultInstruction, \
+    CallInstruction, ScheduleInstruction, CallInStackFrameInstruction, SummonStackFrameInstruction, \
+    KillStackFrameInstruction, SwapInstruction
+from sourcemap import SourceLocation
+from symboltable import GlobalScope, BlockScope, IntType
+
+
+class EncodingTest(unittest.TestCase):
+    def setUp(self):
+        self.namespace = Namespace(NamespaceReference("test"))
+        self.namespace.name = "test"
+        self.a = GlobalScope.GlobalVariable(self.namespace, "a", IntType())
+        function_ = GlobalScope.GlobalFunction(self.namespace, "f")
+        function_.recursive = True
+        self.x = BlockScope.LocalVariable(self.namespace, "x", IntType(), function_)
+
+    def testCommands(self):
+        matches = ScoreMatchesCondition(self.a, "1..")
+        comparison = ScoreComparisonCondition(self.a, "<", self.x, True)
+        instructions = [
+            StoreInstruction(self.a, self.x),
+            RunInstruction("say {\"text\": 1}"),
+            AddConstantInstruction(self.x, -1),
+            SwapInstruction(self.a, self.x),
+            StoreConditionInstruction(self.a, comparison),
+            StoreResultInstruction(self.x, "time query gametime"),
+            ConditionalInstruction([matches], CallInstruction(self.namespace, "g")),
+            ConditionalInstruction([matches, comparison], ScheduleInstruction(self.namespace, "g", 1)),
+            ConditionalInstruction([comparison], StoreConditionInstruction(self.x, matches)),
+            ConditionalInstruction([matches], ConditionalInstruction([comparison], RunInstruction("say hi"))),
+            ConditionalInstruction([], CallInStackFrameInstruction(self.namespace, "g")),
+            ConditionalInstruction([matches], CallInStackFrameInstruction(self.namespace, "g")),
+            SummonStackFrameInstruction(),
+            KillStackFrameInstruction(),
+        ]
+        code = EncodedCode(OperandTable(), instructions)
+        self.assertEqual(len(code), len(instructions))
+        self.assertEqual(list(code.commands()), [instruction.to_string() for instruction in instructions])
+        self.assertEqual(code.command(-1), instructions[-1].to_string())
+
+    def testCallsAndCopies(self):
+        location = SourceLocation(3, 5, "call", "f")
+        call = ConditionalInstruction([ScoreMatchesCondition(self.a, "0")], CallInstruction(self.namespace, "g"))
+        call.source_location = location
+        operands = OperandTable()
+        code = EncodedCode(operands, [RunInstruction("say hi"), call])
+        self.assertIsNone(code.callee(0))
+        self.assertEqual(code.callee(1), ("test", "g"))
+        self.assertFalse(code.is_conditional(0))
+        self.assertTrue(code.is_conditional(1))
+        self.assertEqual(code.operand(0), "say hi")
+        self.assertEqual(code.source_locations(), [None, location])
+
+        copy = EncodedCode(operands)
+        copy.copy(code, 1)
+        copy.append(RunInstruction("say hi"))
+        self.assertEqual(list(copy.commands()), ["execute if score global test.a matches 0 run function test:g",
+                                                 "say hi"])
+        self.assertIs(copy.location(0), location)
+        # Operands are shared, not stored again
+        self.assertEqual(operands.strings.count("say hi"), 1)
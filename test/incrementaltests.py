@@ -0,0 +1,69 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from codegeneration import CodeGenerator
+from incremental import BuildCache
+from test import resolve
+from visitor import NameResolver
+
+CODE = """namespace test;
+int a;
+function f() on minecraft:tick {
+    while (a < 10) a = a + 1;
+}
+function g() {
+    if (a == 2) run "say g";
+    else run "function test:f";
+}
+"""
+
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = Path(self.directory.name).joinpath("cache.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def build(self, code: str, cache_path=None):
+        cache = BuildCache(cache_path, code)
+        name_resolver = NameResolver(cache)
+        ast = resolve(code, name_resolver)
+        name_resolver.resolve_changed_storage()
+        generator = CodeGenerator("test.mccode", cache=cache)
+        ast.accept(generator)
+        cache.write()
+        reused = [declaration.reference.name for declaration in name_resolver.cached_declarations]
+        return dict(generator.serialize()), reused
+
+    def testDependencies(self):
+        ast = resolve(CODE)
+        f, g = [child for child in ast.children if child.construct_name == "function_declaration"]
+        self.assertEqual(f.dependencies.globals_read, {"a"})
+        self.assertEqual(f.dependencies.globals_written, {"a"})
+        self.assertEqual(g.dependencies.globals_written, set())
+        self.assertEqual(g.dependencies.functions_called, {"f"})
+        self.assertEqual(f.environment["globals"], {"a": "int"})
+
+    def testUnchangedFunctionsAreReused(self):
+        self.build(CODE, self.cache_path)
+        edited = CODE.replace("int a;", "int a;\nint b;").replace('"say g"', '"say edited"')
+        files, reused = self.build(edited, self.cache_path)
+        clean, _ = self.build(edited)
+        self.assertEqual(reused, ["f"])
+        self.assertEqual(files, clean)
+
+    def testChangedDependencies(self):
+        self.build(CODE, self.cache_path)
+        _, reused = self.build(CODE.replace("int a;", "int b;\nint a;"), self.cache_path)
+        self.assertEqual(reused, ["f", "g"])
+        recursive = CODE.replace("a = a + 1;", "a = a + 1;\n    run \"function test:g\";")
+        self.build(recursive, self.cache_path)
+        # f no longer needs a stack frame although its text didn't change
+        edited = recursive.replace('run "function test:f"', 'run "say f"')
+        files, reused = self.build(edited, self.cache_path)
+        clean, _ = self.build(edited)
+        self.assertEqual(reused, [])
+        self.assertEqual(files, clean)
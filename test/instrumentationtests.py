@@ -0,0 +1,29 @@
+import json
+import unittest
+
+from instrumentation import PhaseTimer
+
+
+class PhaseTimerTest(unittest.TestCase):
+    def testPhases(self):
+        timer = PhaseTimer()
+        timer.start()
+        with timer.phase("allocate"):
+            data = [bytearray(1024) for _ in range(1024)]
+        with timer.phase("free"):
+            del data
+        timer.stop()
+        report = json.loads(timer.report_json())
+        self.assertEqual([phase["name"] for phase in report["phases"]], ["allocate", "free"])
+        self.assertGreater(report["phases"][0]["peak_memory"], 1024 * 1024)
+        self.assertGreater(report["phases"][0]["allocated_memory"], 1024 * 1024)
+        self.assertLess(report["phases"][1]["allocated_memory"], -1024 * 1024)
+        self.assertIn("allocate", timer.report())
+
+    def testDisabled(self):
+        timer = PhaseTimer(False)
+        timer.start()
+        with timer.phase("parse"):
+            pass
+        timer.stop()
+        self.assertEqual(timer.phases, [])
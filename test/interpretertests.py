@@ -0,0 +1,213 @@
+import unittest
+
+from interpreter import Interpreter
+from test import generate
+
+
+class InterpreterTest(unittest.TestCase):
+    def run_pack(self, code: str, *functions: str) -> Interpreter:
+        interpreter = Interpreter()
+        interpreter.load_files(generate(code).serialize())
+        interpreter.load()
+        for function in functions:
+            interpreter.run_function(function)
+        return interpreter
+
+    def testArithmetic(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int a = 7;
+            int b;
+            boolean c;
+            function f() {
+                b = (a * 3 - 1) / 4 % 3;
+                c = a > 5 && !(b == 2);
+                if (c) run "say c"; else run "say not c";
+            }
+        """, "test:f")
+        self.assertEqual(interpreter.get_score("global", "test.b"), 2)
+        self.assertEqual(interpreter.get_score("global", "test.c"), 0)
+        self.assertEqual(interpreter.output, ["say not c"])
+
+    def testLoop(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int sum;
+            function f() {
+                for (int i = 1; i <= 10; i = i + 1) sum = sum + i;
+            }
+        """, "test:f")
+        self.assertEqual(interpreter.get_score("global", "test.sum"), 55)
+        self.assertEqual(interpreter.calls["test:f.1"], 10)
+
+    def testRecursionUsesStackFrames(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int n = 3;
+            int calls;
+            function f() {
+                int x = n;
+                n = n - 1;
+                calls = calls + 1;
+                if (x > 0) run "function test:f";
+                n = x;
+            }
+        """, "test:f")
+        self.assertEqual(interpreter.get_score("global", "test.calls"), 4)
+        self.assertEqual(interpreter.get_score("global", "test.n"), 3)
+        self.assertEqual(interpreter.entities, [])
+        self.assertGreater(interpreter.selectors, 0)
+
+    def testFunctionCalls(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int result;
+            int total;
+            function fact(int n): int {
+                int r = 1;
+                if (n > 1) r = n * fact(n - 1);
+                return r;
+            }
+            function add(int a, int b): int { return a + b; }
+            function main() {
+                result = fact(5);
+                total = add(add(1, 2), add(result, 4));
+            }
+        """, "test:main")
+        self.assertEqual(interpreter.get_score("global", "test.result"), 120)
+        self.assertEqual(interpreter.get_score("global", "test.total"), 127)
+        self.assertEqual(interpreter.entities, [])
+        self.assertEqual(interpreter.calls["test:fact"], 5)
+
+    def testArrays(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int[64] squares;
+            int sum;
+            int value;
+            function fill() {
+                for (int i = 0; i < 64; i = i + 1) squares[i] = i * i;
+                int[3] local;
+                for (int i = 0; i < 3; i = i + 1) local[i] = squares[i + 10];
+                sum = local[0] + local[1] + local[2];
+            }
+            function read() { value = squares[sum % 64]; }
+        """, "test:fill")
+        self.assertEqual(interpreter.get_score("#9", "test.squares"), 81)
+        self.assertEqual(interpreter.get_score("global", "test.sum"), 100 + 121 + 144)
+        commands = interpreter.commands
+        interpreter.run_function("test:read")
+        self.assertEqual(interpreter.get_score("global", "test.value"), 45 * 45)
+        # A binary search over 64 elements: two commands per level down to a pair and one store
+        self.assertLessEqual(interpreter.commands - commands, 2 * 6 + 10)
+
+    def testNestedArrayIndex(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int[4] a;
+            int[4] b;
+            int k = 2;
+            function f() {
+                b[2] = 3;
+                a[b[k]] = 5;
+                a[b[k] - 1] = a[b[k]] + 1;
+            }
+        """, "test:f")
+        self.assertEqual(interpreter.get_score("#3", "test.a"), 5)
+        self.assertEqual(interpreter.get_score("#2", "test.a"), 6)
+        self.assertEqual(interpreter.get_score("#2", "test.b"), 3)
+
+    def testSwitch(self):
+        cases = "\n".join(f"case {value}: result = {value * 2};" for value in range(0, 256, 4))
+        code = f"""
+            namespace test;
+            int x;
+            int result;
+            function f() {{
+                switch (x) {{
+                    {cases}
+                    case -5: case -4: result = -1;
+                    default: result = 1000 + x;
+                }}
+            }}
+        """
+        interpreter = self.run_pack(code)
+        for value, expected in [(0, 0), (4, 8), (252, 504), (3, 1003), (-4, -1), (-6, 994), (300, 1300)]:
+            interpreter.set_score("global", "test.x", value)
+            commands = interpreter.commands
+            interpreter.run_function("test:f")
+            self.assertEqual(interpreter.get_score("global", "test.result"), expected)
+            # 130 ranges, a chain of tests would run up to 130 commands
+            self.assertLessEqual(interpreter.commands - commands, 20)
+
+    def testStackedSwitchLabels(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int x;
+            int y;
+            function f() {
+                switch (x) {
+                    case 0: y = 2;
+                    case 1: case 2: case 3: y = 3;
+                    case 4: {}
+                    default: y = 4;
+                    case 5: case 6:
+                }
+            }
+        """)
+        for value, expected in [(0, 2), (1, 3), (2, 3), (3, 3), (4, 0), (5, 0), (6, 0), (7, 4), (-1, 4)]:
+            interpreter.set_score("global", "test.x", value)
+            interpreter.set_score("global", "test.y", 0)
+            interpreter.run_function("test:f")
+            self.assertEqual(interpreter.get_score("global", "test.y"), expected)
+
+    def testIntrinsics(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int a = -7;
+            int b = 4;
+            int low;
+            int high;
+            int distance;
+            int clamped;
+            function f() {
+                low = min(a, b);
+                high = max(a * 2, b);
+                distance = abs(a) + abs(b);
+                clamped = clamp(a, -2, b) + clamp(b * 3, 0, 10);
+                swap(a, b);
+            }
+        """, "test:f")
+        self.assertEqual([interpreter.get_score("global", f"test.{name}")
+                          for name in ("low", "high", "distance", "clamped", "a", "b")], [-7, 4, 11, 8, 4, -7])
+
+    def testSlicedLoop(self):
+        interpreter = self.run_pack("""
+            namespace test;
+            int sum;
+            int done;
+            function f() {
+                for (int i = 0; i < 10; i = i + 1) sliced(4) sum = sum + 1;
+                done = done + 1;
+            }
+        """, "test:f")
+        self.assertEqual(interpreter.get_score("global", "test.sum"), 4)
+        # Ignored while the loop is running, instead of starting it over
+        interpreter.run_function("test:f")
+        self.assertEqual(interpreter.get_score("global", "test.sum"), 4)
+        interpreter.tick()
+        interpreter.tick()
+        self.assertEqual(interpreter.get_score("global", "test.sum"), 10)
+        self.assertEqual(interpreter.get_score("global", "test.done"), 1)
+        # Once it's done, the function can run again
+        interpreter.run_function("test:f")
+        self.assertEqual(interpreter.get_score("global", "test.sum"), 14)
+
+    def testCommandChainLimit(self):
+        interpreter = Interpreter(max_command_chain_length=100)
+        interpreter.load_files([("data/test/functions/loop.mcfunction", b"scoreboard players add x test 1\n"
+                                                                        b"function test:loop\n")])
+        interpreter.run_function("test:loop")
+        self.assertTrue(interpreter.chain_limit_reached)
+        self.assertEqual(interpreter.commands, 100)
+        self.assertEqual(interpreter.get_score("x", "test"), 50)
@@ -0,0 +1,57 @@
+import unittest
+
+from codegeneration import CodeGenerator
+from interpreter import Interpreter
+from layout import GlobalLayout, PACKED
+from test import generate
+
+CODE = """
+    namespace test;
+    int a = 2;
+    int b;
+    boolean c;
+    function f() on minecraft:tick {
+        b = a * 3;
+        c = b > 5;
+    }
+"""
+
+
+class GlobalLayoutTest(unittest.TestCase):
+    def generate(self, code: str, mode: str) -> CodeGenerator:
+        self.layout = GlobalLayout(mode)
+        return generate(code, self.layout)
+
+    def testSeparateLayout(self):
+        generator = self.generate(CODE, "separate")
+        self.assertEqual(list(self.layout.objectives), ["test.a", "test.b", "test.c"])
+        self.assertEqual(generator.functions["init"].command(-1),
+                         "scoreboard players operation global test.a = #init mcfc.r0")
+
+    def testPackedLayout(self):
+        generator = self.generate(CODE, PACKED)
+        self.assertEqual(self.layout.report(), "2 objectives for 3 globals (packed layout)\n"
+                                               "test.g.i: a, b\n"
+                                               "test.g.b: c")
+        self.assertEqual(list(generator.functions["init"].commands()), [
+            "scoreboard objectives add test.g.i dummy",
+            "scoreboard objectives add test.g.b dummy",
+            "scoreboard players set #init mcfc.r0 2",
+            "scoreboard players operation #a test.g.i = #init mcfc.r0",
+        ])
+        self.assertEqual(generator.tags["minecraft:load"], ["test:init"])
+        interpreter = Interpreter()
+        interpreter.load_files(generator.serialize())
+        interpreter.load()
+        interpreter.tick()
+        self.assertEqual(interpreter.objectives, {"test.g.i", "test.g.b"})
+        self.assertEqual(interpreter.get_score("#b", "test.g.i"), 6)
+        self.assertEqual(interpreter.get_score("#c", "test.g.b"), 1)
+
+    def testLongNamespaceObjectives(self):
+        self.generate(CODE.replace("namespace test;", "namespace very_long_namespace;"), PACKED)
+        objectives = list(self.layout.objectives)
+        self.assertEqual(len(objectives), 2)
+        self.assertTrue(all(len(objective) <= 16 for objective in objectives))
+        self.assertTrue(objectives[0].endswith(".g.i"))
+        self.assertTrue(objectives[1].endswith(".g.b"))
@@ -0,0 +1,52 @@
+import unittest
+
+from codegeneration import CodeGenerator
+from sourcemap import SourceMap, ProfileReport
+from test import generate
+
+
+class SourceMapTest(unittest.TestCase):
+    def generate(self, code: str) -> CodeGenerator:
+        return generate(code, source_name="test.mccode")
+
+    def testLocations(self):
+        generator = self.generate("""namespace test;
+int a = 2;
+function f() {
+    while (a < 10)
+        a = a + 1;
+    run "say done";
+}
+""")
+        source_map = SourceMap.from_json(generator.source_map().to_json())
+        self.assertEqual(source_map.source, "test.mccode")
+        origin = source_map.origins["test:f.1"]
+        self.assertEqual((origin.line, origin.construct, origin.function), (4, "while_statement", "f"))
+        self.assertEqual(source_map.location("test:f.1", 1).line, 5)
+        self.assertEqual(source_map.location("test:f", 2).line, 6)
+        self.assertEqual(source_map.location("test:init", 1).line, 2)
+        self.assertIsNone(source_map.location("test:f", 3))
+
+    def testProfileReport(self):
+        generator = self.generate("""namespace test;
+int a;
+function f() {
+    while (a < 10)
+        a = a + 1;
+    run "say done";
+}
+""")
+        report = ProfileReport(generator.source_map())
+        report.index_commands({f"test:{name}": list(code.commands())
+                               for name, code in generator.functions.items()})
+        report.read("""[00] tick(100/1) - 100.00%/100.00%
+[01] |   functions(100/1) - 60.00%/60.00%
+[02] |   |   function test:f.1(1000/10) - 50.00%/30.00%
+[03] |   |   |   scoreboard players operation global test.a = #f mcfc.r0(1000/10) - 50.00%/15.00%
+[02] |   |   say done(100/1) - 10.00%/6.00%
+[01] |   |   levels(100/1) - 40.00%/40.00%
+""")
+        self.assertAlmostEqual(report.functions["f"][0], 36.0)
+        self.assertAlmostEqual(report.lines[("f", 4)][0], 15.0)
+        self.assertAlmostEqual(report.lines[("f", 5)][0], 15.0)
+        self.assertAlmostEqual(report.lines[("f", 6)][0], 6.0)
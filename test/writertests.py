@@ -0,0 +1,100 @@
+import os
+import stat
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from writer import DirectoryWriter, ZipWriter, MANIFEST_NAME
+
+
+class DirectoryWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temporary_directory.name)
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def build(self, files):
+        writer = DirectoryWriter(self.directory)
+        for path, content in files.items():
+            writer.write(path, content)
+        writer.close()
+        return writer
+
+    def testIncrementalBuild(self):
+        self.build({"pack.mcmeta": b"{}", "data/test/functions/a.mcfunction": b"say a\n",
+                    "data/test/functions/b.mcfunction": b"say b\n"})
+        unchanged = self.directory.joinpath("data/test/functions/a.mcfunction")
+        modification_time = unchanged.stat().st_mtime_ns
+        self.directory.joinpath("user.txt").write_text("not generated")
+
+        writer = self.build({"pack.mcmeta": b"{}", "data/test/functions/a.mcfunction": b"say a\n",
+                             "data/test/functions/c.mcfunction": b"say c\n"})
+
+        self.assertEqual((writer.written, writer.unchanged, writer.deleted), (1, 2, 1))
+        self.assertEqual(unchanged.stat().st_mtime_ns, modification_time)
+        self.assertFalse(self.directory.joinpath("data/test/functions/b.mcfunction").exists())
+        self.assertEqual(self.directory.joinpath("data/test/functions/c.mcfunction").read_bytes(), b"say c\n")
+        self.assertTrue(self.directory.joinpath("user.txt").exists())
+
+    def testRemovesEmptyDirectories(self):
+        self.build({"data/other/tags/functions/x.json": b"{}"})
+        self.build({})
+        self.assertFalse(self.directory.joinpath("data").exists())
+
+    def testFileModes(self):
+        umask = os.umask(0o027)
+        try:
+            self.build({"data/test/functions/a.mcfunction": b"say a\n"})
+        finally:
+            os.umask(umask)
+        for path in ["data/test/functions/a.mcfunction", MANIFEST_NAME]:
+            self.assertEqual(stat.S_IMODE(self.directory.joinpath(path).stat().st_mode), 0o640)
+
+
+class ZipWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.directory = Path(self.temporary_directory.name)
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def build(self, name, files):
+        path = self.directory.joinpath(name)
+        writer = ZipWriter(path)
+        for file_path, content in files.items():
+            writer.write(file_path, content)
+        writer.close()
+        return path
+
+    def testReproducibleArchive(self):
+        files = {"pack.mcmeta": b"{}", "data/test/functions/a.mcfunction": b"say a\n",
+                 "data/minecraft/tags/functions/tick.json": b"{}"}
+        first = self.build("first.zip", files)
+        second = self.build("second.zip", files)
+        self.assertEqual(first.read_bytes(), second.read_bytes())
+        with zipfile.ZipFile(first) as archive:
+            self.assertEqual(archive.namelist(), list(files))
+            self.assertEqual(archive.read("data/test/functions/a.mcfunction"), b"say a\n")
+        self.assertEqual(sorted(path.name for path in self.directory.iterdir()), ["first.zip", "second.zip"])
+
+    def testFileMode(self):
+        umask = os.umask(0o027)
+        try:
+            path = self.build("pack.zip", {"pack.mcmeta": b"{}"})
+        finally:
+            os.umask(umask)
+        self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o640)
+
+    def testAbort(self):
+        path = self.directory.joinpath("pack.zip")
+        path.write_bytes(b"previous")
+        writer = ZipWriter(path)
+        writer.write("pack.mcmeta", b"{}")
+        writer.abort()
+        # The unfinished archive is deleted and the previous one is left alone
+        self.assertEqual(list(self.directory.iterdir()), [path])
+        self.assertEqual(path.read_bytes(), b"previous")